@@ -0,0 +1,39 @@
+"""
+atomic
+======
+
+Atomic file writes: files are written under a temporary name alongside
+their destination and then renamed over it, so that a crash never leaves
+a partial file behind, and readers only ever see a complete file.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def atomic_write(path, mode="w", opener=open, **kwargs):
+    """Open a file for writing, which replaces :obj:`path` once the block
+    completes without error. On error, :obj:`path` is left untouched.
+
+    Args:
+        path (str): The file to write, whose parent directories are created.
+        mode (str): Mode in which to open the file, e.g. "w", "wb" or "wt".
+        opener (callable): Function to open the file, e.g. :obj:`gzip.open`.
+        kwargs: Any other arguments to pass to :obj:`opener`, e.g. :obj:`encoding`.
+    Yields:
+        The open (temporary) file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer, so that concurrent writes of the same file don't collide
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with opener(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,222 @@
+"""
+cache
+=====
+
+A persistent store of geocoding results, including negative results (i.e.
+queries with no match), so that repeated pipelines reuse previous lookups
+rather than querying the geocoder again.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from nesta_daps.common.lru import SQLiteLRU
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    result TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS geocodes_accessed ON geocodes (accessed);
+"""
+MISS_TTL = 30 * 24 * 60 * 60  # places appear in OSM over time, so retry misses
+MISSING = object()  # Not in the cache, where `None` is a cached negative result
+
+
+def make_key(query):
+    """Generate a stable key for a query.
+
+    Args:
+        query: Any JSON-serialisable value, e.g. normalised query parameters.
+    Returns:
+        (str): SHA-256 hex digest of the query.
+    """
+    return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+
+class GeocodeCache:
+    """SQLite-backed store of geocoding results, with separate expiry of
+    results and of negative results, and eviction of the least recently
+    accessed entries. Safe to share between threads.
+
+    With :obj:`warm_start`, all live entries are loaded into memory up front,
+    so that lookups don't touch the database (and their access times are
+    written back on :obj:`close`).
+
+    Args:
+        path (str): Path to the SQLite database file, by default in memory.
+        ttl (float): Seconds after which a result expires (`None` for never).
+        miss_ttl (float): Seconds after which a negative result expires
+                          (`None` for never).
+        max_entries (int): Maximum number of entries, beyond which entries are
+                           evicted (`None` for unbounded).
+        warm_start (bool): Whether to load all entries into memory up front.
+    """
+
+    def __init__(
+        self,
+        path=":memory:",
+        ttl=None,
+        miss_ttl=MISS_TTL,
+        max_entries=None,
+        warm_start=False,
+    ):
+        self.path = str(path)
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._memory = None
+        self._accessed = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lru = SQLiteLRU(self._conn, "geocodes", max_entries)
+        if warm_start:
+            self.warm()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups answered from the cache, including negative results."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """Lookup statistics of this instance.
+
+        Returns:
+            (dict): Hits, negative hits, misses, hit rate and number of entries.
+        """
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self),
+        }
+
+    def _expired(self, result, created, now):
+        ttl = self.ttl if result is not None else self.miss_ttl
+        return ttl is not None and now - created > ttl
+
+    def warm(self):
+        """Load all live entries into memory, dropping any expired ones."""
+        now = time.time()
+        memory, expired = {}, []
+        with self._lock:
+            for key, result, created in self._conn.execute(
+                "SELECT key, result, created FROM geocodes"
+            ):
+                if self._expired(result, created, now):
+                    expired.append((key,))
+                else:
+                    memory[key] = (result, created)
+            self._conn.executemany("DELETE FROM geocodes WHERE key = ?", expired)
+            self._lru.removed(len(expired))
+            self._memory = memory
+
+    def get(self, query):
+        """Retrieve a cached result.
+
+        Args:
+            query: The (normalised) query, see :obj:`make_key`.
+        Returns:
+            The result, `None` for a negative result, or :obj:`MISSING`
+            if not cached or expired.
+        """
+        key = make_key(query)
+        now = time.time()
+        with self._lock:
+            if self._memory is not None:
+                entry = self._memory.get(key)
+            else:
+                entry = self._conn.execute(
+                    "SELECT result, created FROM geocodes WHERE key = ?", (key,)
+                ).fetchone()
+            if entry is not None and self._expired(*entry, now):
+                self._delete([key])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            result, _ = entry
+            if self._memory is not None:
+                self._accessed[key] = now
+            else:
+                self._conn.execute(
+                    "UPDATE geocodes SET accessed = ? WHERE key = ?", (now, key)
+                )
+            if result is None:
+                self.negative_hits += 1
+                return None
+            self.hits += 1
+        return json.loads(result)
+
+    def put(self, query, result):
+        """Store a result, evicting old entries if over capacity.
+
+        Args:
+            query: The (normalised) query, see :obj:`make_key`.
+            result: Any JSON-serialisable result, or `None` for a negative result.
+        """
+        key = make_key(query)
+        value = None if result is None else json.dumps(result)
+        now = time.time()
+        with self._lock:
+            self._lru.removed(self._lru.weigh(key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(query), value, now, now),
+            )
+            self._lru.added()
+            if self._memory is not None:
+                self._memory[key] = (value, now)
+            self._evict()
+
+    def _delete(self, keys):
+        self._conn.executemany(
+            "DELETE FROM geocodes WHERE key = ?", [(k,) for k in keys]
+        )
+        self._lru.removed(len(keys))
+        self._forget(keys)
+
+    def _forget(self, keys):
+        if self._memory is not None:
+            for key in keys:
+                self._memory.pop(key, None)
+                self._accessed.pop(key, None)
+
+    def _flush_accessed(self):
+        self._conn.executemany(
+            "UPDATE geocodes SET accessed = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._accessed.items()],
+        )
+        self._accessed = {}
+
+    def _evict(self):
+        """Delete the least recently accessed entries until under :obj:`max_entries`"""
+        if not self._lru.over_limit:
+            return
+        self._flush_accessed()
+        self._forget(self._lru.evict())
+
+    def close(self):
+        """Write back any access times, and close the underlying database connection."""
+        with self._lock:
+            self._flush_accessed()
+            self._conn.close()
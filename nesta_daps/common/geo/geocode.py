@@ -2,78 +2,273 @@
 geocode
 =======
 
-Tools for geocoding.
+Tools for geocoding. Queries are answered by a :obj:`GeocoderBackend`, which
+by default is the public Open Street Map Nominatim API, but which can be
+replaced (globally with :obj:`set_backend`, or per call) with a self-hosted
+Nominatim instance, an offline gazetteer or an in-process fake.
 """
 
+import abc
+import csv
 import logging
-from functools import cache
+import threading
+import zlib
+from functools import partial
 
+import numpy as np
 import pandas as pd
 
-import ratelimit
+from nesta_daps.common.geo.cache import MISSING
+from nesta_daps.common.geo.cache import GeocodeCache
+from nesta_daps.common.http.retry import url_host
+from nesta_daps.common.http.retry import with_retries
+from nesta_daps.common.http.session import get_session
+from nesta_daps.common.http.throttle import RateLimiter
 
-import requests
+NOMINATIM_HOST = "nominatim.openstreetmap.org"
+NOMINATIM_URL = f"https://{NOMINATIM_HOST}/search"
+QUERY_FIELDS = ["street", "city", "county", "state", "country", "postalcode"]
 
-from retrying import retry
+_BACKEND = None
+_LOCK = threading.Lock()
+# Results of `geocode`, by backend and query, see `set_geocode_cache`
+GEOCODE_CACHE = GeocodeCache()
 
 
-@cache
-def geocode(**request_kwargs):
+def query_key(**query):
+    """Normalise a geocoding query for exact matching, i.e. case-folded values
+    with collapsed whitespace (and "+" as a space in :obj:`q`), ignoring the
+    response format.
+
+    Args:
+        query (dict): Query parameters, as for :obj:`geocode`.
+    Returns:
+        (tuple): Sorted :obj:`(parameter, value)` pairs.
     """
-    Geocoder using the Open Street Map Nominatim API.
+    key = []
+    for field, value in query.items():
+        if field == "format" or value is None:
+            continue
+        value = str(value)
+        if field == "q":
+            value = value.replace("+", " ")
+        key.append((field, " ".join(value.casefold().split())))
+    return tuple(sorted(key))
 
-    If there are multiple results the first one is returned (they are ranked by importance).
-    The API usage policy allows maximum 1 request per second and no multithreading:
+
+class GeocoderBackend(abc.ABC):
+    """Interface of geocoder backends, which answer queries with a list of
+    results ranked by importance, each with at least "lat" and "lon".
+    Results are only cached for backends with a :obj:`name`."""
+
+    name = None
+
+    @abc.abstractmethod
+    def search(self, **query):
+        """Search for a place.
+
+        Args:
+            query (dict): Either :obj:`q` or any of :obj:`QUERY_FIELDS`.
+        Returns:
+            (:obj:`list` of :obj:`dict`): Results, which is empty if no match.
+        """
+
+
+class NominatimBackend(GeocoderBackend):
+    """Open Street Map Nominatim API, or a self-hosted instance of it.
+
+    The public API usage policy allows maximum 1 request per second and no multithreading:
     https://operations.osmfoundation.org/policies/nominatim/
+    so requests are rate limited, unless :obj:`max_per_second` is `None` (e.g. for a
+    self-hosted instance). The limit is per host, and shared by all workers which
+    share a rate limit store (see :obj:`nesta_daps.common.http.throttle.set_store`).
+    Transient failures are retried by the shared :obj:`RetryScheduler`.
 
     Args:
-        request_kwargs (dict): Parameters for OSM API.
+        url (str): The search endpoint.
+        max_per_second (float): Maximum request rate, or `None` for no limit.
+        user_agent (str): User-Agent header to identify the application.
+        store: Rate limit store to use instead of the shared one.
+    """
+
+    def __init__(
+        self,
+        url=NOMINATIM_URL,
+        max_per_second=0.5,
+        user_agent="Nesta health data geocode",
+        store=None,
+    ):
+        self.url = url
+        self.name = url
+        self.user_agent = user_agent
+        request = self._request
+        if max_per_second is not None:
+            limiter = RateLimiter(max_per_second, key=url_host(url), store=store)
+            request = limiter(request)
+        self._limited_request = with_retries(host=url_host(url))(request)
+
+    def _request(self, params):
+        response = get_session().get(
+            self.url, params=params, headers={"User-Agent": self.user_agent}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, **query):
+        # Explictly require json for ease of use
+        return self._limited_request(dict(query, format="json"))
+
+
+class GazetteerBackend(GeocoderBackend):
+    """Offline gazetteer of known places, matched exactly (see :obj:`query_key`)
+    on their query fields, or on :obj:`q` made of their field values in the
+    order of :obj:`QUERY_FIELDS`, e.g. "london uk" for a city and country.
+    Postcodes can also be looked up in a :obj:`PostcodeIndex`.
+
+    Args:
+        places (:obj:`iterable` of :obj:`dict`): Places with "lat" and "lon" and
+                                                 any of :obj:`QUERY_FIELDS`.
+        postcode_index (:obj:`PostcodeIndex`): Optional offline postcode index.
+    """
+
+    def __init__(self, places=(), postcode_index=None):
+        self.places = {}
+        self.postcode_index = postcode_index
+        for place in places:
+            self.add(**place)
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        """Load a gazetteer from a CSV file with "lat", "lon" and query field columns.
+
+        Args:
+            path (str): The CSV file.
+            kwargs: Any other arguments for :obj:`GazetteerBackend`.
+        """
+        with open(path, newline="") as f:
+            return cls(csv.DictReader(f), **kwargs)
+
+    def add(self, lat, lon, **fields):
+        """Add a place to the gazetteer."""
+        fields = {k: v for k, v in fields.items() if k in QUERY_FIELDS and v}
+        # Validated, but kept as strings as from Nominatim
+        result = {"lat": str(float(lat)), "lon": str(float(lon))}
+        q = " ".join(fields[field] for field in QUERY_FIELDS if field in fields)
+        self.places.setdefault(query_key(**fields), result)
+        self.places.setdefault(query_key(q=q), result)
+
+    def search(self, **query):
+        result = self.places.get(query_key(**query))
+        if result is None and self.postcode_index is not None and "postalcode" in query:
+            result = self.postcode_index.lookup(query["postalcode"])
+        return [] if result is None else [result]
+
+
+class FakeBackend(GeocoderBackend):
+    """In-process stand-in for tests and benchmarks, which records its calls.
+    Without :obj:`results`, every query matches a made-up but stable location.
+
+    Args:
+        results (dict): Optional results by :obj:`query_key`, where any other
+                        queries have no match.
+    """
+
+    def __init__(self, results=None):
+        self.results = results
+        self.calls = []
+
+    def search(self, **query):
+        self.calls.append(query)
+        key = query_key(**query)
+        if self.results is not None:
+            result = self.results.get(key)
+            return [] if result is None else [result]
+        digest = zlib.crc32(repr(key).encode())
+        lat, lon = digest % 18000 / 100 - 90, digest % 36000 / 100 - 180
+        return [{"lat": str(lat), "lon": str(lon)}]
+
+
+def get_backend():
+    """Get the default backend, creating the public Nominatim one on first use.
+
     Returns:
-        JSON from API response.
+        backend (:obj:`GeocoderBackend`)
     """
-    # Explictly require json for ease of use
-    request_kwargs["format"] = "json"
-    response = requests.get(
-        "https://nominatim.openstreetmap.org/search",
-        params=request_kwargs,
-        headers={"User-Agent": "Nesta health data geocode"},
-    )
-    response.raise_for_status()
-    geo_data = response.json()
-    if len(geo_data) == 0:
-        raise ValueError(f"No geocode match for {request_kwargs}")
-    return geo_data
+    global _BACKEND
+    with _LOCK:
+        if _BACKEND is None:
+            _BACKEND = NominatimBackend()
+        return _BACKEND
+
+
+def set_backend(backend):
+    """Replace the default backend.
+
+    Args:
+        backend (:obj:`GeocoderBackend`): The new default backend, or `None` to
+                                          revert to the public Nominatim API.
+    Returns:
+        The previous default backend.
+    """
+    global _BACKEND
+    with _LOCK:
+        previous, _BACKEND = _BACKEND, backend
+    return previous
 
 
-def retry_if_not_value_error(exception):
-    """Forces retry to exit if a valueError is returned. Supplied to the
-    'retry_on_exception' argument in the retry decorator.
+def set_geocode_cache(cache):
+    """Cache results of :obj:`geocode` in the given (e.g. persistent) cache.
 
     Args:
-        exception (Exception): the raised exception, to check
+        cache (:obj:`GeocodeCache`): The cache to use, or `None` to disable caching.
+    Returns:
+        The previous cache.
+    """
+    global GEOCODE_CACHE
+    previous, GEOCODE_CACHE = GEOCODE_CACHE, cache
+    return previous
+
+
+def geocode(backend=None, **request_kwargs):
+    """
+    Geocoder using the default (or a given) backend.
+
+    If there are multiple results the first one is returned (they are ranked by importance).
+    Both results and queries with no match are cached in :obj:`GEOCODE_CACHE`.
 
+    Args:
+        backend (:obj:`GeocoderBackend`): Backend to use instead of the default.
+        request_kwargs (dict): Parameters for OSM API.
     Returns:
-        (bool): False if a ValueError, else True
+        JSON from API response.
     """
-    return not isinstance(exception, ValueError)
+    if backend is None:
+        backend = get_backend()
+    cache = GEOCODE_CACHE if backend.name is not None else None
+    query = [backend.name, query_key(**request_kwargs)]
+    geo_data = MISSING if cache is None else cache.get(query)
+    if geo_data is MISSING:
+        geo_data = backend.search(**request_kwargs) or None
+        if cache is not None:
+            cache.put(query, geo_data)
+    if geo_data is None:
+        raise ValueError(f"No geocode match for {request_kwargs}")
+    return geo_data
 
 
-@retry(stop_max_attempt_number=10, retry_on_exception=retry_if_not_value_error)
-@ratelimit(max_per_second=0.5)
-def _geocode(q=None, **kwargs):
+def _geocode(q=None, backend=None, **kwargs):
     """Extension of geocode to catch invalid requests to the api and handle errors.
-    failure.
 
     Args:
         q (str): query string, multiple words should be separated with +
+        backend (:obj:`GeocoderBackend`): Backend to use instead of the default.
         kwargs (str): name and value of any other valid query parameters
 
     Returns:
         dict: lat and lon
     """
-    valid_kwargs = ["street", "city", "county", "state", "country", "postalcode"]
-    if not all(kwarg in valid_kwargs for kwarg in kwargs):
-        raise ValueError(f"Invalid query parameter. Not in: {valid_kwargs}")
+    if not all(kwarg in QUERY_FIELDS for kwarg in kwargs):
+        raise ValueError(f"Invalid query parameter. Not in: {QUERY_FIELDS}")
     if q and kwargs:
         raise ValueError(
             "Supply either q OR other query parameters, they cannot be combined."
@@ -83,7 +278,10 @@ def _geocode(q=None, **kwargs):
 
     query_kwargs = {"q": q} if q else kwargs
     try:
-        geo_data = geocode(**query_kwargs)
+        if backend is None:
+            geo_data = geocode(**query_kwargs)
+        else:
+            geo_data = geocode(backend=backend, **query_kwargs)
     except ValueError:
         logging.debug(f"Unable to geocode {query_kwargs}")
         return None  # converts to null which is accepted in elasticsearch
@@ -95,34 +293,36 @@ def _geocode(q=None, **kwargs):
     return {"lat": lat, "lon": lon}
 
 
-def geocode_dataframe(df):
+def geocode_dataframe(df, backend=None):
     """
     A wrapper for the geocode function to process a supplied dataframe using
     the city and country.
 
     Args:
         df (dataframe): a dataframe containing city and country fields.
+        backend (:obj:`GeocoderBackend`): Backend to use instead of the default.
     Returns:
         a dataframe with a 'coordinates' column appended.
     """
+    geocoder = _geocode if backend is None else partial(_geocode, backend=backend)
     in_cols = ["city", "country"]
     out_col = "coordinates"
     # Only geocode unique city/country combos
     _df = df[in_cols].drop_duplicates()
-    _df.replace("", pd.np.nan, inplace=True)
+    _df.replace("", np.nan, inplace=True)
     _df = _df.dropna()
     if len(_df) == 0:
         df[out_col] = None
         return df
 
     # Attempt to geocode with city and country
-    _df[out_col] = _df[in_cols].apply(lambda row: _geocode(**row), axis=1)
+    _df[out_col] = _df[in_cols].apply(lambda row: geocoder(**row), axis=1)
     # Attempt to geocode with query for those which failed
     null = pd.isnull(_df[out_col])
     if null.sum() > 0:
         query = "{city} {country}"
         _df.loc[null, out_col] = _df.loc[null, in_cols].apply(
-            lambda row: _geocode(query.format(**row)), axis=1
+            lambda row: geocoder(query.format(**row)), axis=1
         )
     # Merge the results again
     return pd.merge(df, _df, how="left", left_on=in_cols, right_on=in_cols)
@@ -135,11 +335,13 @@ def geocode_batch_dataframe(
     latitude="latitude",
     longitude="longitude",
     query_method="both",
+    backend=None,
 ):
     """Geocodes a dataframe, first by supplying the city and country to the api, if this
     fails a second attempt is made supplying the combination using the q= method.
+    Each unique city and country is only geocoded once.
     The supplied dataframe df is returned with additional columns appended, containing
-    the latitude and longitude as floats.
+    the latitude and longitude as floats (NaN where geocoding failed).
 
     Args:
         df (:obj:`pandas.DataFrame`): input dataframe
@@ -151,6 +353,7 @@ def geocode_batch_dataframe(
                                     'city_country_only': city and country only
                                     'query_only': q method only
                                     'both': city, country with fallback to q method
+        backend (:obj:`GeocoderBackend`): Backend to use instead of the default.
 
     Returns:
         (:obj:`pandas.DataFrame`): original dataframe with lat and lon appended as floats
@@ -160,18 +363,29 @@ def geocode_batch_dataframe(
             "Invalid query method, must be 'city_country_only', 'query_only' or 'both'"
         )
 
-    df[latitude], df[longitude] = None, None
-
-    for idx, row in df.iterrows():
+    geocoder = _geocode if backend is None else partial(_geocode, backend=backend)
+    in_cols = [city, country]
+    # Only geocode unique city/country combos, in order of first appearance
+    keys = df[in_cols].drop_duplicates()
+    lats, lons = [], []
+    for _city, _country in zip(keys[city], keys[country]):
         location = None
         if query_method in ["city_country_only", "both"]:
-            location = _geocode(city=row[city], country=row[country])
+            location = geocoder(city=_city, country=_country)
         if location is None and query_method in ["query_only", "both"]:
-            query = f"{row[city]} {row[country]}"
-            location = _geocode(q=query)
-        if location is not None:
-            df.loc[idx, latitude] = float(location["lat"])
-            df.loc[idx, longitude] = float(location["lon"])
+            location = geocoder(q=f"{_city} {_country}")
+        if location is None:
+            lats.append(None)
+            lons.append(None)
+        else:
+            lats.append(float(location["lat"]))
+            lons.append(float(location["lon"]))
+    keys[latitude] = pd.Series(lats, index=keys.index, dtype="float64")
+    keys[longitude] = pd.Series(lons, index=keys.index, dtype="float64")
+    # Merge the results back onto every row, in the original row order
+    located = df[in_cols].merge(keys, how="left", on=in_cols)
+    df[latitude] = located[latitude].to_numpy()
+    df[longitude] = located[longitude].to_numpy()
     return df
 
 
@@ -5,18 +5,58 @@ country iso codes
 tools for lookup of iso codes for countries
 """
 
+import re
+import unicodedata
+from functools import cache
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
 import pycountry
-from functools import lru_cache
 from pycountry_convert import country_alpha2_to_continent_code
 
-
+PUNCTUATION = re.compile(r"[^\w\s]")
+# Common names of countries which aren't among pycountry's names, by alpha 2 code
+COUNTRY_ALIASES = {
+    "CD": ("Democratic Republic of the Congo", "DR Congo", "Congo-Kinshasa"),
+    "CG": ("Congo-Brazzaville",),
+    "CI": ("Ivory Coast",),
+    "CV": ("Cape Verde",),
+    "CZ": ("Czech Republic",),
+    "BN": ("Brunei",),
+    "FM": ("Micronesia",),
+    "GB": (
+        "UK",
+        "U.K.",
+        "Great Britain",
+        "Britain",
+        "England",
+        "Scotland",
+        "Wales",
+        "Northern Ireland",
+    ),
+    "MK": ("Macedonia",),
+    "MM": ("Burma",),
+    "NL": ("Holland", "The Netherlands"),
+    "PS": ("Palestine",),
+    "RU": ("Russia",),
+    "SZ": ("Swaziland",),
+    "TL": ("East Timor",),
+    "TR": ("Turkey",),
+    "US": ("USA", "U.S.A.", "US", "U.S."),
+    "VA": ("Vatican", "Vatican City", "Holy See"),
+}
+
+
+@cache
 def alpha2_to_continent_mapping():
     """Wrapper around :obj:`pycountry-convert`'s :obj:`country_alpha2_to_continent_code`
     function to generate a dictionary mapping ISO2 to continent codes, accounting
     where :obj:`pycountry-convert` has no mapping (e.g. for Vatican).
+    The mapping is only generated once, and is shared by all callers.
 
     Returns:
-        :obj`dict`
+        :obj:`MappingProxyType`: Read-only mapping of ISO2 to continent code.
     """
     continents = {}
     for c in pycountry.countries:
@@ -25,41 +65,66 @@ def alpha2_to_continent_mapping():
             continents[c.alpha_2] = country_alpha2_to_continent_code(c.alpha_2)
         except KeyError:
             pass
-    return continents
+    return MappingProxyType(continents)
+
+
+def normalise_country_name(name):
+    """Normalise a country name for lookup, i.e. case-folded, without
+    accents or punctuation and with collapsed whitespace, such that
+    "Côte d'Ivoire" and "COTE D'IVOIRE" are equivalent.
+
+    Args:
+        name (str): The country name.
+    Returns:
+        (str): The normalised name.
+    """
+    name = name.casefold()
+    if not name.isascii():
+        name = unicodedata.normalize("NFKD", name)
+        name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(PUNCTUATION.sub(" ", name).split())
+
 
+@cache
+def country_name_index():
+    """Index of pycountry countries by each of their normalised names, common
+    names, official names and :obj:`COUNTRY_ALIASES`, built once on first use.
 
-def _country_iso_code(country):
+    Returns:
+        :obj:`MappingProxyType`: Read-only mapping of normalised name to
+                                 country object from the pycountry module.
+    """
+    index = {}
     for name_type in ["name", "common_name", "official_name"]:
-        query = {name_type: country}
-        try:
-            result = pycountry.countries.get(**query)
-            if result is not None:
-                return result
-        except KeyError:
-            pass
-    raise KeyError(f"{country} not found")
+        for c in pycountry.countries:
+            name = getattr(c, name_type, None)
+            if name is not None:
+                index.setdefault(normalise_country_name(name), c)
+    for alpha_2, aliases in COUNTRY_ALIASES.items():
+        c = pycountry.countries.get(alpha_2=alpha_2)
+        for alias in aliases:
+            index.setdefault(normalise_country_name(alias), c)
+    return MappingProxyType(index)
 
 
-@lru_cache()
 def country_iso_code(country):
     """
     Look up the ISO 3166 codes for countries.
     https://www.iso.org/glossary-for-iso-3166.html
 
-    Wraps the pycountry module to attempt lookup with all name options.
+    Looks up the name in an index of all pycountry name options (and common aliases),
+    ignoring case, accents and punctuation.
 
     Args:
         country (str): name of the country to lookup
     Returns:
         Country object from the pycountry module
+    Raises:
+        KeyError: if the country is not found
     """
-    country = str(country)
-    try:
-        # Note this will raise KeyError if fails
-        result = _country_iso_code(country)
-    except KeyError:
-        # Note this will raise KeyError if fails
-        result = _country_iso_code(country.title())
+    result = country_name_index().get(normalise_country_name(str(country)))
+    if result is None:
+        raise KeyError(f"{country} not found")
     return result
 
 
@@ -67,6 +132,7 @@ def country_iso_code_dataframe(df, country="country"):
     """
     A wrapper for the country_iso_code function to apply it to a whole dataframe,
     using the country name. Also appends the continent code based on the country.
+    Each unique country name is only looked up once.
 
     Args:
         df (:obj:`pandas.DataFrame`): a dataframe containing a country field.
@@ -75,28 +141,33 @@ def country_iso_code_dataframe(df, country="country"):
         a dataframe with country_alpha_2, country_alpha_3, country_numeric, and
         continent columns appended.
     """
-    df["country_alpha_2"], df["country_alpha_3"], df["country_numeric"] = (
-        None,
-        None,
-        None,
-    )
-    df["continent"] = None
-
     continents = alpha2_to_continent_mapping()
-    country_codes = None
-    for idx, row in df.iterrows():
+    columns = {
+        "country_alpha_2": [],
+        "country_alpha_3": [],
+        "country_numeric": [],
+        "continent": [],
+    }
+    # Map each row to its unique country name, where missing names are -1
+    codes, uniques = pd.factorize(df[country])
+    for name in uniques:
         try:
-            country_codes = country_iso_code(row[country])
+            country_codes = country_iso_code(name)
         except KeyError:
             # some fallback method could go here
+            country_codes = None
+        if country_codes is None:
+            for values in columns.values():
+                values.append(None)
             continue
-        else:
-            if country_codes is None:
-                continue
-        df.at[idx, "country_alpha_2"] = country_codes.alpha_2
-        df.at[idx, "country_alpha_3"] = country_codes.alpha_3
-        df.at[idx, "country_numeric"] = country_codes.numeric
-        df.at[idx, "continent"] = continents.get(country_codes.alpha_2)
+        columns["country_alpha_2"].append(country_codes.alpha_2)
+        columns["country_alpha_3"].append(country_codes.alpha_3)
+        columns["country_numeric"].append(country_codes.numeric)
+        columns["continent"].append(continents.get(country_codes.alpha_2))
+    for column, values in columns.items():
+        values.append(None)  # i.e. the last value, for missing names
+        values = np.array(values, dtype=object).take(codes)
+        df[column] = pd.Series(values, index=df.index, dtype=object)
     return df
 
 
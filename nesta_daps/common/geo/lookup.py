@@ -1,14 +1,137 @@
+"""
+lookup
+======
+
+Reference tables of countries, continents and regions. These are read
+from a versioned snapshot of the source data, which is vendored with
+the package and only loaded on first use, so that workers don't need
+network access at startup. The snapshot is only updated on request:
+
+    python -m nesta_daps.common.geo.lookup
+
+Until a snapshot has been vendored (or for any source missing from it),
+the source files are fetched from upstream on first use instead.
+
+The EU member states change too rarely (and have no live open source in a
+stable format) to be worth fetching, so are listed here in :obj:`EU_COUNTRIES`.
+"""
+
+import gzip
+import json
+import logging
+from datetime import datetime
+from datetime import timezone
 from functools import cache
 from io import StringIO
+from pathlib import Path
 
 import pandas as pd
 
-import requests
+from nesta_daps.common.atomic import atomic_write
+from nesta_daps.common.http.session import get_session
 
 COUNTRY_CODES_URL = "https://datahub.io/core/country-codes/r/country-codes.csv"
+CONTINENT_CODES_URL = (
+    "https://nesta-open-data.s3.eu-west"
+    "-2.amazonaws.com/rwjf-viz/"
+    "continent_codes_names.json"
+)
+SNAPSHOT_URLS = (COUNTRY_CODES_URL, CONTINENT_CODES_URL)
+SNAPSHOT_PATH = Path(__file__).parent / "data" / "lookup_snapshot.json.gz"
+# ISO-2 codes of the EU27, i.e. since 1 February 2020
+EU_COUNTRIES = (
+    "AT", "BE", "BG", "CY", "CZ", "DE", "DK", "EE", "ES", "FI", "FR", "GR", "HR", "HU",
+    "IE", "IT", "LT", "LU", "LV", "MT", "NL", "PL", "PT", "RO", "SE", "SI", "SK",
+)  # fmt: skip
+
+# The snapshot read by all lookups, see `set_snapshot`
+_SNAPSHOT = SNAPSHOT_PATH
 
 
 @cache
+def load_snapshot(path=SNAPSHOT_PATH):
+    """Load the snapshot of source data, i.e. a gzipped JSON object with its
+    "version", the "sources" of each file and the "files" by source URL.
+
+    Args:
+        path (str): Path to the snapshot.
+    Returns:
+        snapshot (dict): The snapshot, which is empty if there is no such file.
+    """
+    if not Path(path).exists():
+        return {"version": None, "sources": {}, "files": {}}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def fetch_source(url):
+    """Fetch the text of a source file from upstream.
+
+    Args:
+        url (str): The source URL.
+    Returns:
+        text (str)
+    """
+    r = get_session().get(url)
+    r.raise_for_status()
+    return r.text
+
+
+def get_source(url):
+    """Get the text of a source file from the snapshot, or else from upstream.
+
+    Args:
+        url (str): The source URL.
+    Returns:
+        text (str)
+    """
+    files = load_snapshot(_SNAPSHOT)["files"]
+    if url in files:
+        return files[url]
+    logging.warning(
+        f"{url} is not in the snapshot, so is fetched (see refresh_snapshot)"
+    )
+    return fetch_source(url)
+
+
+def set_snapshot(path=SNAPSHOT_PATH):
+    """Read all subsequent lookups from another snapshot (or the vendored one).
+
+    Args:
+        path (str): Path to the snapshot.
+    Returns:
+        The path to the previous snapshot.
+    """
+    global _SNAPSHOT
+    previous, _SNAPSHOT = _SNAPSHOT, path
+    for fn in (load_snapshot, *LOOKUPS):
+        fn.cache_clear()
+    return previous
+
+
+def refresh_snapshot(path=SNAPSHOT_PATH, urls=SNAPSHOT_URLS):
+    """Fetch every source file and write a new snapshot of them, which is
+    used by all subsequent lookups (see :obj:`set_snapshot`).
+
+    Args:
+        path (str): Path to write the snapshot to.
+        urls (:obj:`iterable` of str): Source URLs to snapshot.
+    Returns:
+        snapshot (dict)
+    """
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    files = {url: fetch_source(url) for url in urls}
+    snapshot = {
+        "version": now,
+        "sources": {url: f"Fetched from {url} at {now}" for url in urls},
+        "files": files,
+    }
+    with atomic_write(path, "wt", opener=gzip.open, encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    set_snapshot(path)
+    return snapshot
+
+
 def get_eu_countries():
     """
     All EU ISO-2 codes
@@ -16,26 +139,20 @@ def get_eu_countries():
     Returns:
         data (list): List of ISO-2 codes)
     """
-    url = "https://restcountries.eu/rest/v2/regionalbloc/eu"
-    r = requests.get(url)
-    return [row["alpha2Code"] for row in r.json()]
+    return list(EU_COUNTRIES)
 
 
 @cache
 def get_continent_lookup():
     """
-    Retrieves continent ISO2 code to continent name mapping from a static open URL.
+    Retrieves continent ISO2 code to continent name mapping from a snapshot
+    of a static open URL.
 
     Returns:
         data (dict): Key-value pairs of continent-codes and names.
     """
-
-    url = (
-        "https://nesta-open-data.s3.eu-west"
-        "-2.amazonaws.com/rwjf-viz/"
-        "continent_codes_names.json"
-    )
-    continent_lookup = {row["Code"]: row["Name"] for row in requests.get(url).json()}
+    rows = json.loads(get_source(CONTINENT_CODES_URL))
+    continent_lookup = {row["Code"]: row["Name"] for row in rows}
     continent_lookup[None] = None
     continent_lookup[""] = None
     return continent_lookup
@@ -45,14 +162,12 @@ def get_continent_lookup():
 def get_country_continent_lookup():
     """
     Retrieves continent lookups for all world countries,
-    by ISO2 code, from a static open URL.
+    by ISO2 code, from a snapshot of a static open URL.
 
     Returns:
         data (dict): Values are country_name-continent pairs.
     """
-    r = requests.get(COUNTRY_CODES_URL)
-    r.raise_for_status()
-    with StringIO(r.text) as csv:
+    with StringIO(get_source(COUNTRY_CODES_URL)) as csv:
         df = pd.read_csv(
             csv, usecols=["ISO3166-1-Alpha-2", "Continent"], keep_default_na=False
         )
@@ -72,14 +187,12 @@ def get_country_region_lookup():
     """
     Retrieves subregions (around 18 in total)
     lookups for all world countries, by ISO2 code,
-    from a static open URL.
+    from a snapshot of a static open URL.
 
     Returns:
         data (dict): Values are country_name-region_name pairs.
     """
-    r = requests.get(COUNTRY_CODES_URL)
-    r.raise_for_status()
-    with StringIO(r.text) as csv:
+    with StringIO(get_source(COUNTRY_CODES_URL)) as csv:
         df = pd.read_csv(
             csv, usecols=["official_name_en", "ISO3166-1-Alpha-2", "Sub-region Name"]
         )
@@ -104,7 +217,8 @@ def get_iso2_to_iso3_lookup(reverse=False):
     Returns:
         lookup (dict): Key-value pairs of ISO2 to ISO3 codes (or reverse).
     """
-    country_codes = pd.read_csv(COUNTRY_CODES_URL)
+    with StringIO(get_source(COUNTRY_CODES_URL)) as csv:
+        country_codes = pd.read_csv(csv)
     alpha2_to_alpha3 = {
         row["ISO3166-1-Alpha-2"]: row["ISO3166-1-Alpha-3"]
         for _, row in country_codes.iterrows()
@@ -130,3 +244,18 @@ def get_disputed_countries():
         "HKG": "CHN",  # Hong Kong: China
         "ROU": "ROM",
     }  # not disputed: just inconsistent format for Romania
+
+
+# Lookups which are derived from the snapshot, see `refresh_snapshot`
+LOOKUPS = (
+    get_continent_lookup,
+    get_country_continent_lookup,
+    get_country_region_lookup,
+    get_iso2_to_iso3_lookup,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    snapshot = refresh_snapshot()
+    logging.info(f"Refreshed {SNAPSHOT_PATH} to version {snapshot['version']}")
@@ -0,0 +1,145 @@
+"""
+postcode
+========
+
+Offline UK postcode geocoding, from a compact index of postcode centroids
+which is built once (e.g. from the ONS Postcode Directory) and then
+memory-mapped, so that lookups are O(log n) binary searches which only
+touch the handful of pages that they need. Locations are returned as
+strings, exactly as from Nominatim, so that the two are interchangeable.
+
+The index is a header followed by fixed-width records, sorted by postcode:
+an 8 byte space-padded postcode (without its space) and float64 lat and lon.
+"""
+
+import csv
+import mmap
+import struct
+from bisect import bisect_left
+
+from nesta_daps.common.atomic import atomic_write
+
+MAGIC = b"PCIX0001"
+HEADER = struct.Struct("<8sQ")  # magic, number of records
+RECORD = struct.Struct("<8sdd")  # postcode, lat, lon
+KEY_SIZE = 8
+NO_LOCATION = 99.999999  # ONSPD's latitude for postcodes without a grid reference
+
+
+def normalise_postcode(postcode):
+    """Normalise a UK postcode to upper case, with a single space before the
+    three character inward code, e.g. " ec4a3bf" -> "EC4A 3BF".
+
+    Args:
+        postcode (str): The raw postcode.
+    Returns:
+        (str): The normalised postcode, or `None` if empty.
+    """
+    postcode = "".join(postcode.split()).upper()
+    if len(postcode) < 5:
+        return postcode or None
+    return f"{postcode[:-3]} {postcode[-3:]}"
+
+
+def postcode_key(postcode):
+    """The fixed-width index key of a postcode.
+
+    Args:
+        postcode (str): The raw postcode.
+    Returns:
+        (bytes): The key, or `None` if the postcode can't be a key.
+    """
+    key = "".join(postcode.split()).upper().encode("ascii", errors="replace")
+    if not key or len(key) > KEY_SIZE:
+        return None
+    return key.ljust(KEY_SIZE)
+
+
+def build_postcode_index(
+    csv_path, index_path, postcode_col="pcds", lat_col="lat", lon_col="long"
+):
+    """Build a postcode index from a CSV of postcode centroids. The defaults
+    suit the ONS Postcode Directory (ONSPD), and any file with lat/lon columns
+    will do. Rows without a location are skipped.
+
+    Args:
+        csv_path (str): The CSV of postcode centroids.
+        index_path (str): Where to write the index.
+        postcode_col (str): Name of the postcode column.
+        lat_col (str): Name of the latitude column.
+        lon_col (str): Name of the longitude column.
+    Returns:
+        (int): The number of postcodes indexed.
+    """
+    records = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            key = postcode_key(row[postcode_col])
+            try:
+                lat, lon = float(row[lat_col]), float(row[lon_col])
+            except (TypeError, ValueError):
+                continue
+            if key is None or lat == NO_LOCATION:
+                continue
+            records[key] = (lat, lon)
+    with atomic_write(index_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            f.write(RECORD.pack(key, *records[key]))
+    return len(records)
+
+
+class PostcodeIndex:
+    """Read-only, memory-mapped postcode index (see :obj:`build_postcode_index`).
+
+    Args:
+        path (str): The index file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_records = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a postcode index")
+
+    def __len__(self):
+        return self.n_records
+
+    def __contains__(self, postcode):
+        return self.lookup(postcode) is not None
+
+    def __getitem__(self, i):
+        """The key of the i'th record, so that the index can be bisected."""
+        offset = HEADER.size + i * RECORD.size
+        return self._mmap[offset : offset + KEY_SIZE]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, postcode):
+        """Look up the centroid of a postcode.
+
+        Args:
+            postcode (str): The postcode, in any case or spacing.
+        Returns:
+            (dict): With "lat" and "lon" keys as strings, as from :obj:`_geocode`,
+                    or `None` if the postcode isn't in the index.
+        """
+        key = postcode_key(postcode)
+        if key is None:
+            return None
+        i = bisect_left(self, key, hi=self.n_records)
+        if i == self.n_records or self[i] != key:
+            return None
+        _, lat, lon = RECORD.unpack_from(self._mmap, HEADER.size + i * RECORD.size)
+        return {"lat": str(lat), "lon": str(lon)}
+
+    def close(self):
+        """Unmap the index file."""
+        self._mmap.close()
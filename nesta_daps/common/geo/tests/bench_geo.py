@@ -0,0 +1,78 @@
+"""
+Geo benchmarks
+==============
+
+Micro-benchmarks for the geo utils, run against synthetic data and an
+in-process fake geocoder (so no network access is needed). From the
+root of the repository:
+
+    python -m nesta_daps.common.geo.tests.bench_geo
+"""
+
+import random
+import time
+
+import pandas as pd
+
+from nesta_daps.common.geo.geocode import FakeBackend
+from nesta_daps.common.geo.geocode import geocode_batch_dataframe
+from nesta_daps.common.geo.iso import alpha2_to_continent_mapping
+from nesta_daps.common.geo.iso import country_iso_code_dataframe
+from nesta_daps.common.geo.iso import country_name_index
+from nesta_daps.flows.datasets.gtr.gtr_utils import add_country_details
+
+
+def make_places(n_rows=300000, n_unique=500):
+    """Generate a frame of cities and countries, with heavy repetition."""
+    random.seed(0)
+    places = [(f"City {i}", f"Country {i % 50}") for i in range(n_unique)]
+    rows = random.choices(places, k=n_rows)
+    return pd.DataFrame(rows, columns=["city", "country"])
+
+
+def bench_geocode_batch_dataframe(n_rows=300000, n_unique=500):
+    """Batch geocoding of a frame, against the fake backend."""
+    df = make_places(n_rows, n_unique)
+    backend = FakeBackend()
+    start = time.perf_counter()
+    geocode_batch_dataframe(df, backend=backend)
+    elapsed = time.perf_counter() - start
+    print(
+        f"geocode_batch_dataframe: {n_rows / elapsed:,.0f} rows/s "
+        f"({len(backend.calls)} geocoder calls for {n_rows} rows)"
+    )
+
+
+def bench_add_country_details(n_orgs=50000):
+    """Country details of GtR organisations, which share the continent mapping."""
+    countries = ["United Kingdom", "France", "Germany", "United States", "Atlantis"]
+    orgs = [{"id": i, "country": countries[i % len(countries)]} for i in range(n_orgs)]
+    start = time.perf_counter()
+    alpha2_to_continent_mapping.cache_clear()
+    alpha2_to_continent_mapping()
+    print(f"alpha2_to_continent_mapping: {time.perf_counter() - start:.4f}s to build")
+    start = time.perf_counter()
+    for org in orgs:
+        add_country_details(org)
+    elapsed = time.perf_counter() - start
+    print(f"add_country_details: {n_orgs / elapsed:,.0f} orgs/s")
+
+
+def bench_country_iso_code_dataframe(n_rows=2000000):
+    """ISO codes of a frame with a few hundred distinct country names."""
+    random.seed(0)
+    names = list(country_name_index()) + ["Atlantis", None]
+    df = pd.DataFrame({"country": random.choices(names, k=n_rows)})
+    start = time.perf_counter()
+    country_iso_code_dataframe(df)
+    elapsed = time.perf_counter() - start
+    print(
+        f"country_iso_code_dataframe: {elapsed:.2f}s for {n_rows} rows "
+        f"({len(names)} distinct countries)"
+    )
+
+
+if __name__ == "__main__":
+    bench_geocode_batch_dataframe()
+    bench_add_country_details()
+    bench_country_iso_code_dataframe()
@@ -3,23 +3,68 @@ from pandas.testing import assert_frame_equal
 import pytest
 from unittest import mock
 
-from nesta.packages.geo_utils.geocode import geocode
-from nesta.packages.geo_utils.geocode import _geocode
-from nesta.packages.geo_utils.geocode import geocode_dataframe
-from nesta.packages.geo_utils.geocode import geocode_batch_dataframe
-from nesta.packages.geo_utils.geocode import generate_composite_key
-from nesta.packages.geo_utils.country_iso_code import country_iso_code
-from nesta.packages.geo_utils.country_iso_code import country_iso_code_dataframe
-from nesta.packages.geo_utils.country_iso_code import country_iso_code_to_name
-from nesta.packages.geo_utils.lookup import get_continent_lookup
-from nesta.packages.geo_utils.lookup import get_country_region_lookup
-from nesta.packages.geo_utils.lookup import get_country_continent_lookup
-
-REQUESTS = "nesta.packages.geo_utils.geocode.requests.get"
-PYCOUNTRY = "nesta.packages.geo_utils.country_iso_code.pycountry.countries.get"
-GEOCODE = "nesta.packages.geo_utils.geocode.geocode"
-_GEOCODE = "nesta.packages.geo_utils.geocode._geocode"
-COUNTRY_ISO_CODE = "nesta.packages.geo_utils.country_iso_code.country_iso_code"
+from nesta_daps.common.geo.geocode import geocode
+from nesta_daps.common.geo.geocode import _geocode
+from nesta_daps.common.geo.geocode import geocode_dataframe
+from nesta_daps.common.geo.geocode import geocode_batch_dataframe
+from nesta_daps.common.geo.geocode import generate_composite_key
+from nesta_daps.common.geo.geocode import query_key
+from nesta_daps.common.geo.geocode import NominatimBackend
+from nesta_daps.common.geo.geocode import GazetteerBackend
+from nesta_daps.common.geo.geocode import FakeBackend
+from nesta_daps.common.geo.geocode import GeocoderBackend
+from nesta_daps.common.geo.geocode import get_backend
+from nesta_daps.common.geo.geocode import set_backend
+from nesta_daps.common.geo.geocode import set_geocode_cache
+from nesta_daps.common.geo.cache import GeocodeCache
+from nesta_daps.common.geo.cache import MISSING
+from nesta_daps.common.geo.iso import alpha2_to_continent_mapping
+from nesta_daps.common.geo.iso import country_iso_code
+from nesta_daps.common.geo.iso import country_iso_code_dataframe
+from nesta_daps.common.geo.iso import country_iso_code_to_name
+from nesta_daps.common.geo.iso import country_name_index
+from nesta_daps.common.geo.iso import normalise_country_name
+from nesta_daps.common.geo.lookup import COUNTRY_CODES_URL
+from nesta_daps.common.geo.lookup import CONTINENT_CODES_URL
+from nesta_daps.common.geo.lookup import get_continent_lookup
+from nesta_daps.common.geo.lookup import get_country_region_lookup
+from nesta_daps.common.geo.lookup import get_country_continent_lookup
+from nesta_daps.common.geo.lookup import get_eu_countries
+from nesta_daps.common.geo.lookup import get_iso2_to_iso3_lookup
+from nesta_daps.common.geo.lookup import get_source
+from nesta_daps.common.geo.lookup import load_snapshot
+from nesta_daps.common.geo.lookup import refresh_snapshot
+from nesta_daps.common.geo.lookup import set_snapshot
+from nesta_daps.common.geo.lookup import SNAPSHOT_URLS
+from nesta_daps.common.geo.postcode import build_postcode_index
+from nesta_daps.common.geo.postcode import PostcodeIndex
+from nesta_daps.common.http.retry import RetryScheduler
+from nesta_daps.common.http.retry import set_scheduler
+
+SESSION = "nesta_daps.common.geo.geocode.get_session"
+PYCOUNTRY = "nesta_daps.common.geo.iso.pycountry.countries.get"
+GEOCODE = "nesta_daps.common.geo.geocode.geocode"
+_GEOCODE = "nesta_daps.common.geo.geocode._geocode"
+RATE_LIMITER = "nesta_daps.common.geo.geocode.RateLimiter"
+TIME = "nesta_daps.common.geo.cache.time.time"
+COUNTRY_ISO_CODE = "nesta_daps.common.geo.iso.country_iso_code"
+LOOKUP_SESSION = "nesta_daps.common.geo.lookup.get_session"
+
+
+@pytest.fixture(autouse=True)
+def unthrottled():
+    """Requests are mocked, so don't wait on the public API's rate limit"""
+    previous = set_backend(NominatimBackend(max_per_second=None))
+    yield
+    set_backend(previous)
+
+
+@pytest.fixture(autouse=True)
+def no_retries():
+    """Fail fast, rather than backing off as the shared scheduler would"""
+    previous = set_scheduler(RetryScheduler(max_attempts=1, sleep=lambda s: None))
+    yield
+    set_scheduler(previous)
 
 
 class TestGeocoding:
@@ -35,46 +80,50 @@ class TestGeocoding:
             geocode()
         assert "No geocode match" in str(e.value)
 
-    @mock.patch(REQUESTS)
+    @mock.patch(SESSION)
     def test_request_includes_user_agent_in_header(
-        self, mocked_request, mocked_osm_response
+        self, mocked_session, mocked_osm_response
     ):
-        mocked_request.return_value = mocked_osm_response
+        mocked_session().get.return_value = mocked_osm_response
         geocode(something="a")
-        assert mocked_request.call_args[1]["headers"] == {
+        assert mocked_session().get.call_args[1]["headers"] == {
             "User-Agent": "Nesta health data geocode"
         }
 
-    @mock.patch(REQUESTS)
+    @mock.patch(SESSION)
     def test_url_correct_with_city_and_country(
-        self, mocked_request, mocked_osm_response
+        self, mocked_session, mocked_osm_response
     ):
-        mocked_request.return_value = mocked_osm_response
+        mocked_session().get.return_value = mocked_osm_response
         kwargs = dict(city="london", country="UK")
         geocode(**kwargs)
-        assert mocked_request.call_args[1]["params"] == dict(format="json", **kwargs)
+        assert mocked_session().get.call_args[1]["params"] == dict(
+            format="json", **kwargs
+        )
 
-    @mock.patch(REQUESTS)
-    def test_url_correct_with_query(self, mocked_request, mocked_osm_response):
-        mocked_request.return_value = mocked_osm_response
+    @mock.patch(SESSION)
+    def test_url_correct_with_query(self, mocked_session, mocked_osm_response):
+        mocked_session().get.return_value = mocked_osm_response
         kwargs = dict(q="my place")
         geocode(**kwargs)
-        assert mocked_request.call_args[1]["params"] == dict(format="json", **kwargs)
+        assert mocked_session().get.call_args[1]["params"] == dict(
+            format="json", **kwargs
+        )
 
-    @mock.patch(REQUESTS)
-    def test_error_returned_if_no_match(self, mocked_request):
+    @mock.patch(SESSION)
+    def test_error_returned_if_no_match(self, mocked_session):
         mocked_response = mock.Mock()
         mocked_response.json.return_value = []
-        mocked_request.return_value = mocked_response
+        mocked_session().get.return_value = mocked_response
         with pytest.raises(ValueError) as e:
             geocode(q="Something bad")
         assert "No geocode match" in str(e.value)
 
-    @mock.patch(REQUESTS)
+    @mock.patch(SESSION)
     def test_coordinates_extracted_from_json_with_one_result(
-        self, mocked_request, mocked_osm_response
+        self, mocked_session, mocked_osm_response
     ):
-        mocked_request.return_value = mocked_osm_response
+        mocked_session().get.return_value = mocked_osm_response
         assert geocode(q="somewhere") == [{"lat": "12.923432", "lon": "-75.234569"}]
 
     @mock.patch(GEOCODE)
@@ -118,6 +167,193 @@ class TestGeocoding:
         assert mocked_geocode.mock_calls == expected_calls
 
 
+class TestGeocoderBackends:
+    @mock.patch(RATE_LIMITER)
+    @mock.patch(SESSION)
+    def test_self_hosted_nominatim_is_not_rate_limited(
+        self, mocked_session, mocked_limiter
+    ):
+        mocked_session().get.return_value.json.return_value = [{"lat": 1, "lon": 2}]
+        NominatimBackend()
+        mocked_limiter.assert_called_once_with(
+            0.5, key="nominatim.openstreetmap.org", store=None
+        )
+
+        mocked_limiter.reset_mock()
+        backend = NominatimBackend("http://localhost:8080/search", max_per_second=None)
+        assert backend.search(city="London") == [{"lat": 1, "lon": 2}]
+        assert not mocked_limiter.called
+        args, kwargs = mocked_session().get.call_args
+        assert args == ("http://localhost:8080/search",)
+        assert kwargs["params"] == {"city": "London", "format": "json"}
+
+    def test_query_key(self):
+        assert query_key(city=" New  York", country="USA") == (
+            ("city", "new york"),
+            ("country", "usa"),
+        )
+        assert query_key(q="New+York USA", format="json") == (("q", "new york usa"),)
+
+    def test_gazetteer(self):
+        index = mock.Mock()
+        index.lookup.return_value = {"lat": "3.0", "lon": "4.0"}
+        backend = GazetteerBackend(
+            [{"city": "London", "country": "UK", "lat": "1.5", "lon": "-0.1"}],
+            postcode_index=index,
+        )
+        london = [{"lat": "1.5", "lon": "-0.1"}]
+        assert backend.search(city="london", country="uk") == london
+        assert backend.search(q="London UK") == london
+        assert backend.search(city="Paris", country="France") == []
+        assert backend.search(postalcode="EC4A 3BF") == [{"lat": "3.0", "lon": "4.0"}]
+        index.lookup.assert_called_once_with("EC4A 3BF")
+
+    def test_gazetteer_from_csv(self, tmp_path):
+        path = tmp_path / "places.csv"
+        path.write_text("city,country,lat,lon\nParis,France,48.85,2.35\n")
+        backend = GazetteerBackend.from_csv(path)
+        assert backend.search(q="paris france") == [{"lat": "48.85", "lon": "2.35"}]
+
+    def test_backends_must_implement_search(self):
+        class Incomplete(GeocoderBackend):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_fake(self):
+        backend = FakeBackend()
+        first = backend.search(city="London", country="UK")
+        assert backend.search(city="LONDON", country="UK") == first
+        assert backend.search(city="Paris", country="France") != first
+        assert len(backend.calls) == 3
+
+        backend = FakeBackend({query_key(q="somewhere"): {"lat": 1, "lon": 2}})
+        assert backend.search(q="Somewhere") == [{"lat": 1, "lon": 2}]
+        assert backend.search(q="nowhere") == []
+
+    def test_set_backend(self):
+        backend = FakeBackend({query_key(q="somewhere"): {"lat": 1, "lon": 2}})
+        previous = set_backend(backend)
+        try:
+            assert get_backend() is backend
+            assert _geocode("somewhere") == {"lat": 1, "lon": 2}
+            assert _geocode("nowhere") is None
+            assert _geocode("somewhere") == {"lat": 1, "lon": 2}
+        finally:
+            set_backend(previous)
+        # Local backends are fast, so aren't cached
+        assert len(backend.calls) == 3
+
+    def test_batch_dataframe_with_backend(self):
+        backend = FakeBackend(
+            {
+                query_key(city="London", country="UK"): {"lat": 1, "lon": 2},
+                query_key(q="Brussels Belgium"): {"lat": 3, "lon": 4},
+            }
+        )
+        df = pd.DataFrame(
+            {
+                "city": ["London", "Brussels", "Nowhere"],
+                "country": ["UK", "Belgium", "X"],
+            }
+        )
+        geocoded = geocode_batch_dataframe(df.copy(), backend=backend)
+        assert geocoded["latitude"].tolist()[:2] == [1.0, 3.0]
+        assert geocoded["longitude"].tolist()[:2] == [2.0, 4.0]
+        assert geocoded.iloc[2][["latitude", "longitude"]].isnull().all()
+
+
+class TestGeocodeCache:
+    @staticmethod
+    @pytest.fixture
+    def cache(tmp_path):
+        cache = GeocodeCache(tmp_path / "geocodes.db")
+        yield cache
+        cache.close()
+
+    def test_round_trip(self, cache):
+        result = [{"lat": "1.5", "lon": "-0.1"}]
+        assert cache.get(["osm", [["q", "london"]]]) is MISSING
+        cache.put(["osm", [["q", "london"]]], result)
+        cache.put(["osm", [["q", "nowhere"]]], None)
+        assert cache.get(["osm", [["q", "london"]]]) == result
+        assert cache.get(["osm", [["q", "nowhere"]]]) is None
+        assert cache.stats() == {
+            "hits": 1,
+            "negative_hits": 1,
+            "misses": 1,
+            "hit_rate": 2 / 3,
+            "entries": 2,
+        }
+
+    def test_warm_start_across_instances(self, tmp_path):
+        path = tmp_path / "geocodes.db"
+        cache = GeocodeCache(path)
+        cache.put("london", [{"lat": 1, "lon": 2}])
+        cache.put("nowhere", None)
+        cache.close()
+
+        cache = GeocodeCache(path, warm_start=True)
+        assert len(cache._memory) == 2
+        assert cache.get("london") == [{"lat": 1, "lon": 2}]
+        assert cache.get("nowhere") is None
+        assert cache.get("paris") is MISSING
+        cache.close()
+
+    @mock.patch(TIME)
+    def test_hits_and_misses_expire_separately(self, mocked_time, tmp_path):
+        cache = GeocodeCache(tmp_path / "geocodes.db", ttl=100, miss_ttl=10)
+        mocked_time.return_value = 1000
+        cache.put("london", [{"lat": 1, "lon": 2}])
+        cache.put("nowhere", None)
+        mocked_time.return_value = 1050
+        assert cache.get("london") == [{"lat": 1, "lon": 2}]
+        assert cache.get("nowhere") is MISSING
+        mocked_time.return_value = 1101
+        assert cache.get("london") is MISSING
+        assert len(cache) == 0
+
+    @pytest.mark.parametrize("warm_start", [False, True])
+    @mock.patch(TIME)
+    def test_least_recently_accessed_are_evicted(
+        self, mocked_time, warm_start, tmp_path
+    ):
+        cache = GeocodeCache(
+            tmp_path / "geocodes.db", max_entries=2, warm_start=warm_start
+        )
+        mocked_time.return_value = 1
+        cache.put("a", ["a"])
+        mocked_time.return_value = 2
+        cache.put("b", ["b"])
+        mocked_time.return_value = 3
+        cache.get("a")
+        mocked_time.return_value = 4
+        cache.put("c", ["c"])
+        assert len(cache) == 2
+        assert cache.get("a") == ["a"]
+        assert cache.get("b") is MISSING
+        assert cache.get("c") == ["c"]
+
+    @mock.patch(SESSION)
+    def test_geocode_caches_hits_and_misses(self, mocked_session, tmp_path):
+        responses = {"London": [{"lat": "1", "lon": "2"}], "Nowhere": []}
+        mocked_session().get.side_effect = lambda url, params, headers: mock.Mock(
+            **{"json.return_value": responses[params["city"]]}
+        )
+        cache = GeocodeCache(tmp_path / "geocodes.db")
+        previous = set_geocode_cache(cache)
+        try:
+            for _ in range(2):
+                assert _geocode(city="London") == {"lat": "1", "lon": "2"}
+                assert _geocode(city="Nowhere") is None
+            assert _geocode(city=" london ") == {"lat": "1", "lon": "2"}
+        finally:
+            set_geocode_cache(previous)
+        assert mocked_session().get.call_count == 2
+        assert cache.stats()["hit_rate"] == 3 / 5
+
+
 class TestGeocodeDataFrame:
     @staticmethod
     @pytest.fixture
@@ -342,6 +578,41 @@ class TestGeocodeBatchDataframe:
         )
         assert mocked_geocode.mock_calls == expected_calls
 
+    @mock.patch(_GEOCODE)
+    def test_duplicates_are_only_geocoded_once(self, mocked_geocode):
+        mocked_geocode.side_effect = [
+            {"lat": "1", "lon": "4"},
+            None,
+            None,
+            {"lat": "2", "lon": "5"},
+        ]
+        df = pd.DataFrame(
+            {
+                "city": ["London", "Nowhere", "London", "Paris", "Nowhere"],
+                "country": ["UK", "X", "UK", "France", "X"],
+            },
+            index=[10, 8, 6, 4, 2],
+        )
+        geocoded = geocode_batch_dataframe(df)
+
+        assert mocked_geocode.mock_calls == [
+            mock.call(city="London", country="UK"),
+            mock.call(city="Nowhere", country="X"),
+            mock.call(q="Nowhere X"),
+            mock.call(city="Paris", country="France"),
+        ]
+        expected = pd.DataFrame(
+            {
+                "city": ["London", "Nowhere", "London", "Paris", "Nowhere"],
+                "country": ["UK", "X", "UK", "France", "X"],
+                "latitude": [1.0, None, 1.0, None, None],
+                "longitude": [4.0, None, 4.0, None, None],
+            },
+            index=[10, 8, 6, 4, 2],
+        )
+        expected.loc[4, ["latitude", "longitude"]] = [2.0, 5.0]
+        assert_frame_equal(geocoded, expected)
+
     @mock.patch(_GEOCODE)
     def test_valueerror_raised_when_invalid_query_method_passed(
         self, mocked_geocode, test_dataframe
@@ -387,75 +658,51 @@ class TestGeocodeBatchDataframe:
 
 
 class TestCountryIsoCode:
-    @mock.patch(PYCOUNTRY)
-    def test_lookup_via_name(self, mocked_pycountry):
-        mocked_pycountry.return_value = "country_object"
-        expected_calls = [mock.call(name="United Kingdom")]
+    def test_lookup_via_name(self):
+        assert country_iso_code("United Kingdom").alpha_3 == "GBR"
 
-        assert country_iso_code("United Kingdom") == "country_object"
-        assert mocked_pycountry.mock_calls == expected_calls
-        assert mocked_pycountry.call_count == 1
-        country_iso_code.cache_clear()
+    def test_lookup_via_common_name(self):
+        assert country_iso_code("Bolivia").alpha_2 == "BO"
 
-    @mock.patch(PYCOUNTRY)
-    def test_lookup_via_common_name(self, mocked_pycountry):
-        mocked_pycountry.side_effect = [KeyError(), "country_object"]
-        expected_calls = [
-            mock.call(name="United Kingdom"),
-            mock.call(common_name="United Kingdom"),
-        ]
-
-        assert country_iso_code("United Kingdom") == "country_object"
-        assert mocked_pycountry.mock_calls == expected_calls
-        assert mocked_pycountry.call_count == 2
-        country_iso_code.cache_clear()
-
-    @mock.patch(PYCOUNTRY)
-    def test_lookup_via_official_name(self, mocked_pycountry):
-        mocked_pycountry.side_effect = [KeyError(), KeyError(), "country_object"]
-        expected_calls = [
-            mock.call(name="United Kingdom"),
-            mock.call(common_name="United Kingdom"),
-            mock.call(official_name="United Kingdom"),
-        ]
+    def test_lookup_via_official_name(self):
+        assert country_iso_code("Plurinational State of Bolivia").alpha_2 == "BO"
 
-        assert country_iso_code("United Kingdom") == "country_object"
-        assert mocked_pycountry.mock_calls == expected_calls
-        assert mocked_pycountry.call_count == 3
-        country_iso_code.cache_clear()
-
-    @mock.patch(PYCOUNTRY)
-    def test_invalid_lookup_raises_keyerror(self, mocked_pycountry):
-        mocked_pycountry.side_effect = [KeyError(), KeyError(), KeyError()] * 2
+    def test_lookup_via_alias(self):
+        for name in ["UK", "Great Britain", "Scotland"]:
+            assert country_iso_code(name).alpha_2 == "GB"
+        assert country_iso_code("Ivory Coast").alpha_2 == "CI"
 
+    def test_invalid_lookup_raises_keyerror(self):
         with pytest.raises(KeyError) as e:
             country_iso_code("Fake Country")
         assert "Fake Country not found" in str(e.value)
-        country_iso_code.cache_clear()
+
+    def test_case_accents_and_punctuation_are_ignored(self):
+        names = ["united kingdom", "UNITED KINGDOM", " United  kingdom "]
+        assert {country_iso_code(name).alpha_2 for name in names} == {"GB"}
+        names = ["Côte d'Ivoire", "COTE D'IVOIRE", "Cote d’Ivoire"]
+        assert {country_iso_code(name).alpha_2 for name in names} == {"CI"}
+        assert normalise_country_name("Korea, Republic of") == "korea republic of"
 
     @mock.patch(PYCOUNTRY)
-    def test_title_case_is_applied(self, mocked_pycountry):
-        expected_calls = []
-        names = ["united kingdom", "UNITED KINGDOM", "United kingdom"]
-        mocked_pycountry.side_effect = [
-            KeyError(),
-            KeyError(),
-            KeyError(),
-            "blah",
-        ] * len(names)
-        for name in names:
-            country_iso_code(name)  # Find the iso codes
-            raw_call = mock.call(name=name)
-            common_call = mock.call(common_name=name)
-            official_call = mock.call(official_name=name)
-            title_call = mock.call(name="United Kingdom")
-            expected_calls.append(raw_call)  # The initial call
-            expected_calls.append(common_call)  # Tries common name call
-            expected_calls.append(official_call)  # Tries official name
-            expected_calls.append(title_call)  # The title case call
-        assert mocked_pycountry.mock_calls == expected_calls
-
-    country_iso_code.cache_clear()
+    def test_index_is_built_once_and_frozen(self, mocked_pycountry):
+        index = country_name_index()
+        country_iso_code("Belgium")
+        with pytest.raises(KeyError):
+            country_iso_code("Fake Country")
+        assert country_name_index() is index
+        assert mocked_pycountry.call_count == 0
+        with pytest.raises(TypeError):
+            index["atlantis"] = None
+
+
+def test_alpha2_to_continent_mapping_is_shared_and_frozen():
+    continents = alpha2_to_continent_mapping()
+    assert alpha2_to_continent_mapping() is continents
+    assert continents["GB"] == "EU"
+    assert continents["VA"] is None
+    with pytest.raises(TypeError):
+        continents["GB"] = "NA"
 
 
 class TestCountryIsoCodeDataframe:
@@ -524,6 +771,24 @@ class TestCountryIsoCodeDataframe:
             orient="records"
         )
 
+    @mock.patch(COUNTRY_ISO_CODE)
+    def test_unique_countries_are_looked_up_once(self, mocked_country_iso_code):
+        uk = self._mocked_response("GB", "GBR", "826", None)
+        mocked_country_iso_code.side_effect = [uk, KeyError()]
+        test_df = pd.DataFrame(
+            {"country": ["UK", "Atlantis", None, "UK", "Atlantis"]},
+            index=[5, 4, 3, 2, 1],
+        )
+        coded_df = country_iso_code_dataframe(test_df)
+
+        assert mocked_country_iso_code.mock_calls == [
+            mock.call("UK"),
+            mock.call("Atlantis"),
+        ]
+        assert list(coded_df.index) == [5, 4, 3, 2, 1]
+        assert coded_df["country_alpha_3"].tolist() == ["GBR", None, None, "GBR", None]
+        assert coded_df["continent"].tolist() == ["EU", None, None, "EU", None]
+
 
 class TestCountryIsoCodeToName:
     def test_valid_iso_code_returns_name(self):
@@ -589,3 +854,95 @@ def test_country_continent_lookup():
     assert len(non_nulls) > 100  # num countries
     assert len(non_nulls) < 1000  # num countries
     assert len(set(non_nulls.values())) == 7  # num continents
+
+
+@mock.patch(LOOKUP_SESSION)
+def test_lookups_are_read_from_snapshot(mocked_session, tmp_path):
+    files = {
+        COUNTRY_CODES_URL: "ISO3166-1-Alpha-2,ISO3166-1-Alpha-3\nGB,GBR\n",
+        CONTINENT_CODES_URL: '[{"Code": "EU", "Name": "Europe"}]',
+    }
+    mocked_session().get.side_effect = lambda url: mock.Mock(text=files[url])
+    try:
+        refresh_snapshot(tmp_path / "snapshot.json.gz")
+        mocked_session.reset_mock()
+        assert get_iso2_to_iso3_lookup()["GB"] == "GBR"
+        assert get_iso2_to_iso3_lookup(reverse=True)["GBR"] == "GB"
+        assert get_continent_lookup()["EU"] == "Europe"
+        assert "GB" not in get_eu_countries()
+        assert not mocked_session.called
+    finally:
+        set_snapshot()
+
+
+@mock.patch(LOOKUP_SESSION)
+def test_sources_are_fetched_without_snapshot(mocked_session, tmp_path):
+    mocked_session().get.side_effect = lambda url: mock.Mock(text=f"<{url}>")
+    previous = set_snapshot(tmp_path / "missing.json.gz")
+    try:
+        assert load_snapshot(tmp_path / "missing.json.gz")["files"] == {}
+        assert get_source(COUNTRY_CODES_URL) == f"<{COUNTRY_CODES_URL}>"
+    finally:
+        set_snapshot(previous)
+
+
+@mock.patch(LOOKUP_SESSION)
+def test_refresh_snapshot(mocked_session, tmp_path):
+    mocked_session().get.side_effect = lambda url: mock.Mock(text=f"<{url}>")
+    path = tmp_path / "data" / "snapshot.json.gz"
+    try:
+        snapshot = refresh_snapshot(path)
+        # Lookups are read from the refreshed snapshot
+        for url in SNAPSHOT_URLS:
+            assert get_source(url) == f"<{url}>"
+    finally:
+        set_snapshot()
+
+    assert load_snapshot(path) == snapshot
+    assert snapshot["files"] == {url: f"<{url}>" for url in SNAPSHOT_URLS}
+    assert set(snapshot["sources"]) == set(SNAPSHOT_URLS)
+
+
+class TestPostcodeIndex:
+    @staticmethod
+    @pytest.fixture
+    def index_path(tmp_path):
+        csv_path = tmp_path / "onspd.csv"
+        csv_path.write_text(
+            "pcds,lat,long\n"
+            "M1 1AE,53.47,-2.23\n"
+            "EC4A 3BF,51.51,-0.11\n"
+            "AB1 0AA,99.999999,0.000000\n"  # no grid reference
+            "B1 1AA,,\n"
+            "SW1A 1AA,51.50,-0.14\n"
+        )
+        index_path = tmp_path / "postcodes.idx"
+        assert build_postcode_index(csv_path, index_path) == 3
+        return index_path
+
+    def test_lookup(self, index_path):
+        with PostcodeIndex(index_path) as index:
+            assert len(index) == 3
+            assert index.lookup("EC4A 3BF") == {"lat": "51.51", "lon": "-0.11"}
+            assert index.lookup(" ec4a3bf") == {"lat": "51.51", "lon": "-0.11"}
+            assert index.lookup("m1 1ae") == {"lat": "53.47", "lon": "-2.23"}
+            assert index.lookup("SW1A1AA") == {"lat": "51.5", "lon": "-0.14"}
+            assert "SW1A 1AA" in index
+
+    def test_misses(self, index_path):
+        with PostcodeIndex(index_path) as index:
+            for postcode in [
+                "AB1 0AA",
+                "B1 1AA",
+                "A1 1AA",
+                "ZZ99 9ZZ",
+                "",
+                "M1 1AEXXXX",
+            ]:
+                assert index.lookup(postcode) is None
+
+    def test_not_an_index(self, tmp_path):
+        path = tmp_path / "not.idx"
+        path.write_bytes(b"0" * 64)
+        with pytest.raises(ValueError):
+            PostcodeIndex(path)
@@ -0,0 +1,123 @@
+"""
+cache
+=====
+
+A persistent, content-addressed store of HTTP response bodies, so that
+crashed or repeated runs can pick up from cached responses rather than
+hitting the upstream API again.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+from nesta_daps.common.lru import SQLiteLRU
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def make_key(url, params=None):
+    """Generate a stable key for a request, independent of parameter order.
+
+    Args:
+        url (str): The request URL.
+        params (dict): Any query parameters for the request.
+    Returns:
+        (str): SHA-256 hex digest of the URL and sorted parameters.
+    """
+    query = urlencode(sorted((params or {}).items()), doseq=True)
+    return hashlib.sha256(f"{url}?{query}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed store of (compressed) response bodies, keyed on a hash
+    of the URL and query parameters, with expiry and size-based eviction
+    of the least recently accessed bodies. Safe to share between threads.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        ttl (float): Seconds after which an entry expires (`None` for never).
+        max_bytes (int): Maximum total size of stored (compressed) bodies,
+                         beyond which entries are evicted (`None` for unbounded).
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=None):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lru = SQLiteLRU(self._conn, "responses", max_bytes, weight="size")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, url, params=None):
+        """Retrieve a cached response body.
+
+        Args:
+            url (str): The request URL.
+            params (dict): Any query parameters for the request.
+        Returns:
+            (str): The response body, or `None` if missing or expired.
+        """
+        key = make_key(url, params)
+        now = time.time()
+        with self._lock:
+            result = self._conn.execute(
+                "SELECT body, size, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if result is None:
+                return None
+            body, size, created = result
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._lru.removed(size)
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return zlib.decompress(body).decode()
+
+    def put(self, url, body, params=None):
+        """Store a response body, evicting old entries if over capacity.
+
+        Args:
+            url (str): The request URL.
+            body (str): The response body.
+            params (dict): Any query parameters for the request.
+        """
+        key = make_key(url, params)
+        blob = zlib.compress(body.encode())
+        now = time.time()
+        with self._lock:
+            self._lru.removed(self._lru.weigh(key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, url, blob, len(blob), now, now),
+            )
+            self._lru.added(len(blob))
+            self._lru.evict()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
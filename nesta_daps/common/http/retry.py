@@ -0,0 +1,298 @@
+"""
+retry
+=====
+
+A shared retry scheduler for all outbound fetchers, so that transient
+failures are retried with exponential backoff and jitter (honouring any
+:obj:`Retry-After` from the server), and so that an unhealthy host is
+given room to recover rather than being hammered with retries:
+
+* a circuit breaker per host stops all requests to it for a while after
+  :obj:`failure_threshold` consecutive failures, and then lets a single
+  probe request through to test whether it has recovered;
+* a retry budget per host caps retries to a fraction of successful
+  requests, so that retries can't multiply the load on a failing host.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import partial
+from functools import wraps
+from urllib.parse import urlparse
+from xml.etree.ElementTree import ParseError
+
+import requests
+
+from nesta_daps.common.http.session import RETRY_STATUSES
+
+MAX_ATTEMPTS = 10
+BACKOFF = 1  # seconds, doubled on each attempt
+MAX_BACKOFF = 300
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+BUDGET = 10  # retries available per host before any successes
+BUDGET_RATIO = 0.2  # retries earned per successful request
+# Failures which are transient whatever the status, e.g. a connection dropped
+# mid-body, which leaves a truncated (so unparseable) body behind
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+    ParseError,
+)
+
+_SCHEDULER = None
+_LOCK = threading.Lock()
+
+
+def is_retryable(exception):
+    """Is this a transient failure, i.e. one of :obj:`TRANSIENT_ERRORS`
+    or a response with one of :obj:`RETRY_STATUSES`?
+
+    Args:
+        exception (Exception): The raised exception.
+    Returns:
+        (bool)
+    """
+    if isinstance(exception, TRANSIENT_ERRORS):
+        return True
+    response = getattr(exception, "response", None)
+    return response is not None and response.status_code in RETRY_STATUSES
+
+
+def retry_after(exception):
+    """Seconds to wait according to any :obj:`Retry-After` header in the
+    response attached to the exception.
+
+    Args:
+        exception (Exception): The raised exception.
+    Returns:
+        (float): Seconds to wait, or `None` if not specified.
+    """
+    response = getattr(exception, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def url_host(url, *args, **kwargs):
+    """The host of a URL, i.e. the circuit for a function of :obj:`url`."""
+    return urlparse(url).netloc
+
+
+class CircuitOpenError(Exception):
+    """Raised by :obj:`RetryScheduler.call` when a host's circuit is open
+    and the caller chose not to wait for it."""
+
+
+class HostState:
+    """Circuit breaker and retry budget for a single host."""
+
+    def __init__(self, budget):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.tokens = budget
+
+
+class RetryScheduler:
+    """Call functions with retries, shared across threads and fetchers.
+    Backoff is "full jitter", i.e. uniformly random up to an exponentially
+    growing ceiling, which spreads out the retries of concurrent callers.
+
+    Args:
+        max_attempts (int): Maximum number of attempts per call.
+        backoff (float): Ceiling of the first backoff, in seconds.
+        max_backoff (float): Maximum backoff (and :obj:`Retry-After`), in seconds.
+        failure_threshold (int): Consecutive failures after which a host's
+                                 circuit is opened.
+        reset_timeout (float): Seconds for which an open circuit blocks requests.
+        budget (float): Retries available per host before any successes,
+                        which is also the cap on retries saved up.
+        budget_ratio (float): Retries earned per successful request.
+        wait (bool): Whether calls wait for an open circuit to half-open, or
+                     fail fast with :obj:`CircuitOpenError`.
+        sleep (callable): Function to sleep for a number of seconds.
+    """
+
+    def __init__(
+        self,
+        max_attempts=MAX_ATTEMPTS,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        failure_threshold=FAILURE_THRESHOLD,
+        reset_timeout=RESET_TIMEOUT,
+        budget=BUDGET,
+        budget_ratio=BUDGET_RATIO,
+        wait=True,
+        sleep=time.sleep,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.wait = wait
+        self.sleep = sleep
+        self.hosts = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.budget)
+        return state
+
+    def delay(self, attempt, exception=None):
+        """Seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): Number of attempts made so far.
+            exception (Exception): The exception raised by the last attempt.
+        Returns:
+            (float)
+        """
+        seconds = retry_after(exception)
+        if seconds is None:
+            seconds = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+        return min(seconds, self.max_backoff)
+
+    def _acquire(self, host):
+        """Block until the host's circuit allows a request."""
+        with self._cond:
+            state = self._state(host)
+            while state.opened_at is not None:
+                remaining = state.opened_at + self.reset_timeout - time.monotonic()
+                if remaining <= 0 and not state.probing:
+                    state.probing = True  # half-open: let a single probe through
+                    return
+                if not self.wait:
+                    raise CircuitOpenError(f"Circuit open for {host}")
+                self._cond.wait(timeout=remaining if remaining > 0 else None)
+
+    def _record(self, host, failed):
+        with self._cond:
+            state = self._state(host)
+            if not failed:
+                state.failures = 0
+                state.opened_at = None
+                state.tokens = min(self.budget, state.tokens + self.budget_ratio)
+            else:
+                state.failures += 1
+                if state.probing or state.failures >= self.failure_threshold:
+                    state.opened_at = time.monotonic()
+            state.probing = False
+            self._cond.notify_all()
+
+    def _release(self, host):
+        """End an attempt which says nothing about the host's health, e.g. a
+        non-retryable failure, letting another probe through if this was one."""
+        with self._cond:
+            self._state(host).probing = False
+            self._cond.notify_all()
+
+    def _spend_retry(self, host):
+        with self._cond:
+            state = self._state(host)
+            if state.tokens < 1:
+                return False
+            state.tokens -= 1
+            return True
+
+    def call(self, host, fn, retry_on=is_retryable):
+        """Call :obj:`fn`, retrying on failures which satisfy :obj:`retry_on`
+        while attempts and the host's retry budget allow.
+
+        Args:
+            host (str): The host (or any other key) of the circuit and budget.
+            fn (callable): Zero-argument function to call.
+            retry_on (callable): Predicate of an exception, whether to retry.
+        Returns:
+            The return value of :obj:`fn`.
+        Raises:
+            The last exception from :obj:`fn`, if out of attempts or budget.
+        """
+        attempt = 0
+        while True:
+            self._acquire(host)
+            attempt += 1
+            try:
+                result = fn()
+            except Exception as exception:
+                # Only transient failures count against the host's health,
+                # and other failures don't count towards it either
+                if not retry_on(exception):
+                    self._release(host)
+                    raise
+                self._record(host, failed=True)
+                if attempt >= self.max_attempts or not self._spend_retry(host):
+                    raise
+                self.sleep(self.delay(attempt, exception))
+            else:
+                self._record(host, failed=False)
+                return result
+
+
+def get_scheduler():
+    """Get the shared scheduler, creating it with the defaults on first use.
+
+    Returns:
+        scheduler (:obj:`RetryScheduler`)
+    """
+    global _SCHEDULER
+    with _LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = RetryScheduler()
+        return _SCHEDULER
+
+
+def set_scheduler(scheduler):
+    """Replace the shared scheduler, e.g. to change the backoff policy.
+
+    Args:
+        scheduler (:obj:`RetryScheduler`): The new shared scheduler, or `None` to
+                                           revert to the defaults on next use.
+    Returns:
+        The previous shared scheduler.
+    """
+    global _SCHEDULER
+    with _LOCK:
+        previous, _SCHEDULER = _SCHEDULER, scheduler
+    return previous
+
+
+def with_retries(host, retry_on=is_retryable):
+    """Decorate a function to be called through the shared scheduler.
+
+    Args:
+        host (str or callable): The host of the circuit, or a function of
+                                the decorated function's arguments which
+                                returns the host, e.g. :obj:`url_host`.
+        retry_on (callable): Predicate of an exception, whether to retry.
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            _host = host(*args, **kwargs) if callable(host) else host
+            call = partial(fn, *args, **kwargs)
+            return get_scheduler().call(_host, call, retry_on=retry_on)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,103 @@
+"""
+session
+=======
+
+A shared, pooled :obj:`requests.Session` for all outbound fetchers, so
+that connections are kept alive and reused rather than renegotiated
+(TCP and TLS handshakes) on every call.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 10
+TIMEOUT = (10, 60)  # (connect, read) in seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_SESSION = None
+_LOCK = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    """:obj:`requests.Session` which applies a default timeout to every request,
+    since :obj:`requests` otherwise waits forever.
+
+    Args:
+        timeout (float or tuple): Default (connect, read) timeout in seconds.
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def make_session(
+    pool_size=POOL_SIZE, timeout=TIMEOUT, retries=0, backoff_factor=0, adapter=None
+):
+    """Make a keep-alive session with a connection pool per host.
+
+    Args:
+        pool_size (int): Number of connections to keep alive per host, which should
+                         be at least the number of threads sharing the session.
+        timeout (float or tuple): Default (connect, read) timeout in seconds.
+        retries (int): Transport-level retries on connection errors and on
+                       :obj:`RETRY_STATUSES`. Zero leaves retrying to the caller,
+                       e.g. :obj:`nesta_daps.common.http.retry.with_retries`.
+        backoff_factor (float): See :obj:`urllib3.util.retry.Retry`.
+        adapter (:obj:`requests.adapters.BaseAdapter`): Transport to mount in place
+                                                        of the pooled HTTP adapter,
+                                                        e.g. a local stand-in.
+    Returns:
+        session (:obj:`TimeoutSession`)
+    """
+    if adapter is None:
+        max_retries = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries
+        )
+    session = TimeoutSession(timeout=timeout)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Get the shared session, creating it with the defaults on first use.
+
+    Returns:
+        session (:obj:`requests.Session`)
+    """
+    global _SESSION
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = make_session()
+        return _SESSION
+
+
+def set_session(session):
+    """Replace the shared session, e.g. to change the pool configuration
+    or to swap in a stand-in transport for testing.
+
+    Args:
+        session (:obj:`requests.Session`): The new shared session, or `None` to
+                                           revert to the defaults on next use.
+    Returns:
+        The previous shared session.
+    """
+    global _SESSION
+    with _LOCK:
+        previous, _SESSION = _SESSION, session
+    return previous
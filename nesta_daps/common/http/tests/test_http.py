@@ -0,0 +1,393 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from xml.etree.ElementTree import ParseError
+
+import pytest
+
+import requests
+from requests.adapters import BaseAdapter
+
+from nesta_daps.common.http.cache import make_key
+from nesta_daps.common.http.cache import ResponseCache
+from nesta_daps.common.http.retry import CircuitOpenError
+from nesta_daps.common.http.retry import RetryScheduler
+from nesta_daps.common.http.retry import retry_after
+from nesta_daps.common.http.retry import set_scheduler
+from nesta_daps.common.http.retry import url_host
+from nesta_daps.common.http.retry import with_retries
+from nesta_daps.common.http.session import get_session
+from nesta_daps.common.http.session import make_session
+from nesta_daps.common.http.session import set_session
+from nesta_daps.common.http.throttle import MemoryStore
+from nesta_daps.common.http.throttle import RateLimiter
+from nesta_daps.common.http.throttle import RedisStore
+from nesta_daps.common.http.throttle import SQLiteStore
+from nesta_daps.common.http.throttle import set_store
+
+TIME = "nesta_daps.common.http.cache.time.time"
+
+
+class TestResponseCache:
+    @staticmethod
+    @pytest.fixture
+    def cache(tmp_path):
+        cache = ResponseCache(tmp_path / "responses.db")
+        yield cache
+        cache.close()
+
+    def test_key_is_independent_of_param_order(self):
+        assert make_key("http://a", {"p": 1, "s": 2}) == make_key(
+            "http://a", {"s": 2, "p": 1}
+        )
+        assert make_key("http://a", {"p": 1}) != make_key("http://a", {"p": 2})
+        assert make_key("http://a") == make_key("http://a", {})
+
+    def test_round_trip(self, cache):
+        assert cache.get("http://a", {"p": 1}) is None
+        cache.put("http://a", "<xml/>", {"p": 1})
+        assert cache.get("http://a", {"p": 1}) == "<xml/>"
+        assert cache.get("http://a", {"p": 2}) is None
+        assert len(cache) == 1
+
+    def test_persists_across_instances(self, tmp_path):
+        ResponseCache(tmp_path / "responses.db").put("http://a", "body")
+        assert ResponseCache(tmp_path / "responses.db").get("http://a") == "body"
+
+    @mock.patch(TIME)
+    def test_expired_entries_are_dropped(self, mocked_time, tmp_path):
+        cache = ResponseCache(tmp_path / "responses.db", ttl=60)
+        mocked_time.return_value = 1000
+        cache.put("http://a", "body")
+        mocked_time.return_value = 1059
+        assert cache.get("http://a") == "body"
+        mocked_time.return_value = 1061
+        assert cache.get("http://a") is None
+        assert len(cache) == 0
+
+    @mock.patch(TIME)
+    def test_least_recently_accessed_are_evicted(self, mocked_time, tmp_path):
+        body = "x" * 1000  # compresses to 17 bytes
+        cache = ResponseCache(tmp_path / "responses.db", max_bytes=20)
+        mocked_time.return_value = 1
+        cache.put("http://a", body)
+        mocked_time.return_value = 2
+        cache.put("http://b", body)
+        assert len(cache) == 1
+        assert cache.get("http://a") is None
+        assert cache.get("http://b") == body
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Local HTTP/1.1 server which records the client port of each request"""
+
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self):
+        type(self).client_ports.append(self.client_address[1])
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInAdapter(BaseAdapter):
+    """Transport which serves a canned body without touching the network"""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request, kwargs))
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.body.encode()
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+class TestSession:
+    @staticmethod
+    @pytest.fixture
+    def server():
+        handler = type("Handler", (KeepAliveHandler,), {"client_ports": []})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield handler, f"http://127.0.0.1:{server.server_port}/"
+        server.shutdown()
+        server.server_close()
+
+    def test_connections_are_reused(self, server):
+        handler, url = server
+        session = make_session()
+        for _ in range(3):
+            assert session.get(url).text == "ok"
+        assert len(handler.client_ports) == 3
+        assert len(set(handler.client_ports)) == 1
+
+    def test_default_timeout_is_applied(self):
+        adapter = StandInAdapter("body")
+        session = make_session(timeout=3, adapter=adapter)
+        session.get("https://example.com")
+        session.get("https://example.com", timeout=7)
+        assert [kwargs["timeout"] for _, kwargs in adapter.sent] == [3, 7]
+
+    def test_pool_size_is_configurable(self):
+        session = make_session(pool_size=25, retries=2)
+        adapter = session.get_adapter("https://example.com")
+        assert adapter._pool_maxsize == 25
+        assert adapter.max_retries.total == 2
+
+    def test_shared_session_can_be_swapped(self):
+        stand_in = make_session(adapter=StandInAdapter("canned"))
+        previous = set_session(stand_in)
+        try:
+            assert get_session() is stand_in
+            assert get_session().get("https://example.com").text == "canned"
+        finally:
+            set_session(previous)
+        assert get_session() is not stand_in
+
+
+def http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+class Flaky:
+    """Callable which raises each of :obj:`errors` in turn, then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class TestRetryScheduler:
+    @staticmethod
+    @pytest.fixture
+    def sleeps():
+        return []
+
+    @staticmethod
+    @pytest.fixture
+    def scheduler(sleeps):
+        return RetryScheduler(backoff=1, max_backoff=30, sleep=sleeps.append)
+
+    def test_transient_failures_back_off_exponentially(self, scheduler, sleeps):
+        fn = Flaky(requests.ConnectionError(), http_error(503), http_error(502))
+        assert scheduler.call("a", fn) == "ok"
+        assert fn.calls == 4
+        assert len(sleeps) == 3
+        for attempt, seconds in enumerate(sleeps, 1):
+            assert 0 <= seconds <= 2 ** (attempt - 1)
+
+    def test_truncated_responses_are_retried(self, scheduler, sleeps):
+        fn = Flaky(
+            requests.exceptions.ChunkedEncodingError(),
+            requests.exceptions.ContentDecodingError(),
+            ParseError("no element found"),
+        )
+        assert scheduler.call("a", fn) == "ok"
+        assert fn.calls == 4
+
+    def test_other_failures_are_not_retried(self, scheduler, sleeps):
+        for error in (ValueError(), http_error(404)):
+            fn = Flaky(error)
+            with pytest.raises(type(error)):
+                scheduler.call("a", fn)
+            assert fn.calls == 1
+        assert sleeps == []
+
+    def test_attempts_are_limited(self, sleeps):
+        scheduler = RetryScheduler(max_attempts=3, sleep=sleeps.append)
+        fn = Flaky(*[requests.Timeout()] * 5)
+        with pytest.raises(requests.Timeout):
+            scheduler.call("a", fn)
+        assert fn.calls == 3
+
+    def test_retry_after_is_honoured(self, scheduler, sleeps):
+        fn = Flaky(http_error(429, {"Retry-After": "7"}))
+        assert scheduler.call("a", fn) == "ok"
+        assert sleeps == [7]
+        assert retry_after(http_error(429, {"Retry-After": "not a date"})) is None
+        assert retry_after(http_error(429, {"Retry-After": "600"})) == 600
+        assert scheduler.delay(1, http_error(429, {"Retry-After": "600"})) == 30
+
+    def test_retry_budget_is_per_host(self, sleeps):
+        scheduler = RetryScheduler(budget=2, budget_ratio=0.5, sleep=sleeps.append)
+        fn = Flaky(*[requests.Timeout()] * 5)
+        with pytest.raises(requests.Timeout):
+            scheduler.call("a", fn)
+        assert fn.calls == 3  # i.e. two retries
+        # Other hosts are unaffected, and successes earn retries back
+        assert scheduler.call("b", Flaky(requests.Timeout())) == "ok"
+        scheduler.call("a", Flaky())
+        scheduler.call("a", Flaky())
+        assert scheduler.call("a", Flaky(requests.Timeout())) == "ok"
+
+    def test_circuit_opens_and_then_half_opens(self, sleeps):
+        scheduler = RetryScheduler(
+            max_attempts=1,
+            failure_threshold=2,
+            reset_timeout=0.1,
+            wait=False,
+            sleep=sleeps.append,
+        )
+        for _ in range(2):
+            with pytest.raises(requests.ConnectionError):
+                scheduler.call("a", Flaky(requests.ConnectionError()))
+        fn = Flaky()
+        with pytest.raises(CircuitOpenError):
+            scheduler.call("a", fn)
+        assert fn.calls == 0
+        assert scheduler.call("b", fn) == "ok"
+        # A single probe is let through once the reset timeout has passed
+        time.sleep(0.1)
+        assert scheduler.call("a", fn) == "ok"
+        assert scheduler.hosts["a"].opened_at is None
+
+    def test_other_failures_are_not_successes(self, sleeps):
+        scheduler = RetryScheduler(
+            max_attempts=1,
+            failure_threshold=2,
+            reset_timeout=0.1,
+            budget=1,
+            wait=False,
+            sleep=sleeps.append,
+        )
+        with pytest.raises(requests.ConnectionError):
+            scheduler.call("a", Flaky(requests.ConnectionError()))
+        with pytest.raises(ValueError):
+            scheduler.call("a", Flaky(ValueError()))
+        assert scheduler.hosts["a"].failures == 1
+        assert scheduler.hosts["a"].tokens == 1
+        with pytest.raises(requests.ConnectionError):
+            scheduler.call("a", Flaky(requests.ConnectionError()))
+        # Nor does a probe which fails that way close the circuit
+        time.sleep(0.1)
+        with pytest.raises(ValueError):
+            scheduler.call("a", Flaky(ValueError()))
+        assert scheduler.hosts["a"].opened_at is not None
+        assert scheduler.call("a", Flaky()) == "ok"
+        assert scheduler.hosts["a"].opened_at is None
+
+    def test_waiting_calls_resume_when_circuit_closes(self, sleeps):
+        scheduler = RetryScheduler(
+            max_attempts=1, failure_threshold=1, reset_timeout=0.1, sleep=sleeps.append
+        )
+        with pytest.raises(requests.ConnectionError):
+            scheduler.call("a", Flaky(requests.ConnectionError()))
+        start = time.monotonic()
+        assert scheduler.call("a", Flaky()) == "ok"
+        assert time.monotonic() - start >= 0.09
+
+    def test_decorator_uses_shared_scheduler(self, scheduler, sleeps):
+        fn = Flaky(requests.ConnectionError())
+
+        @with_retries(host=url_host)
+        def fetch(url, **kwargs):
+            return fn()
+
+        previous = set_scheduler(scheduler)
+        try:
+            assert fetch("https://example.com/api", p=1) == "ok"
+        finally:
+            set_scheduler(previous)
+        assert list(scheduler.hosts) == ["example.com"]
+        assert len(sleeps) == 1
+
+
+class Clock:
+    """Stand-in clock, which only moves when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter:
+    @staticmethod
+    @pytest.fixture
+    def clock():
+        return Clock()
+
+    @staticmethod
+    @pytest.fixture(params=["memory", "sqlite"])
+    def store(request, clock, tmp_path):
+        if request.param == "memory":
+            yield MemoryStore(clock=clock)
+        else:
+            store = SQLiteStore(tmp_path / "buckets.db", clock=clock)
+            yield store
+            store.close()
+
+    def test_reservations_queue_up(self, store, clock):
+        limiter = RateLimiter(2, store=store, sleep=mock.Mock())
+        assert [limiter.acquire() for _ in range(4)] == [0, 0.5, 1.0, 1.5]
+        clock.now += 1.5
+        assert limiter.acquire() == 0.5
+
+    def test_bursts_up_to_capacity(self, store, clock):
+        limiter = RateLimiter(1, capacity=3, store=store, sleep=mock.Mock())
+        assert [limiter.acquire() for _ in range(4)] == [0, 0, 0, 1.0]
+        clock.now += 100  # refills, but only up to capacity
+        assert [limiter.acquire() for _ in range(4)] == [0, 0, 0, 1.0]
+
+    def test_workers_share_the_limit(self, store, clock):
+        """Two workers on the same key get half the rate each"""
+        sleeps = []
+        workers = [RateLimiter(1, key="host", store=store, sleep=sleeps.append)] * 2
+        other = RateLimiter(1, key="other", store=store, sleep=sleeps.append)
+        for worker in workers * 2:
+            worker.acquire()
+        other.acquire()
+        assert sleeps == [1.0, 2.0, 3.0]
+
+    def test_processes_share_sqlite_buckets(self, clock, tmp_path):
+        stores = [SQLiteStore(tmp_path / "buckets.db", clock=clock) for _ in range(2)]
+        waits = [store.reserve("host", 1, 1) for store in stores * 2]
+        assert waits == [0, 1.0, 2.0, 3.0]
+
+    def test_redis_store_reserves_atomically_in_redis(self):
+        client = mock.Mock()
+        client.eval.return_value = b"0.5"
+        assert RedisStore(client).reserve("host", 2, 1) == 0.5
+        script, n_keys, *args = client.eval.call_args[0]
+        assert "HMGET" in script
+        assert (n_keys, *args) == (1, "ratelimit:host", 2, 1, 1)
+
+    def test_decorator_uses_shared_store(self, clock):
+        sleeps = []
+        limiter = RateLimiter(10, key="host", sleep=sleeps.append)
+
+        @limiter
+        def fetch():
+            return "ok"
+
+        previous = set_store(MemoryStore(clock=clock))
+        try:
+            assert [fetch() for _ in range(3)] == ["ok"] * 3
+        finally:
+            set_store(previous)
+        assert sleeps == [0.1, 0.2]
@@ -0,0 +1,240 @@
+"""
+throttle
+========
+
+A token-bucket rate limiter whose buckets live in a pluggable store, so
+that many threads, processes or (e.g. Metaflow foreach) workers can share
+one limit: together they use all of the allowed rate, but never more.
+
+* :obj:`MemoryStore` shares a bucket between threads of one process;
+* :obj:`SQLiteStore` shares a bucket between processes on one machine,
+  through a lock on a SQLite file;
+* :obj:`RedisStore` shares a bucket between machines, through an injected
+  Redis-compatible client.
+
+Callers reserve tokens up front and then sleep until their reservation is
+due, rather than polling, so waiting callers are served in order.
+"""
+
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+_STORE = None
+_LOCK = threading.Lock()
+
+
+def take(tokens, updated, now, rate, capacity, n=1):
+    """Refill a bucket for the time elapsed since it was last updated,
+    and reserve :obj:`n` tokens from it, going into debt if need be.
+
+    Args:
+        tokens (float): Tokens in the bucket when last updated, or `None` for a new (full) bucket.
+        updated (float): Time when last updated.
+        now (float): The current time.
+        rate (float): Tokens added per second.
+        capacity (float): Maximum tokens in the bucket, i.e. the burst size.
+        n (float): Tokens to reserve.
+    Returns:
+        (tokens, wait) (tuple): Tokens now in the bucket, and seconds until
+                                the reservation is due.
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    tokens -= n
+    return tokens, max(0.0, -tokens / rate)
+
+
+class MemoryStore:
+    """Buckets shared between threads of one process (and a stand-in
+    for the shared stores in tests).
+
+    Args:
+        clock (callable): Function returning the current time in seconds.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, capacity, n=1):
+        """Reserve tokens from a bucket.
+
+        Args:
+            key (str): The bucket.
+            rate (float): Tokens added per second.
+            capacity (float): Maximum tokens in the bucket.
+            n (float): Tokens to reserve.
+        Returns:
+            (float): Seconds until the reservation is due.
+        """
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self.buckets.get(key, (None, now))
+            tokens, wait = take(tokens, updated, now, rate, capacity, n)
+            self.buckets[key] = (tokens, now)
+        return wait
+
+
+class SQLiteStore:
+    """Buckets shared between processes on one machine, in a SQLite file.
+    Reservations are made under an exclusive lock on the database.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        timeout (float): Seconds to wait for the lock.
+        clock (callable): Function returning the current time in seconds,
+                          which must be shared by all processes.
+    """
+
+    def __init__(self, path, timeout=30, clock=time.time):
+        self.path = str(path)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=timeout, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def reserve(self, key, rate, capacity, n=1):
+        """See :obj:`MemoryStore.reserve`"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = self.clock()
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row is not None else (None, now)
+                tokens, wait = take(tokens, updated, now, rate, capacity, n)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return wait
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+# Atomic equivalent of `take` for Redis, timed by the Redis server so that
+# workers' clocks needn't agree. Floats are returned as strings, since Lua
+# numbers are otherwise truncated to integers in replies.
+RESERVE_SCRIPT = """
+local rate, capacity, n = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+tokens = tokens - n
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return tostring(math.max(0, -tokens / rate))
+"""
+
+
+class RedisStore:
+    """Buckets shared between machines, in Redis (or anything which implements
+    :obj:`eval` of Lua scripts). Buckets expire once they would be full again.
+
+    Args:
+        client: A Redis-compatible client, e.g. :obj:`redis.Redis`.
+        prefix (str): Prefix of the bucket keys.
+    """
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def reserve(self, key, rate, capacity, n=1):
+        """See :obj:`MemoryStore.reserve`"""
+        wait = self.client.eval(RESERVE_SCRIPT, 1, self.prefix + key, rate, capacity, n)
+        return float(wait)
+
+
+def get_store():
+    """Get the shared store, creating a :obj:`MemoryStore` on first use.
+
+    Returns:
+        store
+    """
+    global _STORE
+    with _LOCK:
+        if _STORE is None:
+            _STORE = MemoryStore()
+        return _STORE
+
+
+def set_store(store):
+    """Replace the shared store, e.g. to share limits between processes.
+
+    Args:
+        store: The new shared store, or `None` to revert to a :obj:`MemoryStore`
+               on next use.
+    Returns:
+        The previous shared store.
+    """
+    global _STORE
+    with _LOCK:
+        previous, _STORE = _STORE, store
+    return previous
+
+
+class RateLimiter:
+    """Limit the rate of calls sharing a key (e.g. a host) to :obj:`max_per_second`,
+    allowing bursts of up to :obj:`capacity` calls. Can be used as a decorator.
+
+    Args:
+        max_per_second (float): Maximum sustained rate of calls.
+        key (str): The bucket, shared by all limiters with the same key and store.
+        capacity (float): Maximum burst of calls.
+        store: Store of the buckets, by default the shared store (see :obj:`set_store`).
+        sleep (callable): Function to sleep for a number of seconds.
+    """
+
+    def __init__(
+        self, max_per_second, key="default", capacity=1, store=None, sleep=time.sleep
+    ):
+        self.max_per_second = max_per_second
+        self.key = key
+        self.capacity = capacity
+        self.store = store
+        self.sleep = sleep
+
+    def acquire(self, n=1):
+        """Block until :obj:`n` calls are allowed.
+
+        Returns:
+            (float): Seconds waited.
+        """
+        store = self.store if self.store is not None else get_store()
+        wait = store.reserve(self.key, self.max_per_second, self.capacity, n)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            return fn(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,89 @@
+"""
+lru
+===
+
+Least recently accessed eviction from a SQLite table, for the persistent
+caches. The table's total weight (its number of rows, or the sum of a size
+column) is measured once, and then kept up to date as rows are written and
+deleted, so that checking the limit on every write doesn't scan the table.
+"""
+
+
+class SQLiteLRU:
+    """Evict the least recently accessed rows of a table with "key" and
+    (indexed) "accessed" columns, once its total weight exceeds a limit.
+    Callers report the weight of every row that they write or delete through
+    :obj:`added` and :obj:`removed`, and must hold any lock on the connection.
+
+    Note that the running total only counts this instance's changes, so other
+    processes writing to the same file are only accounted for when reopened.
+
+    Args:
+        conn (:obj:`sqlite3.Connection`): Connection to the database.
+        table (str): The table.
+        limit (int): Maximum total weight (`None` for unbounded).
+        weight (str): Column with the weight of each row, or `None` to count rows.
+    """
+
+    def __init__(self, conn, table, limit, weight=None):
+        self.conn = conn
+        self.table = table
+        self.limit = limit
+        self.weight = weight
+        self.total = self._measure()
+
+    def _measure(self):
+        weight = "COUNT(*)" if self.weight is None else f"SUM({self.weight})"
+        (total,) = self.conn.execute(f"SELECT {weight} FROM {self.table}").fetchone()
+        return total or 0
+
+    def weigh(self, key):
+        """The weight of a row, or 0 if there is no such row.
+
+        Args:
+            key (str): The row's key.
+        Returns:
+            (int)
+        """
+        weight = "1" if self.weight is None else self.weight
+        row = self.conn.execute(
+            f"SELECT {weight} FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def added(self, weight=1):
+        """Account for a row which has been written."""
+        self.total += weight
+
+    def removed(self, weight=1):
+        """Account for a row which has been deleted."""
+        self.total -= weight
+
+    @property
+    def over_limit(self):
+        """Whether any rows need to be evicted."""
+        return self.limit is not None and self.total > self.limit
+
+    def evict(self):
+        """Delete the least recently accessed rows until within :obj:`limit`.
+
+        Returns:
+            (:obj:`list` of :obj:`str`): Keys of the deleted rows.
+        """
+        if not self.over_limit:
+            return []
+        weight = "1" if self.weight is None else self.weight
+        to_delete = []
+        for key, size in self.conn.execute(
+            f"SELECT key, {weight} FROM {self.table} ORDER BY accessed ASC"
+        ):
+            if self.total <= self.limit:
+                break
+            to_delete.append(key)
+            self.total -= size
+        else:
+            self.total = 0  # i.e. every row is to be deleted
+        self.conn.executemany(
+            f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in to_delete]
+        )
+        return to_delete
@@ -0,0 +1,34 @@
+import gzip
+
+import pytest
+
+from nesta_daps.common.atomic import atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / "nested" / "file.txt"
+    with atomic_write(path) as f:
+        f.write("first")
+    with atomic_write(path) as f:
+        f.write("second")
+    assert path.read_text() == "second"
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_failed_write_leaves_file_untouched(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("original")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert path.read_text() == "original"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_custom_opener(tmp_path):
+    path = tmp_path / "file.txt.gz"
+    with atomic_write(path, "wt", opener=gzip.open, encoding="utf-8") as f:
+        f.write("zipped")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read() == "zipped"
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from nesta_daps.common.lru import SQLiteLRU
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "cache.db", isolation_level=None)
+    conn.execute(
+        "CREATE TABLE entries (key TEXT PRIMARY KEY, size INTEGER, accessed REAL)"
+    )
+    yield conn
+    conn.close()
+
+
+def put(conn, lru, key, size, accessed):
+    lru.removed(lru.weigh(key))
+    conn.execute(
+        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, size, accessed)
+    )
+    lru.added(size if lru.weight else 1)
+    return lru.evict()
+
+
+def keys(conn):
+    return [key for (key,) in conn.execute("SELECT key FROM entries ORDER BY key")]
+
+
+def test_rows_are_counted(conn):
+    lru = SQLiteLRU(conn, "entries", limit=2)
+    assert put(conn, lru, "a", 10, 1) == []
+    assert put(conn, lru, "b", 10, 2) == []
+    assert put(conn, lru, "a", 10, 3) == []  # replaced, not added
+    assert lru.total == 2
+    assert put(conn, lru, "c", 10, 4) == ["b"]
+    assert keys(conn) == ["a", "c"]
+    assert lru.total == 2
+
+
+def test_rows_are_weighed(conn):
+    lru = SQLiteLRU(conn, "entries", limit=25, weight="size")
+    put(conn, lru, "a", 10, 1)
+    put(conn, lru, "b", 10, 2)
+    assert put(conn, lru, "a", 15, 3) == []
+    assert lru.total == 25
+    assert put(conn, lru, "c", 20, 4) == ["b", "a"]
+    assert keys(conn) == ["c"]
+    assert lru.total == 20
+
+
+def test_total_is_measured_on_open(conn):
+    conn.executemany(
+        "INSERT INTO entries VALUES (?, ?, ?)", [("a", 10, 1), ("b", 20, 2)]
+    )
+    assert SQLiteLRU(conn, "entries", limit=None).total == 2
+    assert SQLiteLRU(conn, "entries", limit=None, weight="size").total == 30
+    assert not SQLiteLRU(conn, "entries", limit=None).over_limit
+
+
+def test_oversized_rows_empty_the_table(conn):
+    lru = SQLiteLRU(conn, "entries", limit=5, weight="size")
+    assert put(conn, lru, "a", 10, 1) == ["a"]
+    assert keys(conn) == []
+    assert lru.total == 0
@@ -0,0 +1,118 @@
+"""
+GtR entity cache
+================
+
+Memoize linked GtR entities (organisations, persons, funds, etc) which
+would otherwise be downloaded and flattened again for every project
+that links to them.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from nesta_daps.common.atomic import atomic_write
+
+MAXSIZE = 100000
+
+
+class EntityCache:
+    """Bounded in-memory LRU cache of flattened GtR entities, keyed on the
+    :obj:`(entity, id)` pair extracted from the entity's URL, with an optional
+    on-disk tier which persists entities beyond LRU eviction and across runs.
+
+    Concurrent requests for the same key are collapsed into a single fetch.
+    Note that cached rows are shared, and so should be treated as read-only.
+
+    Args:
+        maxsize (int): Maximum number of entities to hold in memory.
+        path (str): Optional directory in which to persist entities as JSON.
+    """
+
+    def __init__(self, maxsize=MAXSIZE, path=None):
+        self.maxsize = maxsize
+        self.path = None if path is None else Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._lru = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lru)
+
+    def __contains__(self, key):
+        return key in self._lru
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served from either tier of the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key, fetch):
+        """Return the entity stored under :obj:`key`, calling :obj:`fetch`
+        (exactly once, even across threads) if it has not been seen before.
+
+        Args:
+            key (tuple): The :obj:`(entity, id)` pair of the entity.
+            fetch (callable): Zero-argument function which returns the entity.
+        Returns:
+            row (dict): The flattened entity.
+        """
+        while True:
+            with self._lock:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    self.hits += 1
+                    return self._lru[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = threading.Event()
+                    break
+            # Another thread is already fetching this entity, so wait for it
+            pending.wait()
+        try:
+            row = self._read(key)
+            from_disk = row is not None
+            if not from_disk:
+                row = fetch()
+                self._write(key, row)
+            with self._lock:
+                self.hits += from_disk
+                self.disk_hits += from_disk
+                self.misses += not from_disk
+                self._lru[key] = row
+                if len(self._lru) > self.maxsize:
+                    self._lru.popitem(last=False)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+        return row
+
+    def clear(self):
+        """Empty the in-memory tier and reset the counters."""
+        with self._lock:
+            self._lru.clear()
+            self.hits, self.misses, self.disk_hits = 0, 0, 0
+
+    def _filename(self, key):
+        entity, _id = key
+        return self.path / entity.replace("/", "_") / f"{_id}.json"
+
+    def _read(self, key):
+        if self.path is None:
+            return None
+        try:
+            with open(self._filename(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, row):
+        if self.path is None:
+            return
+        with atomic_write(self._filename(key)) as f:
+            json.dump(row, f)
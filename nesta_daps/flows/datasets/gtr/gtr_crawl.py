@@ -0,0 +1,281 @@
+"""
+GtR crawl state
+===============
+
+Checkpointing of GtR crawls, so that each run only re-extracts and
+re-emits projects (and entities) whose content has changed since the
+previous run, as a delta of upserts and deletes per table, and so that
+a crashed run can resume from its last completed page.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from nesta_daps.common.atomic import atomic_write
+from nesta_daps.flows.datasets.gtr.gtr_sink import TableWriter
+
+ID_KEY = "{http://gtr.rcuk.ac.uk/gtr/api}id"
+PROJECTS = "projects"
+LINK_TABLE = "link_table"
+PARTICIPANT = "participant"
+
+
+def content_hash(value):
+    """Stable (i.e. cross-process) hash of a JSON-like value, independent
+    of dict ordering.
+
+    Args:
+        value: A row of data, or a raw XML string.
+    Returns:
+        (str): Hex digest.
+    """
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha1(value).hexdigest()
+
+
+class DeltaCrawl:
+    """Data holder which filters an incremental crawl down to a delta against
+    the checkpoint from the previous run. Projects whose raw XML is unchanged
+    should be skipped entirely (see :obj:`is_changed`), and rows are only
+    forwarded to :obj:`upserts` if new or changed. Deletes are collected per
+    table: vanished projects, the link table entries (by project id) of any
+    vanished or changed project, which are replaced by the new entries, and
+    the participants (by id) of vanished projects or which have dropped out
+    of a changed project. Deletes should be applied before upserts.
+
+    Note that other entities (organisations, persons, etc) are shared between
+    projects so are never deleted, and are only re-checked when a project
+    linking to them has changed.
+
+    Args:
+        path (str): Checkpoint file, read at the start and written by :obj:`close`.
+                    If `None` then nothing is checkpointed, i.e. a full crawl.
+        upserts: Data holder for new and changed rows, e.g. :obj:`ColumnarSink`.
+        preprocess (callable): See :obj:`ColumnarSink`.
+    """
+
+    def __init__(self, path, upserts, preprocess=None):
+        self.path = path
+        self.upserts = upserts
+        self.preprocess = preprocess
+        self.projects = {}
+        self.entities = defaultdict(dict)
+        self.participants = {}  # participant ids by project id
+        self.replaced = {}  # previous participant ids of changed projects
+        self.seen = set()
+        self.deletes = defaultdict(list)
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.projects = state["projects"]
+            self.entities.update(state["entities"])
+            self.participants = state.get("participants", {})
+
+    def __getitem__(self, table_name):
+        return TableWriter(self, table_name)
+
+    def is_changed(self, project):
+        """Has this project's content changed since the previous run?
+
+        Args:
+            project (:obj:`xml.etree.ElementTree`): A GtR XML project entity.
+        Returns:
+            (bool): `False` if the project can be skipped.
+        """
+        return self.update(project.attrib[ID_KEY], content_hash(ET.tostring(project)))
+
+    def update(self, project_id, digest):
+        """Mark a project as seen with the given content hash.
+
+        Args:
+            project_id (str): The project's GtR id.
+            digest (str): The :obj:`content_hash` of the project's raw XML.
+        Returns:
+            (bool): `False` if the project is unchanged since the previous run.
+        """
+        self.seen.add(project_id)
+        previous = self.projects.get(project_id)
+        if previous == digest:
+            return False
+        if previous is not None:
+            self.deletes[LINK_TABLE].append(project_id)
+            self.replaced[project_id] = self.participants.pop(project_id, [])
+        self.projects[project_id] = digest
+        return True
+
+    def write(self, table_name, row):
+        """Forward a row to :obj:`upserts` (via :obj:`preprocess`, if set),
+        unless it is identical to the last time that it was seen."""
+        rows = [(table_name, row)]
+        if self.preprocess is not None:
+            rows = self.preprocess(table_name, row)
+        for _table_name, _row in rows:
+            # Participants belong to a project, which is only known from their links
+            if _table_name == LINK_TABLE:
+                project_id, _, entity_id, entity_table = _row
+                if entity_table == f"gtr_{PARTICIPANT}":
+                    participants = self.participants.setdefault(project_id, [])
+                    participants.append(str(entity_id))
+            # Projects have already been checked, and links belong to them
+            if _table_name not in (PROJECTS, LINK_TABLE) and "id" in _row:
+                hashes = self.entities[_table_name]
+                digest = content_hash(_row)
+                if hashes.get(str(_row["id"])) == digest:
+                    continue
+                hashes[str(_row["id"])] = digest
+            self.upserts[_table_name].append(_row)
+
+    def close(self, complete=True):
+        """Finish the crawl, close :obj:`upserts` and write the checkpoint.
+
+        Args:
+            complete (bool): Whether every page was crawled, in which case
+                             any projects which weren't seen are deleted.
+        Returns:
+            deletes (dict): Mapping of table name to the ids to delete.
+        """
+        if complete:
+            for project_id in set(self.projects) - self.seen:
+                del self.projects[project_id]
+                self.deletes[PROJECTS].append(project_id)
+                self.deletes[LINK_TABLE].append(project_id)
+                self._delete_participants(self.participants.pop(project_id, []))
+        for project_id, participants in self.replaced.items():
+            current = set(self.participants.get(project_id, []))
+            self._delete_participants([p for p in participants if p not in current])
+        self.replaced = {}
+        if hasattr(self.upserts, "close"):
+            self.upserts.close()
+        if self.path is not None:
+            state = {
+                "projects": self.projects,
+                "entities": self.entities,
+                "participants": self.participants,
+            }
+            write_json(self.path, state)
+        return self.deletes
+
+    def _delete_participants(self, participant_ids):
+        hashes = self.entities[PARTICIPANT]
+        for participant_id in participant_ids:
+            # Forget the row, so that it is upserted again if it ever reappears
+            hashes.pop(participant_id, None)
+            self.deletes[PARTICIPANT].append(participant_id)
+
+
+class PageManifest:
+    """Data holder which checkpoints a crawl page by page, in front of a
+    :obj:`DeltaCrawl`. Rows are buffered in order until :obj:`complete` is
+    called for the page, at which point the page's rows (and project hashes) are
+    written to :obj:`path/page-<page>.json` and the page is recorded in
+    :obj:`path/manifest.json`. A restarted crawl should :obj:`replay` the
+    completed pages and then only fetch the :obj:`pending` ones.
+
+    Args:
+        path (str): Directory for the manifest and page files.
+        data (:obj:`DeltaCrawl`): Data holder for the rows of completed pages.
+    """
+
+    def __init__(self, path, data):
+        self.path = Path(path)
+        self.data = data
+        self.completed = []
+        self.manifest = self.path / "manifest.json"
+        if self.manifest.exists():
+            with open(self.manifest) as f:
+                self.completed = json.load(f)["completed"]
+        self._reset()
+
+    def _reset(self):
+        self.projects = {}
+        self.rows = []  # (table_name, row) pairs, in the order they were written
+
+    def _filename(self, page):
+        return self.path / f"page-{page:05d}.json"
+
+    def __getitem__(self, table_name):
+        return TableWriter(self, table_name)
+
+    def pending(self, pages):
+        """Filter out any completed pages.
+
+        Args:
+            pages (:obj:`iterable` of :obj:`int`): Page numbers to crawl.
+        Returns:
+            (list): Page numbers still to be crawled.
+        """
+        completed = set(self.completed)
+        return [page for page in pages if page not in completed]
+
+    def is_changed(self, project):
+        """See :obj:`DeltaCrawl.is_changed`, recording the project's hash
+        against the current page."""
+        changed = self.data.is_changed(project)
+        project_id = project.attrib[ID_KEY]
+        self.projects[project_id] = self.data.projects[project_id]
+        return changed
+
+    def write(self, table_name, row):
+        """Buffer a row until the current page is complete."""
+        self.rows.append((table_name, row))
+
+    def complete(self, page):
+        """Checkpoint the current page, and forward its rows to :obj:`data`.
+
+        Args:
+            page (int): The page number which has just been crawled.
+        """
+        page_data = {"projects": self.projects, "rows": self.rows}
+        write_json(self._filename(page), page_data)
+        self._forward(page_data)
+        self.completed.append(page)
+        write_json(self.manifest, {"completed": self.completed})
+        self._reset()
+
+    def replay(self):
+        """Forward the rows of pages completed by a previous (crashed) run
+        to :obj:`data`, in their original order.
+
+        Returns:
+            (int): The number of pages replayed.
+        """
+        for page in self.completed:
+            with open(self._filename(page)) as f:
+                self._forward(json.load(f))
+        return len(self.completed)
+
+    def _forward(self, page_data):
+        for project_id, digest in page_data["projects"].items():
+            self.data.update(project_id, digest)
+        # Rows are forwarded in their original order, since preprocessing may
+        # depend on it (e.g. a project's row follows its nested entities)
+        for table_name, row in page_data["rows"]:
+            self.data.write(table_name, row)
+
+    def close(self, complete=True):
+        """Close :obj:`data` and, if the crawl is complete, clear the
+        manifest so that the next crawl starts from scratch.
+
+        Args:
+            complete (bool): See :obj:`DeltaCrawl.close`.
+        Returns:
+            deletes (dict): See :obj:`DeltaCrawl.close`.
+        """
+        deletes = self.data.close(complete=complete)
+        if complete:
+            for page in self.completed:
+                self._filename(page).unlink()
+            self.manifest.unlink(missing_ok=True)
+            self.completed = []
+        return deletes
+
+
+def write_json(path, value):
+    """Atomically write a JSON-like value to a file, see :obj:`atomic_write`"""
+    with atomic_write(path) as f:
+        json.dump(value, f, default=str)
@@ -0,0 +1,267 @@
+"""
+GtR columnar sink
+=================
+
+Write flattened GtR entity tables to Parquet a record batch at a time,
+so that a full crawl runs in bounded memory and produces files which
+are ready for bulk loading.
+"""
+
+import json
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nesta_daps.common.atomic import atomic_write
+
+BATCH_SIZE = 10000
+
+
+def to_arrow(values):
+    """Convert a column of row values to an Arrow array. Nested values are
+    serialised to JSON, and columns of mixed type fall back to strings.
+
+    Args:
+        values (list): Column values, with `None` for missing values.
+    Returns:
+        (:obj:`pyarrow.Array`)
+    """
+    if any(isinstance(v, (dict, list)) for v in values):
+        values = [v if v is None else json.dumps(v) for v in values]
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([v if v is None else str(v) for v in values])
+
+
+def common_type(a, b):
+    """The narrowest Arrow type to which columns of types :obj:`a` and :obj:`b`
+    can both be cast. Numbers are widened to floats, and any other conflict
+    falls back to strings (as in :obj:`to_arrow`).
+
+    Args:
+        a, b (:obj:`pyarrow.DataType`): The column types.
+    Returns:
+        (:obj:`pyarrow.DataType`)
+    """
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in (a, b)):
+        return pa.float64()
+    return pa.string()
+
+
+def conform(table, schema):
+    """Cast a table to a (wider) schema, adding any missing columns as nulls.
+
+    Args:
+        table (:obj:`pyarrow.Table`): The table to cast.
+        schema (:obj:`pyarrow.Schema`): The schema, with a field for every column.
+    Returns:
+        (:obj:`pyarrow.Table`)
+    """
+    columns = [
+        (
+            table[field.name].cast(field.type, safe=False)
+            if field.name in table.column_names
+            else pa.nulls(len(table), field.type)
+        )
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class BatchBuilder:
+    """Accumulate the rows of a single table column-wise, flushing them
+    to a new Parquet part file every :obj:`batch_size` rows. Fields which
+    are missing from any row are filled with nulls.
+
+    Rows are dicts or, for a table with fixed :obj:`fields` (such as the link
+    table), tuples of values which are appended straight onto their columns,
+    without building a dict per row.
+
+    Every part of a table has the same :obj:`schema`, so that the parts can
+    be read as one dataset. The schema is fixed by the first flush and only
+    ever widened (see :obj:`common_type`) by later batches, with new fields
+    added at the end, in which case the parts already written are rewritten.
+
+    Args:
+        path (str): Directory for this table's part files.
+        batch_size (int): Number of rows per record batch.
+        fields (tuple): The fields of any rows which are given as tuples.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, fields=None):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.fields = fields
+        self.columns = {}
+        self._positional = None  # see _position
+        self.schema = None
+        self.n_buffered = 0
+        self.n_parts = 0
+        self.n_rows = 0
+
+    def append(self, row):
+        """Add a row (dict, or tuple of :obj:`fields`) to the current batch."""
+        if isinstance(row, tuple):
+            appends = self._positional or self._position()
+            if appends is not None:
+                for append, value in zip(appends, row):
+                    append(value)
+                self.n_buffered += 1
+                self.n_rows += 1
+                if self.n_buffered >= self.batch_size:
+                    self.flush()
+                return
+            row = dict(zip(self.fields, row))
+        n_buffered = self.n_buffered
+        for field, value in row.items():
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = [None] * n_buffered
+                self._positional = None
+            column.append(value)
+        self.n_buffered = n_buffered = n_buffered + 1
+        self.n_rows += 1
+        # Pad out any fields which weren't in this row
+        for column in self.columns.values():
+            if len(column) < n_buffered:
+                column.append(None)
+        if n_buffered >= self.batch_size:
+            self.flush()
+
+    def _position(self):
+        """The columns' appenders in the order of :obj:`fields`, or `None`
+        if the batch has any other columns."""
+        if self.columns and list(self.columns) != list(self.fields):
+            return None
+        self._positional = [
+            self.columns.setdefault(field, [None] * self.n_buffered).append
+            for field in self.fields
+        ]
+        return self._positional
+
+    def flush(self):
+        """Write the current batch, if any, to a new part file."""
+        if self.n_buffered == 0:
+            return
+        table = pa.table(
+            {name: to_arrow(column) for name, column in self.columns.items()}
+        )
+        schema = self.widen(table.schema)
+        if self.n_parts > 0 and schema != self.schema:
+            for part in range(self.n_parts):
+                self._write(part, conform(pq.read_table(self._filename(part)), schema))
+        self.schema = schema
+        self._write(self.n_parts, conform(table, schema))
+        self.n_parts += 1
+        self.columns = {}
+        self._positional = None
+        self.n_buffered = 0
+
+    def widen(self, schema):
+        """The table's schema, widened to fit a batch with the given schema.
+
+        Args:
+            schema (:obj:`pyarrow.Schema`): Schema of the batch.
+        Returns:
+            (:obj:`pyarrow.Schema`)
+        """
+        if self.schema is None:
+            return schema
+        widened = self.schema
+        for field in schema:
+            i = widened.get_field_index(field.name)
+            if i == -1:
+                widened = widened.append(field)
+                continue
+            _type = common_type(widened.field(i).type, field.type)
+            if _type != widened.field(i).type:
+                widened = widened.set(i, pa.field(field.name, _type))
+        return widened
+
+    def _filename(self, part):
+        return self.path / f"part-{part:05d}.parquet"
+
+    def _write(self, part, table):
+        with atomic_write(self._filename(part), "wb") as f:
+            pq.write_table(table, f)
+
+
+class ColumnarSink:
+    """Drop-in replacement for the :obj:`defaultdict(list)` data holder, for
+    code which only appends rows to tables, i.e. :obj:`sink[table].append(row)`.
+    Each table is written to :obj:`path/table/part-*.parquet`, and the parts
+    of every table from any previous run are cleared out when the sink is
+    opened, so that the output only ever holds the rows of the current run.
+
+    Args:
+        path (str): Output directory.
+        batch_size (int): Number of rows per record batch, per table.
+        preprocess (callable): Optional generator function of :obj:`(table_name, row)`
+                               yielding the :obj:`(table_name, row)` pairs to
+                               actually write, e.g. to split rows across tables.
+        fields (dict): The fields of any tables whose rows are given as tuples
+                       (see :obj:`BatchBuilder`), by table name.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, preprocess=None, fields=None):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.preprocess = preprocess
+        self.fields = fields or {}
+        self.tables = {}
+        for stale in self.path.glob("*/part-*.parquet"):
+            stale.unlink()
+
+    def __getitem__(self, table_name):
+        return TableWriter(self, table_name)
+
+    def __contains__(self, table_name):
+        return table_name in self.tables
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def items(self):
+        return self.tables.items()
+
+    def write(self, table_name, row):
+        """Write a row to a table (via :obj:`preprocess`, if set)."""
+        rows = [(table_name, row)]
+        if self.preprocess is not None:
+            rows = self.preprocess(table_name, row)
+        for _table_name, _row in rows:
+            builder = self.tables.get(_table_name)
+            if builder is None:
+                builder = BatchBuilder(
+                    self.path / _table_name,
+                    self.batch_size,
+                    fields=self.fields.get(_table_name),
+                )
+                self.tables[_table_name] = builder
+            builder.append(_row)
+
+    def close(self):
+        """Flush any remaining rows in all tables."""
+        for builder in self.tables.values():
+            builder.flush()
+
+
+class TableWriter:
+    """List-like handle on a single table of a :obj:`ColumnarSink` (or
+    anything else with a :obj:`write(table_name, row)` method)"""
+
+    def __init__(self, sink, table_name):
+        self.sink = sink
+        self.table_name = table_name
+
+    def append(self, row):
+        self.sink.write(self.table_name, row)
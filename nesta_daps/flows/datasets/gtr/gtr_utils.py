@@ -7,25 +7,85 @@ the official API, unpacking all data recursively through
 project entities.
 """
 
+import io
+import json
+import logging
+import os
 import re
+import sys
+import time
 from collections import defaultdict
-
-import defusedxml.etree.ElementTree
-
-from nesta_daps.geo.geocode import _geocode
-from nesta_daps.geo.iso import alpha2_to_continent_mapping
-from nesta_daps.geo.iso import country_iso_code
-
-import requests
-
-from retrying import retry
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from functools import partial
+from itertools import islice
+
+import defusedxml.ElementTree
+
+from nesta_daps.common.atomic import atomic_write
+from nesta_daps.common.geo.geocode import _geocode
+from nesta_daps.common.geo.iso import alpha2_to_continent_mapping
+from nesta_daps.common.geo.iso import country_iso_code
+from nesta_daps.common.geo.postcode import normalise_postcode
+from nesta_daps.common.http.cache import ResponseCache
+from nesta_daps.common.http.retry import url_host
+from nesta_daps.common.http.retry import with_retries
+from nesta_daps.common.http.session import get_session
+from nesta_daps.flows.datasets.gtr.gtr_cache import EntityCache
+from nesta_daps.flows.datasets.gtr.gtr_crawl import DeltaCrawl
+from nesta_daps.flows.datasets.gtr.gtr_crawl import PROJECTS
+from nesta_daps.flows.datasets.gtr.gtr_crawl import PageManifest
+from nesta_daps.flows.datasets.gtr.gtr_sink import ColumnarSink
 
 
 # Global constants
 TOP_URL = "https://gtr.ukri.org/gtr/api/projects"
 TOTALPAGES_KEY = "{http://gtr.rcuk.ac.uk/gtr/api}totalPages"
-REGEX = re.compile(r"\{(.*)\}(.*)")
 REGEX_API = re.compile(r"https://gtr.ukri.org:443/gtr/api/(.*)/(.*)")
+PAGE_SIZE = 100
+MAX_IN_FLIGHT = 4
+MAX_PAGE_ATTEMPTS = 3
+ORG_BATCH_SIZE = 1000
+
+# Type coercion, see `TypeDict`
+NIL = {"nil": "true"}
+INF = float("inf")
+CASTS = {"int": int, "float": float, "str": str}
+TYPE_WIDTHS = ["int", "float", "str"]  # i.e. narrowest to widest
+# Interned (namespace, local name) pairs by qualified name, see `split_qname`
+QNAMES = {}
+# Linked entities are shared between many projects, so only fetch each once
+ENTITY_CACHE = EntityCache()
+# Opt-in store of raw responses, see `set_response_cache`
+RESPONSE_CACHE = None
+RESPONSE_CACHE_TTL = 24 * 60 * 60  # long enough to resume a crashed crawl
+# Fields of a participant which are merged onto its organisation
+PARTICIPANT_FIELDS = ("projectCost", "grantOffer")
+# Fields of the link table, whose rows are tuples (see `BatchBuilder`)
+LINK_FIELDS = ("project_id", "rel", "id", "table_name")
+
+
+def pop_link(table_name, row):
+    """Pop the project id and relationship out of a row of data,
+    and generate the corresponding link table entry.
+
+    Args:
+        table_name (str): The table to which the row belongs.
+        row (dict): A row of data. Note: "project_id" and "rel" are popped from it.
+    Returns:
+        (tuple): The link table entry (values of :obj:`LINK_FIELDS`), or `None`
+                 if the row isn't linked to a project.
+    """
+    project_id = row.pop("project_id", None)
+    rel = row.pop("rel", "TOPIC" if table_name == "topic" else None)
+    if project_id is None or rel is None:
+        return None
+    ### Added recently, check logic
+    if "id" not in row:
+        return None
+    return (project_id, rel, row["id"], f"gtr_{table_name}")
 
 
 def extract_link_table(data):
@@ -38,30 +98,66 @@ def extract_link_table(data):
     """
     link_table = []
     for table_name, rows in data.items():
-        is_topic = table_name == "topic"
         for row in rows:
-            project_id = None
-            rel = "TOPIC" if is_topic else None
-            if "project_id" in row:
-                project_id = row.pop("project_id")
-            if "rel" in row:
-                rel = row.pop("rel")
-            if project_id is None or rel is None:
-                continue
-            ### Added recently, check logic
-            if "id" not in row:
-                continue
-            link_table.append(
-                dict(
-                    project_id=project_id,
-                    rel=rel,
-                    id=row["id"],
-                    table_name=f"gtr_{table_name}",
-                )
-            )
+            link = pop_link(table_name, row)
+            if link is not None:
+                link_table.append(dict(zip(LINK_FIELDS, link)))
     data["link_table"] = link_table
 
 
+def split_link_row(table_name, row):
+    """Prepare a row for streaming output (see :obj:`ColumnarSink`), by applying
+    :obj:`rekey_participant` and :obj:`extract_link_table` row by row.
+
+    Args:
+        table_name (str): The table to which the row belongs.
+        row (dict): A row of data.
+    Yields:
+        table_name, row (str, dict): The row, preceded by its link table entry
+                                     (see :obj:`pop_link`), which the sink
+                                     appends straight onto the link table's
+                                     columns.
+    """
+    if table_name == "participant":
+        rekey_participant(row)
+    link = pop_link(table_name, row)
+    if link is not None:
+        yield "link_table", link
+    yield table_name, row
+
+
+class OrganisationEnricher:
+    """Streaming equivalent of :obj:`deduplicate_participants`, for use as the
+    :obj:`preprocess` of a :obj:`ColumnarSink` or :obj:`DeltaCrawl`. Rows are
+    split as per :obj:`split_link_row`, and participants' costs are indexed per
+    project as they pass through (see :obj:`index_participant_costs`).
+
+    A project's row is written after all of its nested entities (see
+    :obj:`extract_project`), so organisation rows are held back until their
+    project's row arrives, then enriched (see :obj:`enrich_organisations`)
+    and written just ahead of it. The project's index is then dropped, so
+    memory is bounded by the size of a single project.
+    """
+
+    def __init__(self):
+        self.indexes = defaultdict(dict)  # participant costs by project id
+        self.pending = defaultdict(list)  # organisation rows by project id
+
+    def __call__(self, table_name, row):
+        project_id = row.get("project_id")
+        if table_name == "participant":
+            index_participant_costs([row], self.indexes[project_id])
+        elif table_name == "organisations" and project_id is not None:
+            self.pending[project_id].append(row)
+            return
+        elif table_name == PROJECTS:
+            organisations = self.pending.pop(row["id"], [])
+            enrich_organisations(organisations, self.indexes.pop(row["id"], {}))
+            for organisation in organisations:
+                yield from split_link_row("organisations", organisation)
+        yield from split_link_row(table_name, row)
+
+
 def is_list_entity(row_value):
     """All list entities have the following structure:
 
@@ -89,11 +185,50 @@ def contains_key(d, search_key):
     Returns:
         (:obj:`True` or :obj:`False`)
     """
-    if isinstance(d, list):
-        return any(contains_key(item, search_key) for item in d)
-    elif not isinstance(d, dict):
-        return False
-    return search_key in d or any(contains_key(d[k], search_key) for k in d)
+    stack = [d]
+    while stack:
+        d = stack.pop()
+        if isinstance(d, dict):
+            if search_key in d:
+                return True
+            stack.extend(d.values())
+        elif isinstance(d, list):
+            stack.extend(d)
+    return False
+
+
+class KeyPathIndex:
+    """Index of the paths to every key in a mixed dict/list (i.e. json-like)
+    object, built in one iterative pass, so that any number of subsequent
+    key lookups are O(1) rather than each being a traversal.
+
+    Args:
+        d (:obj:`json`): A mixed dict/list (i.e. json-like) object to index.
+    """
+
+    def __init__(self, d):
+        self.paths = defaultdict(list)
+        # Each item: (path, value, whether the last step of the path is a key)
+        stack = [((), d, False)]
+        while stack:
+            path, d, is_key = stack.pop()
+            if is_key:
+                self.paths[path[-1]].append(path)
+            if isinstance(d, dict):
+                children = [(path + (k,), v, True) for k, v in d.items()]
+            elif isinstance(d, list):
+                children = [(path + (i,), v, False) for i, v in enumerate(d)]
+            else:
+                continue
+            # Reversed, so that paths are indexed in document order
+            stack.extend(reversed(children))
+
+    def __contains__(self, key):
+        return key in self.paths
+
+    def __getitem__(self, key):
+        """All paths (tuples of keys and list indexes) at which the key occurs."""
+        return self.paths.get(key, [])
 
 
 def remove_last_occurence(s, to_remove):
@@ -111,41 +246,141 @@ def is_iterable(x):
     return True
 
 
+def infer_and_cast(v):
+    """Infer the narrowest type that a string value can be cast to, and cast it.
+
+    Args:
+        v (str): The value to cast.
+    Returns:
+        type_name, value (str, :obj:`int`, :obj:`float` or :obj:`str`)
+    """
+    # Don't bother if all characters are letters
+    if v.replace(" ", "").isalpha():
+        return "str", v
+    # Try int and float
+    try:
+        return "int", int(v)
+    except ValueError:
+        pass
+    try:
+        return "float", float(v)
+    except ValueError:
+        return "str", v
+
+
 class TypeDict(dict):
     """dict-like class which converts string values to an
-    appropriate type automatically."""
+    appropriate type automatically.
 
-    def set_and_cast_item(self, k, v, _type):
-        try:
-            v = _type(v)
-        except (ValueError, TypeError):
-            return False
-        super().__setitem__(k, v)
-        return True
+    If a :obj:`schema` (mapping of field to type name, see :obj:`FieldSchema`)
+    is given then "int" and "str" fields are cast directly to their type, and
+    other fields are inferred and then learned into the schema. If a value
+    doesn't fit the learned type, the field's type is widened (int -> float -> str).
+    Blank values are kept as they are, and never affect the schema.
+
+    Note that values of "float" fields are still inferred (see :obj:`infer_and_cast`),
+    rather than cast directly, so that whole numbers in them stay ints as they
+    would without a schema. So a saved schema only skips inference for "int"
+    and "str" fields.
+
+    The :obj:`has_text` flag records whether a "text" key has been set anywhere
+    within the row (i.e. :obj:`contains_key(row, "text")`), as it is filled,
+    so that topics can be identified without traversing the row again.
+
+    Args:
+        schema (dict): Optional field to type name mapping, to read and update.
+    """
+
+    schema = None
+    has_text = False
+
+    def __init__(self, *args, schema=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.schema = schema
+        if self:
+            self.has_text = contains_key(dict(self), "text")
 
     def __setitem__(self, k, v):
-        if v == {"nil": "true"} or v == float("inf"):
-            return super().__setitem__(k, None)
-        # Don't bother if not a string
-        # or if all characters are letters
-        if not isinstance(v, str) or v.replace(" ", "").isalpha():
-            return super().__setitem__(k, v)
-        # Try int and float
-        if self.set_and_cast_item(k, v, int):
-            return
-        if self.set_and_cast_item(k, v, float):
-            return
-        # # Cycle through date formats
-        # base_fmt = '%Y-%m-%d{}'
-        # for time_fmt in ('', 'T%H:%M:%S', 'T%H:%M:%S%z', 'Z',
-        #                  'T%H:%M:%SZ', 'T%H:%M:%S%zZ', '%z'):
-        #     _v = remove_last_occurence(v, ':') if '%z' in time_fmt else v
-        #     fmt = base_fmt.format(time_fmt)
-        #     if self.set_and_cast_item(k, _v, lambda x: dt.strptime(x, fmt)):
-        #         return
-        # Otherwise, set as normal
+        if isinstance(v, str):
+            v = self.cast(k, v)
+        elif v == NIL or v == INF:
+            v = None
+        elif not self.has_text and isinstance(v, (dict, list)):
+            self.has_text = (
+                v.has_text if isinstance(v, TypeDict) else contains_key(v, "text")
+            )
+        if k == "text":
+            self.has_text = True
         super().__setitem__(k, v)
 
+    def cast(self, k, v):
+        """Cast a string value for field :obj:`k`, according to the schema."""
+        if not v:
+            return v
+        schema = self.schema
+        _type = None if schema is None else schema.get(k)
+        if _type == "str":
+            return v
+        if _type == "int":
+            try:
+                return int(v)
+            except ValueError:
+                pass
+        # Otherwise infer exactly as for an unseen field, so that e.g. whole
+        # numbers in a "float" field are still ints, and widen on any conflict
+        new_type, v = infer_and_cast(v)
+        if schema is not None:
+            schema[k] = max(_type or new_type, new_type, key=TYPE_WIDTHS.index)
+        return v
+
+
+class FieldSchema:
+    """Per-entity field types ("int", "float" or "str"), learned as values are
+    cast by :obj:`TypeDict`. Save the schema at the end of a run and load it at
+    the start of the next, so that later runs skip type inference entirely.
+
+    Args:
+        path (str): Optional JSON file from which to load a saved schema.
+    """
+
+    def __init__(self, path=None):
+        self.entities = defaultdict(dict)
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __getitem__(self, entity):
+        """The (mutable) field to type name mapping for this entity."""
+        return self.entities[entity]
+
+    def load(self, path):
+        """Merge in a schema previously written by :obj:`save`."""
+        with open(path) as f:
+            for entity, fields in json.load(f).items():
+                self.entities[entity].update(fields)
+
+    def save(self, path):
+        """Write the schema to a JSON file."""
+        with atomic_write(path) as f:
+            json.dump(self.entities, f, indent=2, sort_keys=True)
+
+
+# Field types of each entity, learned during extraction
+SCHEMA = FieldSchema()
+
+
+def rekey_participant(row):
+    """Generate a composite key for a participant row, which is otherwise
+    identified only by its organisation.
+
+    Args:
+        row (dict): A row of participant data, which is modified in place.
+    """
+    org_id = row.pop("organisationId")
+    row["id"] = org_id + row["project_id"]
+    row["organisation_id"] = org_id
+    row["rel"] = row.pop("role")
+    del row["organisationName"]
+
 
 def deduplicate_participants(data):
     """The participant data is a duplicate of organisation,
@@ -158,23 +393,85 @@ def deduplicate_participants(data):
     """
     # Iterate through participants and generate a composite key
     for row in data["participant"]:
-        org_id = row.pop("organisationId")
-        row["id"] = org_id + row["project_id"]
-        row["organisation_id"] = org_id
-        row["rel"] = row.pop("role")
-        del row["organisationName"]
-
-    # # Iterate through participants
-    # for row in data.pop('participant'):
-    #     # Find a matching organisation
-    #     for _row in data['organisations']:
-    #         if row['organisationId'] != _row['id']:
-    #             continue
-    #         # Extract the two specific bonus fields
-    #         for key in ('projectCost', 'grantOffer'):
-    #             _row[key] = row[key]
-    #         # Stop iterating, since we've found the organisation
-    #         break
+        rekey_participant(row)
+    # Copy the two specific bonus fields onto the matching organisations
+    if "organisations" in data:
+        index = index_participant_costs(data["participant"])
+        enrich_organisations(data["organisations"], index)
+
+
+def get_columns(batch, fields):
+    """Extract columns from a batch of rows, which is either a list of dicts
+    or columnar, i.e. a mapping of field to values (e.g. a :obj:`DataFrame`).
+
+    Args:
+        batch (list or dict): The batch of rows.
+        fields (tuple): The fields to extract, which are `None` where missing.
+    Returns:
+        (list): One list of values per field.
+    """
+    if isinstance(batch, list):
+        return [[row.get(field) for row in batch] for field in fields]
+    columns = list(batch)
+    n_rows = len(batch[columns[0]]) if columns else 0
+    return [
+        list(batch[field]) if field in batch else [None] * n_rows for field in fields
+    ]
+
+
+def index_participant_costs(participants, index=None):
+    """Build a hash index of participants' :obj:`PARTICIPANT_FIELDS`, keyed on
+    :obj:`(organisation id, project id)`, and also on :obj:`(organisation id, None)`
+    for the first participation of each organisation. Call once per batch,
+    passing in the index so far, to index the participant table in batches.
+
+    Args:
+        participants (list or dict): Participant rows, see :obj:`get_columns`,
+                                     either raw or as from :obj:`rekey_participant`.
+        index (dict): Index to add to.
+    Returns:
+        index (dict): Mapping of key to the tuple of :obj:`PARTICIPANT_FIELDS`.
+    """
+    index = {} if index is None else index
+    fields = ("organisation_id", "organisationId", "project_id", *PARTICIPANT_FIELDS)
+    org_ids, raw_org_ids, project_ids, *values = get_columns(participants, fields)
+    for org_id, raw_org_id, project_id, costs in zip(
+        org_ids, raw_org_ids, project_ids, zip(*values)
+    ):
+        if org_id is None:
+            org_id = raw_org_id
+        index[(org_id, project_id)] = costs
+        index.setdefault((org_id, None), costs)
+    return index
+
+
+def enrich_organisations(organisations, index):
+    """Copy :obj:`PARTICIPANT_FIELDS` onto organisations from the participant
+    index, matching on the organisation and project ids, or else on the
+    organisation id alone if the organisation isn't tied to a project.
+
+    Args:
+        organisations (list or dict): Organisation rows, see :obj:`get_columns`.
+                                      Note: these are enriched in place.
+        index (dict): See :obj:`index_participant_costs`.
+    Returns:
+        organisations: The enriched organisations.
+    """
+    org_ids, project_ids = get_columns(organisations, ("id", "project_id"))
+    matches = [
+        index.get((org_id, project_id)) or index.get((org_id, None))
+        for org_id, project_id in zip(org_ids, project_ids)
+    ]
+    if isinstance(organisations, list):
+        for row, costs in zip(organisations, matches):
+            if costs is not None:
+                row.update(zip(PARTICIPANT_FIELDS, costs))
+        return organisations
+    missing = (None,) * len(PARTICIPANT_FIELDS)
+    columns = zip(*(missing if costs is None else costs for costs in matches))
+    for field, values in zip(PARTICIPANT_FIELDS, columns):
+        organisations[field] = list(values)
+    return organisations
 
 
 def unpack_funding(row):
@@ -203,7 +500,8 @@ def unpack_list_data(row, data):
 
     Args:
         row (dict): A row of GtR project data, within which there may be lists to unpack.
-        data (:obj:`defaultdict(list)`): Data holder, mapping entities to rows of data.
+        data (:obj:`defaultdict(list)` or :obj:`ColumnarSink`): Data holder, mapping
+                                         entities to rows of data.
                                          Note: data is unpacked into this object.
     """
     # Create a list of list-like data to unpack
@@ -213,8 +511,12 @@ def unpack_list_data(row, data):
         # Pop out the entry, so that it can be entered into `data`
         # as a standalone entity
         dict_list = row.pop(k)
-        # Special case: entities containing 'text' are topics
-        is_topic = contains_key(dict_list, "text")
+        # Special case: entities containing 'text' are topics,
+        # which is flagged on rows as they are extracted (see `TypeDict`)
+        if isinstance(dict_list, TypeDict):
+            is_topic = dict_list.has_text
+        else:
+            is_topic = contains_key(dict_list, "text")
         # Iterate over the nested list
         key, nested_list = next(iter(dict_list.items()))
         for item in nested_list:
@@ -235,6 +537,28 @@ def unpack_list_data(row, data):
             data[table_name.replace("/", "_")].append(item)
 
 
+def split_qname(qname):
+    """Split a qualified XML name, of the form "{namespace}local", into its
+    namespace and local name. GtR uses a small, fixed vocabulary of names
+    so the result is memoized (and interned) rather than recalculated for
+    every tag and attribute.
+
+    Args:
+        qname (str): Qualified tag or attribute name.
+    Returns:
+        namespace, local (str, str): Namespace (empty if none) and local name.
+    """
+    try:
+        return QNAMES[qname]
+    except KeyError:
+        pass
+    namespace, local = "", qname
+    if qname.startswith("{"):
+        namespace, _, local = qname[1:].rpartition("}")
+    QNAMES[qname] = result = (sys.intern(namespace), sys.intern(local))
+    return result
+
+
 def extract_link_data(url):
     """Enter a link URL and recursively extract the data.
 
@@ -248,6 +572,8 @@ def extract_link_data(url):
     # Note: Ignore any links and hrefs, as this will lead to
     # infinite recursion!
     if et is not None:
+        _, entity = split_qname(et.tag)
+        row.schema = SCHEMA[entity]
         extract_data_recursive(et, row, ignore=["links", "href"])
     return row
 
@@ -261,23 +587,24 @@ def extract_data(et, ignore=[]):
     Returns:
         entity, row (str, dict): Entity type and data.
     """
-    row = TypeDict()
     # Get the root entity name
-    _, entity = REGEX.findall(et.tag)[0]
+    _, entity = split_qname(et.tag)
+    row = TypeDict(schema=SCHEMA[entity])
     if entity in ignore:
         return entity, row
     # Iterate over data fields
     for k, v in et.attrib.items():
         # Extract the field name
-        _, field = REGEX.findall(k)[0]
+        _, field = split_qname(k)
         if field in ignore:
             continue
         # URLs need to be treated differently, as they point to new data
         if field == "href":
             # Get the ID and entity type of the object pointed to by the URL
             _entity, _id = REGEX_API.findall(v)[0]
-            # ... then extract the data at that URL
-            _entity_data = extract_link_data(v)
+            # ... then extract the data at that URL, unless it's already been seen
+            fetch = partial(extract_link_data, v)
+            _entity_data = ENTITY_CACHE.get((_entity, _id), fetch)
             # Finally, unpack the data as usual
             row["entity"] = _entity
             row["id"] = _id
@@ -297,60 +624,277 @@ def extract_data(et, ignore=[]):
     return entity, row
 
 
+def is_duplicate_row(new, old):
+    """Is :obj:`new` a duplicate of the :obj:`old` value already in the parent row?
+    Note that equality short-circuits on values of a different type (e.g. a row
+    compared against a list of rows) and on the first difference found."""
+    return new == old
+
+
+def attach_row(row, entity, _row):
+    """Attach a fully extracted child :obj:`_row` to its parent :obj:`row`.
+
+    Args:
+        row (dict): The parent row.
+        entity (str): Entity type of the child row.
+        _row (dict): The child row.
+    """
+    # If this row contains "value" or "item", and nothing else, then flatten it further
+    # as these are dummy fields in the GtR data
+    if isinstance(_row, dict):
+        for key in ("value", "item"):
+            if key in _row and len(_row) == 1:
+                _row = _row[key]
+                break
+    # Ignore duplicate entries
+    if entity in row and is_duplicate_row(_row, row[entity]):
+        return
+    # Treat 'link' objects differently: append as a list item to the parent row
+    is_topic_row = isinstance(_row, dict) and "text" in _row
+    if entity in ("link", "participant") or is_topic_row:
+        if entity not in row:
+            row[entity] = []
+        row[entity].append(_row)
+        # Appending bypasses `TypeDict.__setitem__`, so flag any text here
+        if isinstance(row, TypeDict) and (
+            is_topic_row or getattr(_row, "has_text", False)
+        ):
+            row.has_text = True
+    # Otherwise, append any non-empty data to the parent row
+    elif (not is_iterable(_row)) or len(_row) > 0:
+        row[entity] = _row
+
+
 def extract_data_recursive(et, row, ignore=[]):
-    """Recursively dive into and extract a row of data.
+    """Dive into and extract a row of data, to any depth. The tree is walked
+    depth-first with an explicit stack (rather than recursion), so that each
+    child row is complete before being attached to its parent.
 
     Args:
         et (:obj:`xml.etree.ElementTree`): A GtR XML entity "row".
         row (dict): The output row of data to fill.
         ignore: See :obj:`extract_data`.
     """
-    for c in et.getchildren():
-        # Extract the shallow data for this row
-        entity, _row = extract_data(c, ignore)
-        if entity in ignore:
-            continue
-        # Unpack any deep data into the shallow _row that we just extracted
-        extract_data_recursive(c, _row, ignore)
-        # If this row contains "value" or "item", and nothing else, then flatten it further
-        # as these are dummy fields in the GtR data
-        if isinstance(_row, dict):
-            for key in ("value", "item"):
-                if key in _row and len(_row) == 1:
-                    _row = _row[key]
-                    break
-        # Ignore duplicate entries
-        if entity in row and _row == row[entity]:
-            continue
-        # Treat 'link' objects differently: append as a list item to the parent row
-        is_topic_row = isinstance(_row, dict) and "text" in _row
-        if entity in ("link", "participant") or is_topic_row:
-            if entity not in row:
-                row[entity] = []
-            row[entity].append(_row)
-        # Otherwise, append any non-empty data to the parent row
-        elif (not is_iterable(_row)) or len(_row) > 0:
-            row[entity] = _row
-
-
-@retry(wait_random_min=120, wait_random_max=300, stop_max_attempt_number=10)
+    # Each frame: (remaining children, row being filled, its entity, its parent row)
+    stack = [(iter(et), row, None, None)]
+    while stack:
+        children, _row, entity, parent = stack[-1]
+        for c in children:
+            # Extract the shallow data for this row, then dive into its children
+            _entity, child_row = extract_data(c, ignore)
+            if _entity not in ignore:
+                stack.append((iter(c), child_row, _entity, _row))
+                break
+        else:
+            # All children have been unpacked, so the row is complete
+            stack.pop()
+            if parent is not None:
+                attach_row(parent, entity, _row)
+
+
+def extract_project(project, data):
+    """Extract and flatten a GtR project, with all of its nested
+    and linked entities, unpacking them into separate tables.
+
+    Args:
+        project (:obj:`xml.etree.ElementTree`): A GtR XML project entity.
+        data (:obj:`defaultdict(list)` or :obj:`ColumnarSink`): Data holder, mapping
+                                         entities to rows of data.
+                                         Note: data is unpacked into this object.
+    """
+    # Extract the data for the project into 'row'
+    _, row = extract_data(project)
+    # Then recursively extract data from nested rows into the parent 'row'
+    extract_data_recursive(project, row)
+    # Flatten out any list data directly into 'data' under separate tables
+    unpack_list_data(row, data)
+    row.pop("identifiers", None)
+    # Append the row
+    data[row.pop("entity")].append(row)
+
+
+@with_retries(host=url_host)
 def read_xml_from_url(url, **kwargs):
-    """Read pure XML data directly from a URL.
+    """Read pure XML data directly from a URL, or from the response
+    cache if one has been set with :obj:`set_response_cache`. Transient
+    failures are retried by the shared :obj:`RetryScheduler`.
 
     Args:
         url (str): The source URL.
-        kwargs (dict): Any :obj:`params` data to pass to :obj:`requests.get`.
+        kwargs (dict): Any :obj:`params` data to pass to the request.
     Returns:
         An `:obj:`xml.etree.ElementTree` of the full XML tree.
     """
-    r = requests.get(url, params=kwargs)
-    if "Unable to find" in r.text:
-        return None
-    r.raise_for_status()
-    et = defusedxml.etree.ElementTree.fromstring(r.text)
+    text = None if RESPONSE_CACHE is None else RESPONSE_CACHE.get(url, kwargs)
+    cached = text is not None
+    if not cached:
+        r = get_session().get(url, params=kwargs)
+        if "Unable to find" not in r.text:
+            r.raise_for_status()
+        text = r.text
+    et = None
+    if "Unable to find" not in text:
+        et = defusedxml.ElementTree.fromstring(text)
+    # Only cache bodies which parse, so that a truncated response is fetched again
+    if not cached and RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.put(url, text, kwargs)
     return et
 
 
+def stream_project_rows(url=TOP_URL, **kwargs):
+    """Stream a page of GtR data from a URL, parsing the response incrementally
+    and yielding one flattened row per top-level entity. Finished entities are
+    cleared as soon as they have been flattened, so peak memory is independent
+    of the page size. Note that, unlike :obj:`read_xml_from_url`, failures are
+    not retried since some rows may already have been consumed.
+
+    Args:
+        url (str): The source URL.
+        kwargs (dict): Any :obj:`params` data to pass to the request.
+    Yields:
+        row (dict): A flattened GtR entity, as per :obj:`extract_data_recursive`.
+    """
+    text = None if RESPONSE_CACHE is None else RESPONSE_CACHE.get(url, kwargs)
+    if text is not None:
+        if "Unable to find" not in text:
+            yield from _iter_rows(io.BytesIO(text.encode()))
+        return
+    with get_session().get(url, params=kwargs, stream=True) as r:
+        if not r.ok and "Unable to find" in r.text:
+            return
+        r.raise_for_status()
+        r.raw.decode_content = True  # i.e. let urllib3 decompress the stream
+        yield from _iter_rows(r.raw)
+
+
+def _iter_rows(source):
+    """Incrementally parse XML from a file-like object, flattening and then
+    discarding each child of the root element as soon as it is complete."""
+    depth, root = 0, None
+    events = defusedxml.ElementTree.iterparse(source, events=("start", "end"))
+    for event, elem in events:
+        if event == "start":
+            depth += 1
+            root = elem if root is None else root
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        _, row = extract_data(elem)
+        extract_data_recursive(elem, row)
+        yield row
+        root.clear()
+
+
+def set_response_cache(cache):
+    """Read responses through a persistent cache (or stop doing so), so that
+    crashed or repeated runs don't need to hit the GtR API again.
+
+    Args:
+        cache (:obj:`ResponseCache`): The cache to use, or `None` to disable caching.
+    """
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = cache
+
+
+class FailedPagesError(Exception):
+    """Raised once every other page has been fetched, if any pages
+    still failed after :obj:`max_page_attempts`.
+
+    Args:
+        pages (dict): Mapping of page number to its last exception.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        super().__init__(f"Failed to fetch pages {sorted(pages)}")
+
+
+def fetch_pages(
+    pages,
+    page_size=PAGE_SIZE,
+    max_in_flight=MAX_IN_FLIGHT,
+    delay=0,
+    url=TOP_URL,
+    max_page_attempts=MAX_PAGE_ATTEMPTS,
+):
+    """Fetch pages of GtR data concurrently, keeping at most :obj:`max_in_flight`
+    requests open at any one time. Pages are yielded in the order that they
+    complete, which is not necessarily the order in which they were requested.
+    Failed pages are put to the back of the queue, so that they are retried
+    without holding up the pages around them.
+
+    Args:
+        pages (:obj:`iterable` of :obj:`int`): Page numbers to fetch.
+        page_size (int): Number of entities per page (the :obj:`s` param).
+        max_in_flight (int): Maximum number of concurrent requests.
+        delay (float): Politeness delay, in seconds, between starting requests.
+        url (str): The paginated GtR endpoint.
+        max_page_attempts (int): Number of times to try each page.
+    Yields:
+        page, et (int, :obj:`xml.etree.ElementTree`): Page number and its XML tree.
+    Raises:
+        :obj:`FailedPagesError`: If any pages failed :obj:`max_page_attempts` times.
+    """
+    pages = iter(pages)
+    retries = deque()
+    attempts = defaultdict(int)
+    failed = {}
+    in_flight = {}
+    next_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+
+        def submit_next():
+            nonlocal next_start
+            page = next(pages, None)
+            if page is None:
+                if not retries:
+                    return
+                page = retries.popleft()
+            # Be polite: space out the start of consecutive requests
+            time.sleep(max(0, next_start - time.monotonic()))
+            next_start = time.monotonic() + delay
+            attempts[page] += 1
+            future = pool.submit(read_xml_from_url, url, p=page, s=page_size)
+            in_flight[future] = page
+
+        # Fill the pool, then top it up as each request completes
+        for _ in range(max_in_flight):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    et = future.result()
+                except Exception as err:
+                    if attempts[page] < max_page_attempts:
+                        retries.append(page)
+                    else:
+                        failed[page] = err
+                    submit_next()
+                    continue
+                submit_next()
+                yield page, et
+    if failed:
+        raise FailedPagesError(failed)
+
+
+def fetch_projects(pages, **kwargs):
+    """Fetch pages of GtR data concurrently, and yield the project elements
+    from each page as it completes.
+
+    Args:
+        pages (:obj:`iterable` of :obj:`int`): Page numbers to fetch.
+        kwargs: Any other arguments to pass to :obj:`fetch_pages`.
+    Yields:
+        :obj:`xml.etree.ElementTree`: A GtR XML project entity.
+    """
+    for _, projects in fetch_pages(pages, **kwargs):
+        if projects is not None:
+            yield from projects
+
+
 def get_orgs_to_process(all_orgs, existing_orgs):
     """Extracts organisations and addresses, flattens addresses and returns just records
     that have not prevously been processed.
@@ -382,13 +926,15 @@ def get_orgs_to_process(all_orgs, existing_orgs):
     return orgs_to_process
 
 
-def geocode_uk_with_postcode(org_details):
+def geocode_uk_with_postcode(org_details, postcode_index=None):
     """Wrapper for the geocoder that will process any organisations that are in the UK
     and have a postcode. Any that succeed also have their country overwritten, so the
     data in this column is consistent.
 
     Args:
         orgs_details (dict): organisation details, without latitude and longitude
+        postcode_index (:obj:`PostcodeIndex`): Optional offline index, which is tried
+                                               before falling back to the geocoder.
 
     Returns
         (dict): processed org details with latitude, longitude appended
@@ -402,9 +948,13 @@ def geocode_uk_with_postcode(org_details):
     ):
         # assume most without 'Outside UK' region are UK, but hardcode country into the
         # request to prevent false results with identical postcodes that exist in multiple countries
-        coordinates = _geocode(
-            postalcode=org_details["postCode"], country="United Kingdom"
-        )
+        coordinates = None
+        if postcode_index is not None:
+            coordinates = postcode_index.lookup(org_details["postCode"])
+        if coordinates is None:
+            coordinates = _geocode(
+                postalcode=org_details["postCode"], country="United Kingdom"
+            )
 
         if coordinates is not None:
             org_details["latitude"] = coordinates["lat"]
@@ -415,6 +965,89 @@ def geocode_uk_with_postcode(org_details):
     return org_details
 
 
+class OrgGeocoder:
+    """Batch equivalent of :obj:`geocode_uk_with_postcode`, which groups
+    organisations by normalised postcode so that each unique postcode is
+    geocoded only once (across all batches), and the result is fanned back
+    out to every organisation sharing it. Postcodes in the offline index, if
+    given, are never sent to the geocoder.
+
+    Args:
+        postcode_index (:obj:`PostcodeIndex`): Optional offline postcode index.
+    """
+
+    def __init__(self, postcode_index=None):
+        self.postcode_index = postcode_index
+        self.postcodes = {}  # postcode: coordinates, or None if not found
+        self.n_orgs = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Organisations processed per second."""
+        return self.n_orgs / self.elapsed if self.elapsed else 0.0
+
+    def geocode_batch(self, orgs):
+        """Geocode a batch of organisations, exactly as :obj:`geocode_uk_with_postcode`.
+
+        Args:
+            orgs (:obj:`list` of :obj:`dict`): Organisation details, which are
+                                               modified in place.
+        Returns:
+            orgs (:obj:`list` of :obj:`dict`)
+        """
+        start = time.monotonic()
+        by_postcode = defaultdict(list)
+        for org in orgs:
+            org["latitude"] = None
+            org["longitude"] = None
+            if org.get("region") != "Outside UK" and org.get("postCode") is not None:
+                postcode = normalise_postcode(org["postCode"])
+                if postcode is not None:
+                    by_postcode[postcode].append(org)
+        for postcode, _orgs in by_postcode.items():
+            if postcode not in self.postcodes:
+                coordinates = None
+                if self.postcode_index is not None:
+                    coordinates = self.postcode_index.lookup(postcode)
+                if coordinates is None:
+                    coordinates = _geocode(
+                        postalcode=postcode, country="United Kingdom"
+                    )
+                self.postcodes[postcode] = coordinates
+            coordinates = self.postcodes[postcode]
+            if coordinates is None:
+                continue
+            for org in _orgs:
+                org["latitude"] = coordinates["lat"]
+                org["longitude"] = coordinates["lon"]
+                org["country"] = "United Kingdom"
+        self.n_orgs += len(orgs)
+        self.elapsed += time.monotonic() - start
+        return orgs
+
+    def geocode_batches(self, orgs, batch_size=ORG_BATCH_SIZE):
+        """Stream organisations through :obj:`geocode_batch`, logging progress.
+
+        Args:
+            orgs (:obj:`iterable` of :obj:`dict`): Organisation details.
+            batch_size (int): Number of organisations per batch.
+        Yields:
+            (:obj:`list` of :obj:`dict`): Batches of geocoded organisations.
+        """
+        orgs = iter(orgs)
+        while True:
+            batch = list(islice(orgs, batch_size))
+            if not batch:
+                return
+            yield self.geocode_batch(batch)
+            logging.info(
+                f"Geocoded {self.n_orgs} organisations with "
+                f"{len(self.postcodes)} postcode lookups, "
+                f"at {self.rate:.1f} organisations/s"
+            )
+
+
 def add_country_details(org_details):
     """If country name is valid attempt to append iso codes and continent.
 
@@ -424,8 +1057,6 @@ def add_country_details(org_details):
     Returns:
         (dict): processed org with extra data appended or None if failure
     """
-    continent_map = alpha2_to_continent_mapping()
-
     try:
         country_name = org_details["country"]
         country_codes = country_iso_code(country_name)
@@ -443,6 +1074,7 @@ def add_country_details(org_details):
         org_details["country_alpha_3"] = country_codes.alpha_3
         org_details["country_name"] = country_codes.name
         org_details["country_numeric"] = country_codes.numeric
+        continent_map = alpha2_to_continent_mapping()  # shared, so only built once
         org_details["continent"] = continent_map[country_codes.alpha_2]
 
     return org_details
@@ -450,8 +1082,14 @@ def add_country_details(org_details):
 
 if __name__ == "__main__":
 
-    # Local constants
-    PAGE_SIZE = 100
+    # Reuse responses from any recent (e.g. crashed) runs, but let them expire
+    # so that later (delta) crawls see any changes upstream
+    if "GTR_RESPONSE_CACHE" in os.environ:
+        ttl = float(os.environ.get("GTR_RESPONSE_CACHE_TTL", RESPONSE_CACHE_TTL))
+        set_response_cache(ResponseCache(os.environ["GTR_RESPONSE_CACHE"], ttl=ttl))
+    # Skip type inference for any fields seen in previous runs
+    if "GTR_SCHEMA" in os.environ:
+        SCHEMA = FieldSchema(os.environ["GTR_SCHEMA"])
 
     # Assertain the total number of pages first
     projects = read_xml_from_url(TOP_URL, p=1, s=PAGE_SIZE)
@@ -459,32 +1097,35 @@ if __name__ == "__main__":
 
     # The output data structure:
     # each key represents a unique flat entity (i.e. a flat 'table')
-    # each list represents rows in that table.
-    data = defaultdict(list)
-
-    # Iterate through all pages
-    for page in range(1, total_pages + 1):
-        # Get all projects on this page
-        projects = read_xml_from_url(TOP_URL, p=page, s=PAGE_SIZE)
-        for project in projects.getchildren():
-            # Extract the data for the project into 'row'
-            _, row = extract_data(project)
-            # Then recursively extract data from nested rows into the parent 'row'
-            extract_data_recursive(project, row)
-            # Flatten out any list data directly into 'data' under separate tables
-            unpack_list_data(row, data)
-            row.pop("identifiers")
-            # Append the row
-            data[row.pop("entity")].append(row)
-            break
-        break
-
-    # The 'participant' data is near duplicate
-    # of 'organisation' data so merge them.
-    if "participant" in data:
-        deduplicate_participants(data)
-
-    for k, v in data.items():
-        print(k)
-        print(v)
-        print()
+    # whose rows are written out in batches under GTR_OUTPUT/<table>/
+    # Participants, organisations and the link table are handled row by row,
+    # as they are written.
+    output = os.environ.get("GTR_OUTPUT", "gtr")
+    sink = ColumnarSink(output, fields={"link_table": LINK_FIELDS})
+    # Only emit rows which have changed since the run checkpointed at GTR_STATE
+    delta = DeltaCrawl(
+        os.environ.get("GTR_STATE"), sink, preprocess=OrganisationEnricher()
+    )
+    # Checkpoint each page, so that a crashed run can resume where it left off
+    data = PageManifest(os.path.join(output, "pages"), delta)
+    data.replay()
+
+    # Iterate through all projects, fetching several pages at once.
+    # If any pages fail outright then the error is raised here, and
+    # the completed pages are picked up again by the next run.
+    pages = data.pending(range(1, total_pages + 1))
+    for page, projects in fetch_pages(pages, page_size=PAGE_SIZE):
+        for project in [] if projects is None else projects:
+            if data.is_changed(project):
+                extract_project(project, data)
+        data.complete(page)
+
+    deletes = data.close()
+    with atomic_write(os.path.join(output, "deletes.json")) as f:
+        json.dump(deletes, f)
+
+    if "GTR_SCHEMA" in os.environ:
+        SCHEMA.save(os.environ["GTR_SCHEMA"])
+
+    for k, v in sink.items():
+        print(k, v.n_rows)
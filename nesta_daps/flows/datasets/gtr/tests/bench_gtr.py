@@ -0,0 +1,173 @@
+"""
+GtR extraction benchmarks
+=========================
+
+Micro-benchmarks for the GtR extraction path, run against synthetic
+GtR-like project documents (so no network access is needed). From the
+root of the repository:
+
+    python -m nesta_daps.flows.datasets.gtr.tests.bench_gtr
+"""
+
+import re
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+from nesta_daps.flows.datasets.gtr import gtr_utils
+from nesta_daps.flows.datasets.gtr.gtr_sink import BatchBuilder
+
+API = "http://gtr.rcuk.ac.uk/gtr/api"
+PROJECT = "http://gtr.rcuk.ac.uk/gtr/api/project"
+HREF = "https://gtr.ukri.org:443/gtr/api/{entity}/{id}"
+# Namespace stripping as it was, i.e. a regex match per tag and attribute
+QNAME_REGEX = re.compile(r"\{(.*)\}(.*)")
+
+
+def regex_qname(qname):
+    """The regex equivalent of :obj:`gtr_utils.split_qname`."""
+    return QNAME_REGEX.findall(qname)[0]
+
+
+def dict_pop_link(table_name, row):
+    """:obj:`gtr_utils.pop_link` as it was, i.e. building a dict per link."""
+    project_id = row.pop("project_id", None)
+    rel = row.pop("rel", "TOPIC" if table_name == "topic" else None)
+    if project_id is None or rel is None or "id" not in row:
+        return None
+    return dict(
+        project_id=project_id, rel=rel, id=row["id"], table_name=f"gtr_{table_name}"
+    )
+
+
+def make_project(project_id, n_links=10, n_topics=5, n_participants=3):
+    """Generate a GtR-like project element, with links to (pre-cached) entities."""
+    project = ET.Element(
+        f"{{{PROJECT}}}project",
+        {f"{{{API}}}id": project_id, f"{{{API}}}created": "2020-01-01"},
+    )
+    for field, value in (
+        ("title", "A study of things"),
+        ("status", "Active"),
+        ("grantCategory", "Research Grant"),
+        ("leadFunder", "EPSRC"),
+        ("abstractText", "Lorem ipsum " * 50),
+    ):
+        ET.SubElement(project, f"{{{PROJECT}}}{field}").text = value
+    links = ET.SubElement(project, f"{{{API}}}links")
+    for i in range(n_links):
+        entity = ("organisations", "persons", "funds")[i % 3]
+        ET.SubElement(
+            links,
+            f"{{{API}}}link",
+            {
+                f"{{{API}}}href": HREF.format(entity=entity, id=f"{entity}-{i}"),
+                f"{{{API}}}rel": "LEAD_ORG",
+            },
+        )
+    topics = ET.SubElement(project, f"{{{PROJECT}}}researchTopics")
+    for i in range(n_topics):
+        topic = ET.SubElement(topics, f"{{{PROJECT}}}researchTopic")
+        ET.SubElement(topic, f"{{{PROJECT}}}id").text = f"topic-{i}"
+        ET.SubElement(topic, f"{{{PROJECT}}}text").text = f"Topic {i}"
+        ET.SubElement(topic, f"{{{PROJECT}}}percentage").text = "20"
+    participants = ET.SubElement(project, f"{{{PROJECT}}}participantValues")
+    for i in range(n_participants):
+        participant = ET.SubElement(participants, f"{{{PROJECT}}}participant")
+        for field, value in (
+            ("organisationId", f"organisations-{i}"),
+            ("organisationName", "Nesta"),
+            ("role", "LEAD_PARTICIPANT_ORG"),
+            ("projectCost", "123456"),
+            ("grantOffer", "100000.5"),
+        ):
+            ET.SubElement(participant, f"{{{PROJECT}}}{field}").text = value
+    return project
+
+
+def make_deep_project(depth=50, width=20):
+    """Generate a pathologically deep and wide project element."""
+    project = ET.Element(f"{{{PROJECT}}}project", {f"{{{API}}}id": "deep"})
+    parent = project
+    for level in range(depth):
+        for i in range(width):
+            ET.SubElement(parent, f"{{{PROJECT}}}field{i}").text = str(level * i)
+        parent = ET.SubElement(parent, f"{{{PROJECT}}}nested")
+    return project
+
+
+def precache_links(n_links=10):
+    """Fill the entity cache, so that extraction never goes to the network."""
+    for i in range(n_links):
+        entity = ("organisations", "persons", "funds")[i % 3]
+        gtr_utils.ENTITY_CACHE.get(
+            (entity, f"{entity}-{i}"), lambda: {"name": "Nesta", "postCode": "EC4A 3BF"}
+        )
+
+
+def rate(fn, n):
+    """Calls of :obj:`fn` per second, over :obj:`n` calls."""
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - start)
+
+
+def bench_qnames(projects):
+    """Namespace stripping of every tag and attribute: regex vs interned lookup."""
+    names = [n for p in projects for el in p.iter() for n in (el.tag, *el.attrib)]
+    before = rate(lambda: [regex_qname(n) for n in names], 20) * len(names)
+    after = rate(lambda: [gtr_utils.split_qname(n) for n in names], 20) * len(names)
+    print(f"split qname: {before:,.0f} -> {after:,.0f} names/s ({after/before:.1f}x)")
+
+
+def bench_extract(projects, label):
+    """Full extraction (shallow + recursive) of project rows, with names
+    resolved by regex (before) and by interned lookup (after)."""
+
+    def extract():
+        for project in projects:
+            _, row = gtr_utils.extract_data(project)
+            gtr_utils.extract_data_recursive(project, row)
+
+    with mock.patch.object(gtr_utils, "split_qname", regex_qname):
+        before = rate(extract, 5) * len(projects)
+    after = rate(extract, 5) * len(projects)
+    print(
+        f"extract {label}: {before:,.0f} -> {after:,.0f} rows/s ({after/before:.1f}x)"
+    )
+
+
+def bench_link_table(n_rows):
+    """Splitting the link table entry out of each row and into the link
+    table's columns, with a dict per link (before) and appended straight
+    onto the columns as a tuple (after). Best of three, excluding the
+    Parquet write."""
+    tables = ("organisations", "persons", "funds", "topic")
+    rows = [
+        (tables[i % 4], {"id": f"id-{i}", "project_id": f"p-{i // 10}", "rel": "X"})
+        for i in range(n_rows)
+    ]
+
+    def split_links(pop_link):
+        _rows = [(table_name, dict(row)) for table_name, row in rows]
+        with tempfile.TemporaryDirectory() as path:
+            links = BatchBuilder(path, n_rows + 1, gtr_utils.LINK_FIELDS)
+            start = time.perf_counter()
+            for table_name, row in _rows:
+                links.append(pop_link(table_name, row))
+            return n_rows / (time.perf_counter() - start)
+
+    before = max(split_links(dict_pop_link) for _ in range(3))
+    after = max(split_links(gtr_utils.pop_link) for _ in range(3))
+    print(f"link table: {before:,.0f} -> {after:,.0f} rows/s ({after/before:.1f}x)")
+
+
+if __name__ == "__main__":
+    precache_links()
+    projects = [make_project(f"project-{i}") for i in range(1000)]
+    bench_qnames(projects)
+    bench_extract(projects, "projects")
+    bench_extract([make_deep_project() for _ in range(20)], "deep projects")
+    bench_link_table(1_000_000)
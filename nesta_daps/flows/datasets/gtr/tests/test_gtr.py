@@ -1,19 +1,63 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import TestCase, mock
+from urllib.parse import parse_qs, urlparse
+from xml.etree.ElementTree import ParseError
+
+import pandas as pd
 import pytest
 
-from nesta.packages.gtr.get_gtr_data import extract_link_table
-from nesta.packages.gtr.get_gtr_data import is_list_entity
-from nesta.packages.gtr.get_gtr_data import contains_key
-from nesta.packages.gtr.get_gtr_data import remove_last_occurence
-from nesta.packages.gtr.get_gtr_data import is_iterable
-from nesta.packages.gtr.get_gtr_data import TypeDict
-from nesta.packages.gtr.get_gtr_data import deduplicate_participants
-from nesta.packages.gtr.get_gtr_data import unpack_funding
-from nesta.packages.gtr.get_gtr_data import unpack_list_data
-from nesta.packages.gtr.get_gtr_data import read_xml_from_url
-from nesta.packages.gtr.get_gtr_data import get_orgs_to_process
-from nesta.packages.gtr.get_gtr_data import geocode_uk_with_postcode
-from nesta.packages.gtr.get_gtr_data import add_country_details
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nesta_daps.flows.datasets.gtr.gtr_utils import extract_link_table
+from nesta_daps.flows.datasets.gtr.gtr_utils import LINK_FIELDS
+from nesta_daps.flows.datasets.gtr.gtr_utils import is_list_entity
+from nesta_daps.flows.datasets.gtr.gtr_utils import contains_key
+from nesta_daps.flows.datasets.gtr.gtr_utils import KeyPathIndex
+from nesta_daps.flows.datasets.gtr.gtr_utils import remove_last_occurence
+from nesta_daps.flows.datasets.gtr.gtr_utils import is_iterable
+from nesta_daps.flows.datasets.gtr.gtr_utils import TypeDict
+from nesta_daps.flows.datasets.gtr.gtr_utils import FieldSchema
+from nesta_daps.flows.datasets.gtr.gtr_utils import deduplicate_participants
+from nesta_daps.flows.datasets.gtr.gtr_utils import index_participant_costs
+from nesta_daps.flows.datasets.gtr.gtr_utils import enrich_organisations
+from nesta_daps.flows.datasets.gtr.gtr_utils import OrganisationEnricher
+from nesta_daps.flows.datasets.gtr.gtr_utils import unpack_funding
+from nesta_daps.flows.datasets.gtr.gtr_utils import unpack_list_data
+from nesta_daps.flows.datasets.gtr.gtr_utils import read_xml_from_url
+from nesta_daps.flows.datasets.gtr.gtr_utils import fetch_pages
+from nesta_daps.flows.datasets.gtr.gtr_utils import fetch_projects
+from nesta_daps.flows.datasets.gtr.gtr_utils import FailedPagesError
+from nesta_daps.flows.datasets.gtr.gtr_utils import get_orgs_to_process
+from nesta_daps.flows.datasets.gtr.gtr_utils import geocode_uk_with_postcode
+from nesta_daps.flows.datasets.gtr.gtr_utils import normalise_postcode
+from nesta_daps.flows.datasets.gtr.gtr_utils import OrgGeocoder
+from nesta_daps.flows.datasets.gtr.gtr_utils import add_country_details
+from nesta_daps.flows.datasets.gtr.gtr_utils import extract_data
+from nesta_daps.flows.datasets.gtr.gtr_utils import set_response_cache
+from nesta_daps.flows.datasets.gtr.gtr_utils import stream_project_rows
+from nesta_daps.flows.datasets.gtr.gtr_utils import extract_data_recursive
+from nesta_daps.flows.datasets.gtr.gtr_utils import split_qname
+from nesta_daps.flows.datasets.gtr.gtr_utils import is_duplicate_row
+from nesta_daps.flows.datasets.gtr.gtr_utils import split_link_row
+from nesta_daps.flows.datasets.gtr.gtr_utils import extract_project
+from nesta_daps.common.http.cache import ResponseCache
+from nesta_daps.common.http.retry import RetryScheduler
+from nesta_daps.common.http.retry import set_scheduler
+from nesta_daps.flows.datasets.gtr.gtr_cache import EntityCache
+from nesta_daps.flows.datasets.gtr.gtr_crawl import DeltaCrawl
+from nesta_daps.flows.datasets.gtr.gtr_crawl import PageManifest
+from nesta_daps.flows.datasets.gtr.gtr_sink import ColumnarSink
+
+
+@pytest.fixture(autouse=True)
+def no_retries():
+    """Fail fast, rather than backing off as the shared scheduler would"""
+    previous = set_scheduler(RetryScheduler(max_attempts=1, sleep=lambda s: None))
+    yield
+    set_scheduler(previous)
 
 
 class TestGtr(TestCase):
@@ -33,6 +77,11 @@ class TestGtr(TestCase):
         extract_link_table(data)
         self.assertIn("link_table", data)
         self.assertEqual(len(data["link_table"]), 3)
+        self.assertEqual(
+            data["link_table"][0],
+            {"project_id": 1, "rel": 2, "id": 1, "table_name": "gtr_example_table_1"},
+        )
+        self.assertNotIn("project_id", data["example_table_1"][0])
 
     def test_is_list_entity(self):
         entity_pass_1 = {"key": [{"key_2": "value"}]}
@@ -74,6 +123,20 @@ class TestGtr(TestCase):
         for fail_key in ("something_else", "another"):
             self.assertFalse(contains_key(data, fail_key))
 
+    def test_key_path_index(self):
+        data = {
+            "a": [{"text": 1}, {"b": {"text": 2}}],
+            "text": 3,
+        }
+        index = KeyPathIndex(data)
+        self.assertIn("text", index)
+        self.assertNotIn("c", index)
+        self.assertEqual(
+            index["text"], [("a", 0, "text"), ("a", 1, "b", "text"), ("text",)]
+        )
+        self.assertEqual(index["b"], [("a", 1, "b")])
+        self.assertEqual(index["c"], [])
+
     def test_remove_last_occurence(self):
         result = remove_last_occurence("some:other:object", ":")
         self.assertEqual(result, "some:otherobject")
@@ -85,6 +148,63 @@ class TestGtr(TestCase):
         for fail_iter in (1, 1.0):
             self.assertFalse(is_iterable(fail_iter))
 
+    def test_split_qname(self):
+        qname = "{http://gtr.rcuk.ac.uk/gtr/api}totalPages"
+        self.assertEqual(
+            split_qname(qname), ("http://gtr.rcuk.ac.uk/gtr/api", "totalPages")
+        )
+        self.assertIs(split_qname(qname), split_qname(qname))
+        self.assertEqual(split_qname("{a}{b}c"), ("a}{b", "c"))
+        self.assertEqual(split_qname("{}local"), ("", "local"))
+        self.assertEqual(split_qname("local"), ("", "local"))
+
+    def test_extract_data_recursive(self):
+        import xml.etree.ElementTree as ET
+
+        project = ET.fromstring(
+            '<project xmlns="http://gtr"><title>Title</title><title>Title</title>'
+            "<cost><item>12</item></cost><empty/>"
+            "<topics><topic><text>AI</text></topic><topic><text>ML</text></topic>"
+            "</topics><links><link><id>a</id></link><link><id>b</id></link></links>"
+            "</project>"
+        )
+        row = {}
+        extract_data_recursive(project, row)
+        self.assertEqual(
+            row,
+            {
+                "title": "Title",
+                "cost": 12,
+                "topics": {"topic": [{"text": "AI"}, {"text": "ML"}]},
+                "links": {"link": [{"id": "a"}, {"id": "b"}]},
+            },
+        )
+
+    def test_extract_data_recursive_is_not_depth_limited(self):
+        import sys
+        import xml.etree.ElementTree as ET
+
+        depth = sys.getrecursionlimit() + 100
+        project = ET.Element("{http://gtr}project")
+        parent = project
+        for _ in range(depth):
+            parent = ET.SubElement(parent, "{http://gtr}nested")
+        parent.text = "bottom"
+        row = {}
+        extract_data_recursive(project, row)
+        for _ in range(depth - 1):
+            row = row["nested"]
+        self.assertEqual(row, {"nested": "bottom"})
+
+    def test_is_duplicate_row(self):
+        self.assertTrue(is_duplicate_row({"a": 1, "b": [2]}, {"b": [2], "a": 1}))
+        self.assertTrue(is_duplicate_row("text", "text"))
+        self.assertFalse(is_duplicate_row({"a": 1}, {"a": 2}))
+        self.assertFalse(is_duplicate_row({"a": 1}, [{"a": 1}]))
+        self.assertFalse(is_duplicate_row("1", 1))
+        self.assertTrue(is_duplicate_row({"a": 1}, {"a": 1.0}))
+        self.assertFalse(is_duplicate_row({"a": 1}, {"a": "1"}))
+
     def test_TypeDict(self):
         data = TypeDict()
         self.assertTrue(isinstance(data, dict))
@@ -103,6 +223,66 @@ class TestGtr(TestCase):
         self.assertEqual(data["one"], 1)
         self.assertEqual(data["one_point"], 1.0)
 
+    def test_TypeDict_learns_schema(self):
+        schema = {}
+        data = TypeDict(schema=schema)
+        data["greeting"] = "hello"
+        data["one"] = "1"
+        data["one_point"] = "1."
+        data["nil_value"] = {"nil": "true"}
+        self.assertEqual(
+            schema, {"greeting": "str", "one": "int", "one_point": "float"}
+        )
+        self.assertEqual(
+            data, {"greeting": "hello", "one": 1, "one_point": 1.0, "nil_value": None}
+        )
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.infer_and_cast")
+    def test_TypeDict_casts_known_fields_without_inference(self, mocked_infer):
+        data = TypeDict(schema={"cost": "int", "code": "str"})
+        data["cost"] = "12"
+        data["code"] = "0123"
+        mocked_infer.assert_not_called()
+        self.assertEqual(data, {"cost": 12, "code": "0123"})
+
+    def test_TypeDict_widens_schema(self):
+        schema = {"cost": "int", "ref": "int"}
+        data = TypeDict(schema=schema)
+        data["cost"] = "12.5"
+        data["ref"] = "A12"
+        self.assertEqual(schema, {"cost": "float", "ref": "str"})
+        self.assertEqual(data, {"cost": 12.5, "ref": "A12"})
+
+    def test_TypeDict_matches_inference_without_schema(self):
+        schema = {"cost": "int", "grant": "float"}
+        data = TypeDict(schema=schema)
+        for cost, grant in (("10", "13"), ("", ""), ("20", "13.5")):
+            data["cost"], data["grant"] = cost, grant
+            unlearned = TypeDict()
+            unlearned["cost"], unlearned["grant"] = cost, grant
+            self.assertEqual(data, unlearned)
+            self.assertEqual(
+                {k: type(v) for k, v in data.items()},
+                {k: type(v) for k, v in unlearned.items()},
+            )
+            if not cost:
+                self.assertEqual(data, {"cost": "", "grant": ""})
+        # Blank values are kept as they are, rather than being a conflict
+        self.assertEqual(schema, {"cost": "int", "grant": "float"})
+        self.assertEqual(data, {"cost": 20, "grant": 13.5})
+
+    def test_FieldSchema_round_trip(self):
+        import os
+        import tempfile
+
+        schema = FieldSchema()
+        TypeDict(schema=schema["project"])["cost"] = "12"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "schema.json")
+            schema.save(path)
+            self.assertEqual(FieldSchema(path)["project"], {"cost": "int"})
+        self.assertEqual(FieldSchema(path)["project"], {})
+
     def test_deduplicate_participants(self):
         data = {
             "participant": [
@@ -122,6 +302,65 @@ class TestGtr(TestCase):
         self.assertIn("id", data["participant"][0])
         self.assertIn("organisation_id", data["participant"][0])
 
+    def test_deduplicate_participants_enriches_organisations(self):
+        data = {
+            "participant": [
+                {
+                    "organisationId": org_id,
+                    "projectCost": cost,
+                    "grantOffer": cost / 2,
+                    "project_id": project_id,
+                    "role": "LEAD_PARTICIPANT_ORG",
+                    "organisationName": "Nesta",
+                }
+                for org_id, project_id, cost in (("o1", "p1", 10), ("o1", "p2", 20))
+            ],
+            "organisations": [
+                {"id": "o1", "project_id": "p2"},
+                {"id": "o1", "project_id": "p1"},
+                {"id": "o1"},
+                {"id": "o2", "project_id": "p1"},
+            ],
+        }
+        deduplicate_participants(data)
+        self.assertEqual(
+            data["organisations"],
+            [
+                {"id": "o1", "project_id": "p2", "projectCost": 20, "grantOffer": 10},
+                {"id": "o1", "project_id": "p1", "projectCost": 10, "grantOffer": 5},
+                {"id": "o1", "projectCost": 10, "grantOffer": 5},
+                {"id": "o2", "project_id": "p1"},
+            ],
+        )
+
+    def test_participant_costs_are_merged_in_columnar_batches(self):
+        index = None
+        for batch in (
+            {"organisation_id": ["o1"], "project_id": ["p1"], "projectCost": [10]},
+            pd.DataFrame({"organisation_id": ["o2"], "project_id": ["p1"]}),
+        ):
+            index = index_participant_costs(batch, index)
+        self.assertEqual(
+            index,
+            {
+                ("o1", "p1"): (10, None),
+                ("o1", None): (10, None),
+                ("o2", "p1"): (None, None),
+                ("o2", None): (None, None),
+            },
+        )
+        organisations = pd.DataFrame(
+            {"id": ["o2", "o1", "o3"], "name": ["a", "b", "c"]}
+        )
+        enrich_organisations(organisations, index)
+        self.assertEqual(organisations.loc[1, "projectCost"], 10)
+        self.assertEqual(
+            organisations["projectCost"].isna().tolist(), [True, False, True]
+        )
+        columns = enrich_organisations({"id": ["o1"], "project_id": ["p1"]}, index)
+        self.assertEqual(columns["projectCost"], [10])
+        self.assertEqual(columns["grantOffer"], [None])
+
     def test_unpack_funding(self):
         row = {
             "money_stuff": {"currencyCode": "GBP", "value": 20},
@@ -151,10 +390,653 @@ class TestGtr(TestCase):
         self.assertIn("topic", data)
         self.assertNotIn("percentage", data["topic"][0])
 
+    def test_topics_are_flagged_during_extraction(self):
+        import xml.etree.ElementTree as ET
+
+        project = ET.fromstring(
+            '<project xmlns="http://gtr"><id>1</id>'
+            "<researchTopics><researchTopic><id>t</id><text>AI</text>"
+            "<percentage>100</percentage></researchTopic></researchTopics>"
+            "<others><other><id>o</id><name>X</name></other></others>"
+            "</project>"
+        )
+        _, row = extract_data(project)
+        extract_data_recursive(project, row)
+        self.assertTrue(row.has_text)
+        self.assertTrue(row["researchTopics"].has_text)
+        self.assertFalse(row["others"].has_text)
+        self.assertFalse(TypeDict({"a": {"b": 1}}).has_text)
+        self.assertTrue(TypeDict({"a": [{"text": 1}]}).has_text)
+
+        from collections import defaultdict
+
+        data = defaultdict(list)
+        with mock.patch(
+            "nesta_daps.flows.datasets.gtr.gtr_utils.contains_key"
+        ) as mocked:
+            unpack_list_data(row, data)
+        mocked.assert_not_called()
+        self.assertEqual(
+            data["topic"],
+            [{"id": "t", "text": "AI", "project_id": 1, "topic_type": "researchTopic"}],
+        )
+
     def test_read_xml_from_url(self):
         read_xml_from_url("https://gtr.ukri.org/gtr/api/projects")
 
 
+GTR_PAGE = (
+    '<ns2:projects xmlns:ns1="http://gtr.rcuk.ac.uk/gtr/api" '
+    'xmlns:ns2="http://gtr.rcuk.ac.uk/gtr/api/project" '
+    'ns1:page="{page}" ns1:size="2" ns1:totalPages="{total_pages}">'
+    '<ns2:project ns1:id="{page}-a"><ns2:title>A {page}</ns2:title></ns2:project>'
+    '<ns2:project ns1:id="{page}-b"><ns2:title>B {page}</ns2:title></ns2:project>'
+    "</ns2:projects>"
+)
+
+
+class GtrStandIn(BaseHTTPRequestHandler):
+    """Local stand-in for the GtR API, serving canned pages of projects"""
+
+    total_pages = 5
+    latency = 0.05
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    requested = []
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        page = int(parse_qs(urlparse(self.path).query)["p"][0])
+        cls.requested.append(page)
+        time.sleep(cls.latency)
+        body = GTR_PAGE.format(page=page, total_pages=cls.total_pages).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with cls.lock:
+            cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gtr_stand_in():
+    handler = type("Handler", (GtrStandIn,), {"requested": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{server.server_port}/gtr/api/projects"
+    server.shutdown()
+    server.server_close()
+
+
+class TestFetchPages:
+    def test_fetch_pages_yields_every_page(self, gtr_stand_in):
+        _, url = gtr_stand_in
+        pages = dict(fetch_pages(range(1, 6), page_size=2, url=url))
+        assert sorted(pages) == [1, 2, 3, 4, 5]
+        for page, et in pages.items():
+            assert et.attrib["{http://gtr.rcuk.ac.uk/gtr/api}page"] == str(page)
+
+    def test_fetch_pages_bounds_requests_in_flight(self, gtr_stand_in):
+        handler, url = gtr_stand_in
+        list(fetch_pages(range(1, 6), page_size=2, max_in_flight=2, url=url))
+        assert sorted(handler.requested) == [1, 2, 3, 4, 5]
+        assert handler.max_in_flight <= 2
+
+    def test_fetch_pages_applies_politeness_delay(self, gtr_stand_in):
+        _, url = gtr_stand_in
+        start = time.monotonic()
+        list(fetch_pages(range(1, 4), max_in_flight=3, delay=0.1, url=url))
+        assert time.monotonic() - start >= 0.2
+
+    def test_response_cache_is_read_first(self, gtr_stand_in, tmp_path):
+        handler, url = gtr_stand_in
+        set_response_cache(ResponseCache(tmp_path / "responses.db"))
+        try:
+            first = read_xml_from_url(url, p=1, s=2)
+            second = read_xml_from_url(url, p=1, s=2)
+        finally:
+            set_response_cache(None)
+        assert handler.requested == [1]
+        assert first.attrib == second.attrib
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.get_session")
+    def test_malformed_responses_are_not_cached(self, mocked_session, tmp_path):
+        mocked_session().get().text = "<ns2:projects><ns2:proj"
+        cache = ResponseCache(tmp_path / "responses.db")
+        set_response_cache(cache)
+        try:
+            with pytest.raises(ParseError):
+                read_xml_from_url("https://gtr.ukri.org/gtr/api/projects", p=1)
+        finally:
+            set_response_cache(None)
+        assert len(cache) == 0
+
+    def test_fetch_projects_yields_project_elements(self, gtr_stand_in):
+        _, url = gtr_stand_in
+        projects = list(fetch_projects(range(1, 4), page_size=2, url=url))
+        ids = sorted(p.attrib["{http://gtr.rcuk.ac.uk/gtr/api}id"] for p in projects)
+        assert ids == ["1-a", "1-b", "2-a", "2-b", "3-a", "3-b"]
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.read_xml_from_url")
+    def test_failed_pages_are_retried_at_the_back(self, mocked_read):
+        requested = []
+
+        def read(url, p, s):
+            requested.append(p)
+            if p == 2 and requested.count(2) == 1:
+                raise ConnectionError
+            return p
+
+        mocked_read.side_effect = read
+        pages = list(fetch_pages(range(1, 5), max_in_flight=1))
+        assert pages == [(1, 1), (3, 3), (4, 4), (2, 2)]
+        assert requested == [1, 2, 3, 4, 2]
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.read_xml_from_url")
+    def test_failed_pages_are_raised_after_the_others(self, mocked_read):
+        requested = []
+
+        def read(url, p, s):
+            requested.append(p)
+            if p == 2:
+                raise ConnectionError
+            return p
+
+        mocked_read.side_effect = read
+        pages = []
+        with pytest.raises(FailedPagesError) as excinfo:
+            for page, _ in fetch_pages(range(1, 5), max_page_attempts=3):
+                pages.append(page)
+        assert sorted(pages) == [1, 3, 4]
+        assert requested.count(2) == 3
+        assert list(excinfo.value.pages) == [2]
+
+
+class TestStreamProjectRows:
+    def test_rows_match_full_tree_extraction(self, gtr_stand_in):
+        _, url = gtr_stand_in
+        expected = []
+        for project in read_xml_from_url(url, p=2, s=2):
+            _, row = extract_data(project)
+            extract_data_recursive(project, row)
+            expected.append(row)
+        rows = list(stream_project_rows(url, p=2, s=2))
+        assert rows == expected
+        assert rows == [
+            {"id": "2-a", "title": "A 2"},
+            {"id": "2-b", "title": "B 2"},
+        ]
+
+    def test_rows_are_yielded_one_at_a_time(self, gtr_stand_in):
+        _, url = gtr_stand_in
+        rows = stream_project_rows(url, p=1, s=2)
+        assert next(rows) == {"id": "1-a", "title": "A 1"}
+        assert next(rows) == {"id": "1-b", "title": "B 1"}
+        with pytest.raises(StopIteration):
+            next(rows)
+
+    def test_rows_are_streamed_from_response_cache(self, gtr_stand_in, tmp_path):
+        handler, url = gtr_stand_in
+        set_response_cache(ResponseCache(tmp_path / "responses.db"))
+        try:
+            read_xml_from_url(url, p=3, s=2)
+            rows = list(stream_project_rows(url, p=3, s=2))
+        finally:
+            set_response_cache(None)
+        assert handler.requested == [3]
+        assert [row["id"] for row in rows] == ["3-a", "3-b"]
+
+
+class TestColumnarSink:
+    def test_rows_are_flushed_in_batches(self, tmp_path):
+        with ColumnarSink(tmp_path, batch_size=2) as data:
+            data["projects"].append({"id": "a", "cost": 1})
+            data["projects"].append({"id": "b", "title": "B"})
+            assert len(list((tmp_path / "projects").iterdir())) == 1
+            data["projects"].append({"id": "c", "cost": {"value": 2}})
+        parts = sorted((tmp_path / "projects").iterdir())
+        assert [p.name for p in parts] == ["part-00000.parquet", "part-00001.parquet"]
+        # The cost in the second batch widens the column to strings in both parts
+        assert pq.read_table(parts[0]).to_pylist() == [
+            {"id": "a", "cost": "1", "title": None},
+            {"id": "b", "cost": None, "title": "B"},
+        ]
+        assert pq.read_table(parts[1]).to_pylist() == [
+            {"id": "c", "cost": '{"value": 2}', "title": None}
+        ]
+        assert data.tables["projects"].n_rows == 3
+
+    def test_parts_share_one_schema(self, tmp_path):
+        rows = [
+            {"id": "a", "v": 1, "cost": 1},
+            {"id": "b", "v": 2, "cost": None},
+            {"id": "c", "v": "x", "cost": 2.5},
+            {"id": "d", "v": 3, "cost": 3, "extra": None},
+            {"id": "e", "extra": "E"},
+        ]
+        with ColumnarSink(tmp_path, batch_size=1) as data:
+            for row in rows:
+                data["funds"].append(row)
+        parts = sorted((tmp_path / "funds").iterdir())
+        assert len({pq.read_schema(p) for p in parts}) == 1
+        table = pq.read_table(tmp_path / "funds")
+        assert table.schema.types == [
+            pa.string(),
+            pa.string(),
+            pa.float64(),
+            pa.string(),
+        ]
+        assert table.sort_by("id").to_pylist() == [
+            {"id": "a", "v": "1", "cost": 1.0, "extra": None},
+            {"id": "b", "v": "2", "cost": None, "extra": None},
+            {"id": "c", "v": "x", "cost": 2.5, "extra": None},
+            {"id": "d", "v": "3", "cost": 3.0, "extra": None},
+            {"id": "e", "v": None, "cost": None, "extra": "E"},
+        ]
+
+    def test_stale_parts_are_replaced(self, tmp_path):
+        with ColumnarSink(tmp_path, batch_size=1) as data:
+            data["projects"].append({"id": "a"})
+            data["projects"].append({"id": "b"})
+            data["persons"].append({"id": "x"})
+        # A later (e.g. delta) run with no rows for some tables
+        with ColumnarSink(tmp_path, batch_size=1) as data:
+            data["projects"].append({"id": "c"})
+        parts = sorted((tmp_path / "projects").iterdir())
+        assert [pq.read_table(p).to_pylist() for p in parts] == [[{"id": "c"}]]
+        assert list((tmp_path / "persons").iterdir()) == []
+
+    def test_mixed_types_fall_back_to_strings(self, tmp_path):
+        with ColumnarSink(tmp_path) as data:
+            data["funds"].append({"value": 1})
+            data["funds"].append({"value": "unknown"})
+        table = pq.read_table(tmp_path / "funds" / "part-00000.parquet")
+        assert table.to_pylist() == [{"value": "1"}, {"value": "unknown"}]
+
+    def test_links_are_appended_column_wise(self, tmp_path):
+        fields = {"link_table": LINK_FIELDS}
+        with ColumnarSink(tmp_path, batch_size=3, fields=fields) as data:
+            data["link_table"].append(("p1", "LEAD_ORG", "o1", "gtr_organisations"))
+            data["link_table"].append({"project_id": "p1", "id": "t1", "extra": 1})
+            data["link_table"].append(("p2", "TOPIC", "t2", "gtr_topic"))
+            data["link_table"].append(("p3", "TOPIC", "t3", "gtr_topic"))
+        table = pq.read_table(tmp_path / "link_table")
+        assert table.to_pylist() == [
+            {
+                "project_id": "p1",
+                "rel": "LEAD_ORG",
+                "id": "o1",
+                "table_name": "gtr_organisations",
+                "extra": None,
+            },
+            {
+                "project_id": "p1",
+                "rel": None,
+                "id": "t1",
+                "table_name": None,
+                "extra": 1,
+            },
+            {
+                "project_id": "p2",
+                "rel": "TOPIC",
+                "id": "t2",
+                "table_name": "gtr_topic",
+                "extra": None,
+            },
+            {
+                "project_id": "p3",
+                "rel": "TOPIC",
+                "id": "t3",
+                "table_name": "gtr_topic",
+                "extra": None,
+            },
+        ]
+
+    def test_list_data_and_links_are_unpacked_into_sink(self, tmp_path):
+        row = {
+            "id": "p1",
+            "links": {"link": [{"entity": "persons", "rel": "PI_PER", "id": "x"}]},
+            "participantValues": {
+                "participant": [
+                    {
+                        "organisationId": "o1",
+                        "organisationName": "Nesta",
+                        "role": "LEAD",
+                        "projectCost": 10,
+                    }
+                ]
+            },
+        }
+        with ColumnarSink(
+            tmp_path, preprocess=split_link_row, fields={"link_table": LINK_FIELDS}
+        ) as data:
+            unpack_list_data(row, data)
+
+        def read(table):
+            return pq.read_table(tmp_path / table).to_pylist()
+
+        assert read("persons") == [{"id": "x"}]
+        assert read("participant") == [
+            {"projectCost": 10, "id": "o1p1", "organisation_id": "o1"}
+        ]
+        assert read("link_table") == [
+            {
+                "project_id": "p1",
+                "rel": "PI_PER",
+                "id": "x",
+                "table_name": "gtr_persons",
+            },
+            {
+                "project_id": "p1",
+                "rel": "LEAD",
+                "id": "o1p1",
+                "table_name": "gtr_participant",
+            },
+        ]
+
+    def test_organisations_are_enriched_in_sink(self, tmp_path):
+        def project(project_id, cost):
+            return {
+                "id": project_id,
+                "links": {
+                    "link": [{"entity": "organisations", "rel": "LEAD_ORG", "id": "o1"}]
+                },
+                "participantValues": {
+                    "participant": [
+                        {
+                            "organisationId": "o1",
+                            "organisationName": "Nesta",
+                            "role": "LEAD",
+                            "projectCost": cost,
+                        }
+                    ]
+                },
+                "entity": "projects",
+            }
+
+        with ColumnarSink(
+            tmp_path,
+            preprocess=OrganisationEnricher(),
+            fields={"link_table": LINK_FIELDS},
+        ) as data:
+            for row in (project("p1", 10), project("p2", 20)):
+                unpack_list_data(row, data)
+                data[row.pop("entity")].append(row)
+        organisations = pq.read_table(tmp_path / "organisations").to_pylist()
+        assert organisations == [
+            {"id": "o1", "projectCost": 10, "grantOffer": None},
+            {"id": "o1", "projectCost": 20, "grantOffer": None},
+        ]
+        assert [
+            row["id"] for row in pq.read_table(tmp_path / "participant").to_pylist()
+        ] == ["o1p1", "o1p2"]
+
+
+def make_project(project_id, title, org_name):
+    import xml.etree.ElementTree as ET
+
+    return ET.fromstring(
+        '<ns2:project xmlns:ns1="http://gtr.rcuk.ac.uk/gtr/api" '
+        'xmlns:ns2="http://gtr.rcuk.ac.uk/gtr/api/project" '
+        f'ns1:id="{project_id}" '
+        f'ns1:href="https://gtr.ukri.org:443/gtr/api/projects/{project_id}">'
+        f"<ns2:title>{title}</ns2:title><ns1:links><ns1:link "
+        'ns1:href="https://gtr.ukri.org:443/gtr/api/organisations/o1" '
+        f'ns1:rel="LEAD_ORG"/></ns1:links><ns2:org>{org_name}</ns2:org>'
+        "</ns2:project>"
+    )
+
+
+class TestDeltaCrawl:
+    @staticmethod
+    def crawl(path, projects):
+        from collections import defaultdict
+
+        upserts = defaultdict(list)
+        data = DeltaCrawl(path, upserts, preprocess=split_link_row)
+        for project in projects:
+            if data.is_changed(project):
+                extract_project(project, data)
+        return upserts, data.close()
+
+    @mock.patch(
+        "nesta_daps.flows.datasets.gtr.gtr_utils.ENTITY_CACHE", new_callable=EntityCache
+    )
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.extract_link_data")
+    def test_only_changes_are_emitted(self, mocked_extract, cache, tmp_path):
+        mocked_extract.side_effect = lambda url: {"name": url.split("/")[-1]}
+        path = tmp_path / "state.json"
+        first = [
+            make_project("p1", "One", "Nesta"),
+            make_project("p2", "Two", "Nesta"),
+            make_project("p3", "Three", "Nesta"),
+        ]
+        upserts, deletes = self.crawl(path, first)
+        assert sorted(row["id"] for row in upserts["projects"]) == ["p1", "p2", "p3"]
+        assert [row["id"] for row in upserts["organisations"]] == ["o1"]
+        assert len(upserts["link_table"]) == 3
+        assert deletes == {}
+
+        # p1 is unchanged, p2 has changed and p3 has been removed
+        second = [
+            make_project("p1", "One", "Nesta"),
+            make_project("p2", "Two!", "Nesta"),
+        ]
+        upserts, deletes = self.crawl(path, second)
+        assert [row["id"] for row in upserts["projects"]] == ["p2"]
+        assert upserts["projects"][0]["title"] == "Two!"
+        assert "organisations" not in upserts  # unchanged
+        assert [row[0] for row in upserts["link_table"]] == ["p2"]
+        assert deletes == {"link_table": ["p2", "p3"], "projects": ["p3"]}
+
+        # Nothing has changed
+        upserts, deletes = self.crawl(path, second)
+        assert upserts == {}
+        assert deletes == {}
+
+    def test_participants_of_removed_projects_are_deleted(self, tmp_path):
+        from collections import defaultdict
+
+        def crawl(projects):
+            upserts = defaultdict(list)
+            data = DeltaCrawl(path, upserts, preprocess=split_link_row)
+            for project_id, (digest, org_ids) in projects.items():
+                if data.update(project_id, digest):
+                    for org_id in org_ids:
+                        participant = {
+                            "organisationId": org_id,
+                            "organisationName": org_id.upper(),
+                            "role": "LEAD_PARTICIPANT_ORG",
+                            "project_id": project_id,
+                        }
+                        data["participant"].append(participant)
+            return upserts, data.close()
+
+        path = tmp_path / "state.json"
+        upserts, deletes = crawl({"p1": ("1", ["o1", "o2"]), "p2": ("2", ["o1"])})
+        assert [row["id"] for row in upserts["participant"]] == ["o1p1", "o2p1", "o1p2"]
+        assert deletes == {}
+
+        # o2 drops out of p1, and p2 is removed
+        upserts, deletes = crawl({"p1": ("1!", ["o1"])})
+        assert "participant" not in upserts  # o1p1 is unchanged
+        assert deletes["participant"] == ["o1p2", "o2p1"]
+
+        # o2 rejoins p1, so is upserted again
+        upserts, deletes = crawl({"p1": ("1", ["o1", "o2"])})
+        assert [row["id"] for row in upserts["participant"]] == ["o2p1"]
+        assert "participant" not in deletes
+
+    def test_incomplete_crawls_delete_nothing(self, tmp_path):
+        path = tmp_path / "state.json"
+        data = DeltaCrawl(path, {})
+        data.is_changed(make_project("p1", "One", "Nesta"))
+        data.close()
+        data = DeltaCrawl(path, {})
+        assert data.close(complete=False) == {}
+
+
+@mock.patch(
+    "nesta_daps.flows.datasets.gtr.gtr_utils.ENTITY_CACHE", new_callable=EntityCache
+)
+@mock.patch(
+    "nesta_daps.flows.datasets.gtr.gtr_utils.extract_link_data", return_value={}
+)
+class TestPageManifest:
+    @staticmethod
+    def crawl(path, pages, upserts, crash_after=None):
+        data = PageManifest(path / "pages", DeltaCrawl(path / "state.json", upserts))
+        data.replay()
+        for page in data.pending(pages):
+            if page == crash_after:
+                return None
+            for project in pages[page]:
+                if data.is_changed(project):
+                    extract_project(project, data)
+            data.complete(page)
+        return data.close()
+
+    def test_crawl_resumes_from_completed_pages(self, mocked_extract, cache, tmp_path):
+        from collections import defaultdict
+
+        pages = {
+            1: [make_project("p1", "One", "Nesta"), make_project("p2", "Two", "Nesta")],
+            2: [make_project("p3", "Three", "Nesta")],
+        }
+        upserts = defaultdict(list)
+        assert self.crawl(tmp_path, pages, upserts) == {}
+
+        # p2 changes and p3 vanishes, but the crawl dies before page 2
+        pages = {
+            1: [
+                make_project("p1", "One", "Nesta"),
+                make_project("p2", "Two!", "Nesta"),
+            ],
+            2: [],
+        }
+        upserts = defaultdict(list)
+        assert self.crawl(tmp_path, pages, upserts, crash_after=2) is None
+        data = PageManifest(tmp_path / "pages", DeltaCrawl(None, {}))
+        assert data.pending(pages) == [2]
+
+        # Page 1 is replayed rather than crawled again
+        pages[1] = None
+        upserts = defaultdict(list)
+        deletes = self.crawl(tmp_path, pages, upserts)
+        assert [row["id"] for row in upserts["projects"]] == ["p2"]
+        assert deletes == {"link_table": ["p2", "p3"], "projects": ["p3"]}
+        assert list((tmp_path / "pages").iterdir()) == []
+
+    def test_rows_are_forwarded_in_order(self, mocked_extract, cache, tmp_path):
+        from collections import defaultdict
+
+        def write_page(data):
+            # The first project has no organisations, so the projects table
+            # is seen before the organisations table
+            data["projects"].append({"id": "p0"})
+            data["participant"].append(
+                {
+                    "organisationId": "o1",
+                    "organisationName": "Nesta",
+                    "role": "LEAD_PARTICIPANT_ORG",
+                    "projectCost": 10,
+                    "project_id": "p1",
+                }
+            )
+            data["organisations"].append(
+                {"id": "o1", "project_id": "p1", "rel": "LEAD_ORG"}
+            )
+            data["projects"].append({"id": "p1"})
+            data.complete(1)
+
+        def organisations(upserts):
+            return [(row["id"], row["projectCost"]) for row in upserts["organisations"]]
+
+        upserts = defaultdict(list)
+        delta = DeltaCrawl(None, upserts, preprocess=OrganisationEnricher())
+        write_page(PageManifest(tmp_path / "pages", delta))
+        assert organisations(upserts) == [("o1", 10)]
+        assert len(upserts["link_table"]) == 2
+
+        # Pages are replayed in the same order
+        upserts = defaultdict(list)
+        delta = DeltaCrawl(None, upserts, preprocess=OrganisationEnricher())
+        assert PageManifest(tmp_path / "pages", delta).replay() == 1
+        assert organisations(upserts) == [("o1", 10)]
+
+
+class TestEntityCache:
+    def test_entity_fetched_once(self):
+        cache = EntityCache()
+        fetch = mock.Mock(return_value={"name": "Nesta"})
+        for _ in range(3):
+            assert cache.get(("organisations", "abc"), fetch) == {"name": "Nesta"}
+        assert fetch.call_count == 1
+        assert (cache.hits, cache.misses) == (2, 1)
+        assert cache.hit_rate == pytest.approx(2 / 3)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = EntityCache(maxsize=2)
+        cache.get(("persons", "1"), lambda: {"id": 1})
+        cache.get(("persons", "2"), lambda: {"id": 2})
+        cache.get(("persons", "1"), lambda: {"id": 1})
+        cache.get(("persons", "3"), lambda: {"id": 3})
+        assert ("persons", "1") in cache
+        assert ("persons", "2") not in cache
+        assert len(cache) == 2
+
+    def test_disk_tier_persists_across_instances(self, tmp_path):
+        EntityCache(path=tmp_path).get(("funds", "xyz"), lambda: {"value": 20})
+        cache = EntityCache(path=tmp_path)
+        fetch = mock.Mock()
+        assert cache.get(("funds", "xyz"), fetch) == {"value": 20}
+        fetch.assert_not_called()
+        assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+
+    def test_concurrent_lookups_are_collapsed(self):
+        cache = EntityCache()
+        fetch = mock.Mock(side_effect=lambda: time.sleep(0.05) or {"id": 1})
+        threads = [
+            threading.Thread(target=cache.get, args=(("persons", "1"), fetch))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert fetch.call_count == 1
+
+    @mock.patch(
+        "nesta_daps.flows.datasets.gtr.gtr_utils.ENTITY_CACHE", new_callable=EntityCache
+    )
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.extract_link_data")
+    def test_extract_data_dereferences_each_href_once(self, mocked_extract, cache):
+        import xml.etree.ElementTree as ET
+
+        mocked_extract.return_value = {"name": "Nesta"}
+        link = ET.fromstring(
+            '<ns2:link xmlns:ns2="http://gtr.rcuk.ac.uk/gtr/api" '
+            'ns2:href="https://gtr.ukri.org:443/gtr/api/organisations/abc" '
+            'ns2:rel="LEAD_ORG"/>'
+        )
+        for _ in range(3):
+            _, row = extract_data(link)
+            assert row["name"] == "Nesta"
+            assert row["id"] == "abc"
+            assert row["entity"] == "organisations"
+        assert mocked_extract.call_count == 1
+        assert cache.misses == 1
+
+
 class TestGetOrgsToProcess:
     @pytest.fixture
     def raw_org_data(self):
@@ -209,7 +1091,7 @@ class TestGetOrgsToProcess:
 
 
 class TestGeocoding:
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_correctly_calls_geocoder(self, mocked_geocode):
         mocked_geocode.return_value = {"lat": 111, "lon": 999}
 
@@ -226,7 +1108,7 @@ class TestGeocoding:
             mock.call(postalcode="ABC 123", country="United Kingdom")
         ]
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_returns_results_on_success(self, mocked_geocode):
         mocked_geocode.return_value = {"lat": 111, "lon": 999}
 
@@ -248,7 +1130,7 @@ class TestGeocoding:
             "country": "United Kingdom",
         }
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_returns_empty_fields_when_address_missing(self, mocked_geocode):
         mocked_geocode.return_value = None
         geocoded = geocode_uk_with_postcode({"id": 4})
@@ -256,7 +1138,7 @@ class TestGeocoding:
         mocked_geocode.assert_not_called()
         assert geocoded == {"id": 4, "latitude": None, "longitude": None}
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_returns_empty_fields_when_postcode_missing(self, mocked_geocode):
         mocked_geocode.return_value = None
         geocoded = geocode_uk_with_postcode({"id": 3, "line1": "my road"})
@@ -269,7 +1151,7 @@ class TestGeocoding:
             "longitude": None,
         }
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_returns_empty_fields_when_outside_uk(self, mocked_geocode):
         mocked_geocode.return_value = None
         geocoded = geocode_uk_with_postcode(
@@ -285,7 +1167,7 @@ class TestGeocoding:
             "longitude": None,
         }
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_returns_empty_fields_when_geocode_fails(self, mocked_geocode):
         mocked_geocode.return_value = None
         geocoded = geocode_uk_with_postcode(
@@ -303,7 +1185,7 @@ class TestGeocoding:
             "longitude": None,
         }
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data._geocode")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
     def test_geocode_overwrites_country_on_successful_geocode(self, mocked_geocode):
         mocked_geocode.return_value = {"lat": 111, "lon": 999}
         geocoded = geocode_uk_with_postcode(
@@ -320,6 +1202,101 @@ class TestGeocoding:
         }
 
 
+@mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
+def test_geocode_uk_with_postcode_index_falls_back(mocked_geocode):
+    mocked_geocode.return_value = {"lat": 111, "lon": 999}
+    index = mock.Mock()
+    index.lookup.side_effect = [{"lat": 1, "lon": 2}, None]
+
+    found = geocode_uk_with_postcode({"postCode": "ABC 123"}, postcode_index=index)
+    missed = geocode_uk_with_postcode({"postCode": "AA 456"}, postcode_index=index)
+
+    assert (found["latitude"], found["longitude"]) == (1, 2)
+    assert (missed["latitude"], missed["longitude"]) == (111, 999)
+    assert mocked_geocode.mock_calls == [
+        mock.call(postalcode="AA 456", country="United Kingdom")
+    ]
+
+
+class TestOrgGeocoder:
+    def test_normalise_postcode(self):
+        assert normalise_postcode(" ec4a3bf ") == "EC4A 3BF"
+        assert normalise_postcode("EC4A  3BF") == "EC4A 3BF"
+        assert normalise_postcode("m1 1ae") == "M1 1AE"
+        assert normalise_postcode("abc") == "ABC"
+        assert normalise_postcode("  ") is None
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
+    def test_each_postcode_is_geocoded_once(self, mocked_geocode):
+        mocked_geocode.side_effect = lambda postalcode, country: (
+            None if postalcode == "AA1 456" else {"lat": 1, "lon": 2}
+        )
+        orgs = [
+            {"id": 0, "postCode": "ec4a 3bf"},
+            {"id": 1, "postCode": "AA1 456", "country": "France"},
+            {"id": 2, "postCode": "EC4A3BF", "country": "UK"},
+            {"id": 3, "postCode": "EC4A 3BF", "region": "Outside UK"},
+            {"id": 4},
+            {"id": 5, "postCode": "aa1456"},
+        ]
+        geocoder = OrgGeocoder()
+        batches = list(geocoder.geocode_batches(orgs, batch_size=4))
+
+        assert [len(batch) for batch in batches] == [4, 2]
+        assert mocked_geocode.mock_calls == [
+            mock.call(postalcode="EC4A 3BF", country="United Kingdom"),
+            mock.call(postalcode="AA1 456", country="United Kingdom"),
+        ]
+        uk = {"latitude": 1, "longitude": 2, "country": "United Kingdom"}
+        missing = {"latitude": None, "longitude": None}
+        assert orgs == [
+            {"id": 0, "postCode": "ec4a 3bf", **uk},
+            {"id": 1, "postCode": "AA1 456", "country": "France", **missing},
+            {"id": 2, "postCode": "EC4A3BF", **uk},
+            {"id": 3, "postCode": "EC4A 3BF", "region": "Outside UK", **missing},
+            {"id": 4, **missing},
+            {"id": 5, "postCode": "aa1456", **missing},
+        ]
+        assert geocoder.n_orgs == 6
+        assert len(geocoder.postcodes) == 2
+        assert geocoder.rate > 0
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
+    def test_batches_match_geocoding_one_at_a_time(self, mocked_geocode):
+        mocked_geocode.return_value = {"lat": 111, "lon": 999}
+        orgs = [
+            {"id": 0, "postCode": "ABC 123", "country": "United Kingdom"},
+            {"id": 1, "region": "London", "postCode": "AA 456"},
+            {"id": 2, "city": "Paris", "region": "Outside UK"},
+            {"id": 3, "line1": "my road"},
+        ]
+        expected = [geocode_uk_with_postcode(dict(org)) for org in orgs]
+        assert OrgGeocoder().geocode_batch(orgs) == expected
+
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils._geocode")
+    def test_postcode_index_is_tried_first(self, mocked_geocode):
+        mocked_geocode.return_value = {"lat": 111, "lon": 999}
+        index = mock.Mock()
+        index.lookup.side_effect = lambda postcode: (
+            {"lat": 1, "lon": 2} if postcode == "EC4A 3BF" else None
+        )
+        orgs = [
+            {"id": 0, "postCode": "ec4a3bf"},
+            {"id": 1, "postCode": "AA1 456"},
+            {"id": 2, "postCode": "EC4A 3BF"},
+        ]
+        OrgGeocoder(postcode_index=index).geocode_batch(orgs)
+
+        assert mocked_geocode.mock_calls == [
+            mock.call(postalcode="AA1 456", country="United Kingdom")
+        ]
+        assert [(org["latitude"], org["longitude"]) for org in orgs] == [
+            (1, 2),
+            (111, 999),
+            (1, 2),
+        ]
+
+
 class TestAddCountryDetails:
     @pytest.fixture
     def continent_map(self):
@@ -337,8 +1314,8 @@ class TestAddCountryDetails:
 
         return _iso_codes
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_properly_calls_iso_coding(
         self, mocked_iso_code, mocked_continent
     ):
@@ -346,8 +1323,8 @@ class TestAddCountryDetails:
 
         assert mocked_iso_code.mock_calls == [mock.call("United Kingdom")]
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_correctly_applies_continent(
         self, mocked_iso_code, mocked_continent, continent_map, iso_codes
     ):
@@ -359,8 +1336,8 @@ class TestAddCountryDetails:
 
         assert coded_country["continent"] == "EU"
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_correctly_applies_iso_codes_uk(
         self, mocked_iso_code, mocked_continent, iso_codes
     ):
@@ -374,8 +1351,8 @@ class TestAddCountryDetails:
         assert coded_country["country_name"] == "United Kingdom"
         assert coded_country["country_numeric"] == "826"
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_correctly_applies_iso_codes_non_uk(
         self, mocked_iso_code, mocked_continent, iso_codes
     ):
@@ -389,8 +1366,8 @@ class TestAddCountryDetails:
         assert coded_country["country_name"] == "France"
         assert coded_country["country_numeric"] == "250"
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_returns_empty_fields_for_failed_country_lookup(
         self, mocked_iso_code, mocked_continent
     ):
@@ -403,8 +1380,8 @@ class TestAddCountryDetails:
         assert coded_country["country_numeric"] is None
         assert coded_country["continent"] is None
 
-    @mock.patch("nesta.packages.gtr.get_gtr_data.alpha2_to_continent_mapping")
-    @mock.patch("nesta.packages.gtr.get_gtr_data.country_iso_code")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.alpha2_to_continent_mapping")
+    @mock.patch("nesta_daps.flows.datasets.gtr.gtr_utils.country_iso_code")
     def test_add_country_details_returns_empty_fields_when_no_country(
         self, mocked_iso_code, mocked_continent
     ):